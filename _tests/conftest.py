@@ -12,6 +12,12 @@ import pytest
 import requests
 
 from app.core.prometheus.config import PrometheusConfig
+from app.core.prometheus.metrics import get_metric_registry
+
+
+def value(name, labels=None):
+    """A sample of the shared metric registry, 0.0 when it doesn't exist yet."""
+    return get_metric_registry().get_sample_value(name, labels or {}) or 0.0
 
 
 @pytest.fixture(scope="module")
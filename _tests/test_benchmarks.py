@@ -0,0 +1,313 @@
+"""
+Instrumentation Micro-benchmarks
+
+Tests:
+- Per-request overhead of the ASGI middleware vs the BaseHTTPMiddleware version
+- Route template lookup cost with a large route table
+- Bound children vs .labels() per observation
+- Buffered vs direct recording under thread contention
+- Cached incremental exposition vs full render with many series
+- Binary snapshot + delta vs text render + parse
+- Per-task overhead of the Celery signal instrumentation (eager mode)
+- Per-command overhead of the instrumented cache client wrapper
+"""
+
+import asyncio
+import threading
+import time
+
+import pytest
+from prometheus_client import CollectorRegistry, Counter, generate_latest
+from prometheus_client.parser import text_string_to_metric_families
+from starlette.applications import Starlette
+from starlette.middleware import Middleware
+from starlette.middleware.base import BaseHTTPMiddleware
+from starlette.responses import PlainTextResponse
+from starlette.routing import Match, Route
+
+from app.core.prometheus.cache_instrumentation import InstrumentedCache
+from app.core.prometheus.celery_instrumentation import CeleryInstrumentation
+from app.core.prometheus.exposition import MetricsExposition
+from app.core.prometheus.metrics import bind, get_request_count, get_request_latency
+from app.core.prometheus.middleware import PrometheusMiddleware
+from app.core.prometheus.recorder import BufferedRecorder, DirectRecorder
+from app.core.prometheus.route_resolver import RouteResolver
+from app.core.prometheus.snapshot import diff_snapshots, take_snapshot
+
+ITERATIONS = 2000
+
+
+class LegacyPrometheusMiddleware(BaseHTTPMiddleware):
+    """The previous ``call_next`` based implementation, kept as a baseline."""
+
+    async def dispatch(self, request, call_next):
+        method = request.method
+        endpoint = request.url.path
+        for route in request.app.routes:
+            match, _ = route.matches(request.scope)
+            if match == Match.FULL:
+                endpoint = route.path
+                break
+        start_time = time.time()
+        status = 500
+        try:
+            response = await call_next(request)
+            status = response.status_code
+        finally:
+            elapsed = time.time() - start_time
+            get_request_count().labels(method, endpoint, status).inc()
+            get_request_latency().labels(method, endpoint, status).observe(elapsed)
+        return response
+
+
+async def homepage(request):
+    return PlainTextResponse("ok")
+
+
+def build_app(middleware_class):
+    return Starlette(
+        routes=[Route("/bench/{item_id}", homepage)],
+        middleware=[Middleware(middleware_class)],
+    )
+
+
+def time_requests(app, iterations=ITERATIONS):
+    """Drive the ASGI app directly and return the mean seconds per request."""
+    scope = {
+        "type": "http",
+        "asgi": {"version": "3.0"},
+        "http_version": "1.1",
+        "method": "GET",
+        "scheme": "http",
+        "path": "/bench/1",
+        "raw_path": b"/bench/1",
+        "root_path": "",
+        "query_string": b"",
+        "headers": [],
+        "server": ("testserver", 80),
+        "client": ("testclient", 50000),
+    }
+
+    async def receive():
+        return {"type": "http.request", "body": b"", "more_body": False}
+
+    async def send(message):
+        pass
+
+    async def run():
+        for _ in range(100):
+            await app(dict(scope), receive, send)
+        start = time.perf_counter()
+        for _ in range(iterations):
+            await app(dict(scope), receive, send)
+        return (time.perf_counter() - start) / iterations
+
+    return asyncio.run(run())
+
+
+@pytest.mark.performance
+def test_asgi_middleware_overhead():
+    """Verify the ASGI middleware is cheaper per request than BaseHTTPMiddleware"""
+    legacy = time_requests(build_app(LegacyPrometheusMiddleware))
+    current = time_requests(build_app(PrometheusMiddleware))
+
+    print(f"\nBaseHTTPMiddleware: {legacy * 1e6:.1f}us/request")
+    print(f"ASGI middleware:    {current * 1e6:.1f}us/request")
+    assert current < legacy, "ASGI middleware should be faster than BaseHTTPMiddleware"
+
+
+@pytest.mark.performance
+def test_route_resolver_lookup_cost():
+    """Verify cached template lookups beat walking every route per request"""
+    app = Starlette(routes=[Route(f"/resource{i}/{{item_id}}", homepage) for i in range(200)])
+    scope = {"type": "http", "method": "GET", "path": "/resource199/7", "root_path": ""}
+    resolver = RouteResolver(app)
+
+    start = time.perf_counter()
+    for _ in range(ITERATIONS):
+        for route in app.routes:
+            match, _ = route.matches(scope)
+            if match == Match.FULL:
+                break
+    linear = (time.perf_counter() - start) / ITERATIONS
+
+    start = time.perf_counter()
+    for _ in range(ITERATIONS):
+        resolver.resolve_scope(scope)
+    cached = (time.perf_counter() - start) / ITERATIONS
+
+    print(f"\nroute.matches() walk: {linear * 1e6:.2f}us/lookup")
+    print(f"RouteResolver:        {cached * 1e6:.2f}us/lookup")
+    assert cached < linear
+
+
+def time_per_call(fn, iterations=ITERATIONS * 10):
+    start = time.perf_counter()
+    for _ in range(iterations):
+        fn()
+    return (time.perf_counter() - start) / iterations
+
+
+@pytest.mark.performance
+def test_bound_metric_observation_cost():
+    """Verify bound children skip the .labels() lookup cost"""
+    counter = get_request_count()
+    histogram = get_request_latency()
+    bound_counter = bind(counter)
+    bound_histogram = bind(histogram)
+    labels = ("GET", "/bench/{item_id}", 200)
+
+    labelled = time_per_call(lambda: counter.labels(*labels).inc())
+    bound = time_per_call(lambda: bound_counter.child(*labels).inc())
+    labelled_hist = time_per_call(lambda: histogram.labels(*labels).observe(0.01))
+    bound_hist = time_per_call(lambda: bound_histogram.child(*labels).observe(0.01))
+
+    print(f"\nCounter   .labels().inc():      {labelled * 1e9:.0f}ns")
+    print(f"Counter   bound .child().inc(): {bound * 1e9:.0f}ns")
+    print(f"Histogram .labels().observe():  {labelled_hist * 1e9:.0f}ns")
+    print(f"Histogram bound .observe():     {bound_hist * 1e9:.0f}ns")
+    assert bound < labelled
+    assert bound_hist < labelled_hist
+
+
+@pytest.mark.performance
+def test_buffered_recording_cost():
+    """Verify buffered recording is cheaper than direct writes across threads"""
+    child = bind(get_request_latency()).child("GET", "/bench/buffered", 200)
+
+    def run(recorder, threads=8, iterations=ITERATIONS * 5):
+        def work():
+            for _ in range(iterations):
+                recorder.observe(child, 0.01)
+
+        workers = [threading.Thread(target=work) for _ in range(threads)]
+        start = time.perf_counter()
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
+        recorder.flush()
+        return (time.perf_counter() - start) / (threads * iterations)
+
+    direct = run(DirectRecorder())
+    buffered = run(BufferedRecorder())
+
+    print(f"\nDirect observe:   {direct * 1e9:.0f}ns")
+    print(f"Buffered observe: {buffered * 1e9:.0f}ns")
+    assert buffered < direct
+
+
+@pytest.mark.performance
+def test_cached_exposition_cost():
+    """Verify incremental rendering beats a full render when few series change"""
+    registry = CollectorRegistry()
+    counters = [
+        Counter(f"bench_family_{i}", "Benchmark family", ["label"], registry=registry)
+        for i in range(100)
+    ]
+    for counter in counters:
+        for j in range(100):
+            counter.labels(str(j)).inc()
+    exposition = MetricsExposition(registry, ttl=0)
+    exposition.render()
+
+    def scrape():
+        counters[0].labels("0").inc()
+        exposition.render()
+
+    full = time_per_call(lambda: generate_latest(registry), iterations=20)
+    cached = time_per_call(scrape, iterations=20)
+
+    print(f"\nFull render (10k series):   {full * 1e3:.2f}ms")
+    print(f"Incremental render:         {cached * 1e3:.2f}ms")
+    assert cached < full
+
+
+@pytest.mark.performance
+def test_snapshot_delta_cost():
+    """Verify snapshot + delta + encode beats capturing state through the text format"""
+    registry = CollectorRegistry()
+    counters = [
+        Counter(f"snap_bench_{i}", "Benchmark family", ["label"], registry=registry)
+        for i in range(50)
+    ]
+    for counter in counters:
+        for j in range(100):
+            counter.labels(str(j)).inc()
+    previous = take_snapshot(registry)
+
+    def via_text():
+        list(text_string_to_metric_families(generate_latest(registry).decode()))
+
+    def via_snapshot():
+        diff_snapshots(previous, take_snapshot(registry)).encode()
+
+    text = time_per_call(via_text, iterations=10)
+    binary = time_per_call(via_snapshot, iterations=10)
+
+    print(f"\nText render + parse (5k series): {text * 1e3:.2f}ms")
+    print(f"Snapshot + delta + encode:       {binary * 1e3:.2f}ms")
+    assert binary < text
+
+
+@pytest.mark.performance
+def test_celery_task_overhead():
+    """Measure per-task cost of the signal handlers with Celery's eager mode"""
+    from celery import Celery
+
+    app = Celery("bench", set_as_current=False)
+    app.conf.task_always_eager = True
+
+    @app.task(name="bench.noop")
+    def noop():
+        return None
+
+    baseline = time_per_call(noop.apply, iterations=ITERATIONS)
+    instrumentation = CeleryInstrumentation()
+    instrumentation.install()
+    try:
+        noop.apply()  # bind children outside the measurement
+        instrumented = time_per_call(noop.apply, iterations=ITERATIONS)
+    finally:
+        instrumentation.uninstall()
+
+    overhead = instrumented - baseline
+    print(f"\nEager task (baseline):     {baseline * 1e6:.1f}us")
+    print(f"Eager task (instrumented): {instrumented * 1e6:.1f}us")
+    print(f"Overhead per task:         {overhead * 1e6:.1f}us")
+    assert overhead < baseline
+
+
+class DictCache:
+    """Trivial in-memory client, so the wrapper's cost isn't lost in client noise."""
+
+    def __init__(self):
+        self.data = {"present": b"1"}
+
+    def get(self, key):
+        return self.data.get(key)
+
+
+@pytest.mark.performance
+def test_cache_wrapper_overhead():
+    """Measure per-command cost of the cache wrapper with direct and buffered recording"""
+    fakeredis = pytest.importorskip("fakeredis")
+
+    client = DictCache()
+    cache = InstrumentedCache(client, "bench")
+    fake = fakeredis.FakeRedis()
+
+    baseline = time_per_call(lambda: client.get("present"))
+    cache._recorder = DirectRecorder()
+    direct = time_per_call(lambda: cache.get("present")) - baseline
+    cache._recorder = BufferedRecorder()
+    buffered = time_per_call(lambda: cache.get("present")) - baseline
+    cache._recorder.flush()
+    fake_get = time_per_call(lambda: fake.get("present"), iterations=ITERATIONS)
+
+    print(f"\nDict client GET:              {baseline * 1e9:.0f}ns")
+    print(f"Wrapper overhead (direct):    {direct * 1e9:.0f}ns")
+    print(f"Wrapper overhead (buffered):  {buffered * 1e9:.0f}ns")
+    print(f"In-process fake Redis GET:    {fake_get * 1e9:.0f}ns")
+    assert buffered < direct
+    assert buffered < fake_get / 10
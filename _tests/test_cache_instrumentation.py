@@ -0,0 +1,130 @@
+"""
+Cache Client Instrumentation Tests
+
+Tests:
+- GET results are classified as hit/miss and timed
+- Other commands are counted under their own name
+- MGET counts a hit/miss per key and is timed once
+- Pipelines are timed as one batch with a per-command breakdown
+- Async clients get the async wrapper, pipelines included
+- Uninstrumented attributes pass through to the client
+"""
+
+import asyncio
+
+import pytest
+
+from app.core.prometheus.cache_instrumentation import (
+    InstrumentedAsyncCache,
+    InstrumentedCache,
+    instrument_cache,
+)
+from app.core.prometheus.metrics import get_metric_registry
+
+fakeredis = pytest.importorskip("fakeredis")
+
+
+def count(cache_type, operation):
+    return get_metric_registry().get_sample_value(
+        "cache_operations_total", {"cache_type": cache_type, "operation": operation}
+    ) or 0.0
+
+
+def timed(cache_type, operation):
+    return get_metric_registry().get_sample_value(
+        "cache_operation_duration_seconds_count", {"cache_type": cache_type, "operation": operation}
+    ) or 0.0
+
+
+def test_get_hit_and_miss():
+    """Verify GET counts a hit for a value and a miss for None, timing both"""
+    cache = instrument_cache(fakeredis.FakeRedis(), "test_get")
+    assert isinstance(cache, InstrumentedCache)
+    cache.set("present", "1")
+
+    assert cache.get("present") == b"1"
+    assert cache.get("absent") is None
+    assert cache.hget("hash", "field") is None
+
+    assert count("test_get", "hit") == 1
+    assert count("test_get", "miss") == 2
+    assert timed("test_get", "get") == 2
+    assert timed("test_get", "hget") == 1
+
+
+def test_commands_counted_by_name():
+    """Verify non-GET commands are counted and timed under their own name"""
+    cache = instrument_cache(fakeredis.FakeRedis(), "test_commands")
+    cache.set("k", "1")
+    cache.incr("k")
+    cache.delete("k")
+
+    for operation in ("set", "incr", "delete"):
+        assert count("test_commands", operation) == 1
+        assert timed("test_commands", operation) == 1
+    assert count("test_commands", "hit") == 0
+
+
+def test_mget_counts_per_key():
+    """Verify MGET counts one hit/miss per key and observes a single latency"""
+    cache = instrument_cache(fakeredis.FakeRedis(), "test_mget")
+    cache.set("a", "1")
+    cache.set("b", "2")
+
+    assert cache.mget(["a", "b", "c"]) == [b"1", b"2", None]
+
+    assert count("test_mget", "hit") == 2
+    assert count("test_mget", "miss") == 1
+    assert timed("test_mget", "mget") == 1
+
+
+def test_pipeline_batch_and_breakdown():
+    """Verify a pipeline is timed once and each queued command is counted"""
+    cache = instrument_cache(fakeredis.FakeRedis(), "test_pipeline")
+    cache.set("a", "1")
+
+    with cache.pipeline() as pipe:
+        # Chained calls stay on the wrapper; ping is not instrumented
+        pipe.get("a").get("missing").set("b", "2").ping().mget("a", "b")
+        results = pipe.execute()
+
+    assert results == [b"1", None, True, True, [b"1", b"2"]]
+    assert timed("test_pipeline", "pipeline") == 1
+    assert count("test_pipeline", "hit") == 3
+    assert count("test_pipeline", "miss") == 1
+    assert count("test_pipeline", "set") == 2
+    # Commands inside the pipeline are not timed individually
+    assert timed("test_pipeline", "get") == 0
+
+
+def test_async_client():
+    """Verify async clients are detected and recorded, pipelines included"""
+    async def run():
+        cache = instrument_cache(fakeredis.FakeAsyncRedis(), "test_async")
+        assert isinstance(cache, InstrumentedAsyncCache)
+        await cache.set("a", "1")
+        assert await cache.get("a") == b"1"
+        assert await cache.get("b") is None
+        async with cache.pipeline() as pipe:
+            pipe.get("a").delete("a")
+            assert await pipe.execute() == [b"1", 1]
+        await cache.aclose()
+
+    asyncio.run(run())
+
+    assert count("test_async", "hit") == 2
+    assert count("test_async", "miss") == 1
+    assert count("test_async", "set") == 1
+    assert count("test_async", "delete") == 1
+    assert timed("test_async", "get") == 2
+    assert timed("test_async", "pipeline") == 1
+
+
+def test_passthrough():
+    """Verify commands that are not instrumented reach the client untouched"""
+    client = fakeredis.FakeRedis()
+    cache = instrument_cache(client, "test_passthrough")
+
+    assert cache.ping() is True
+    assert cache.connection_pool is client.connection_pool
+    assert count("test_passthrough", "ping") == 0
@@ -0,0 +1,79 @@
+"""
+Cardinality Guard Tests
+
+Tests:
+- Label sets beyond the budget are recorded into the __overflow__ series
+- Dropped label sets are counted per metric
+- Bound children never cache overflowed label values
+- Budgets come from the per-metric config with a global default
+"""
+
+from prometheus_client import CollectorRegistry, Counter
+
+from app.core.prometheus.cardinality import (
+    OVERFLOW_LABEL_VALUE,
+    get_limiter,
+    get_series_limit,
+    limit_cardinality,
+)
+from app.core.prometheus.config import get_prometheus_config
+from app.core.prometheus.metrics import BoundMetric, get_metric_registry, get_request_count
+
+
+def dropped(name):
+    return get_metric_registry().get_sample_value(
+        "metrics_cardinality_dropped_total", {"metric": name}
+    ) or 0.0
+
+
+def test_overflow_series():
+    """Verify excess label sets share one __overflow__ series"""
+    registry = CollectorRegistry()
+    counter = limit_cardinality(
+        Counter("guard_topics_total", "Topics", ["topic", "result"], registry=registry),
+        max_series=3,
+    )
+    before = dropped("guard_topics")
+
+    for i in range(10):
+        counter.labels(f"topic-{i}", "success").inc()
+    counter.labels(topic="topic-0", result="success").inc()
+
+    assert registry.get_sample_value("guard_topics_total", {"topic": "topic-0", "result": "success"}) == 2
+    assert registry.get_sample_value("guard_topics_total", {"topic": "topic-3", "result": "success"}) is None
+    assert registry.get_sample_value(
+        "guard_topics_total", {"topic": OVERFLOW_LABEL_VALUE, "result": OVERFLOW_LABEL_VALUE}
+    ) == 7
+    assert dropped("guard_topics") - before == 7
+    assert get_limiter(counter).series == 3
+
+
+def test_bound_children_skip_overflow_cache():
+    """Verify overflowed label values are not cached by BoundMetric"""
+    registry = CollectorRegistry()
+    counter = limit_cardinality(
+        Counter("guard_bound_total", "Bound", ["path"], registry=registry),
+        max_series=2,
+    )
+    bound = BoundMetric(counter)
+
+    for i in range(50):
+        bound.child(f"/raw/{i}").inc()
+
+    assert len(bound._children) == 2
+    assert registry.get_sample_value("guard_bound_total", {"path": OVERFLOW_LABEL_VALUE}) == 48
+
+
+def test_series_limits_from_config():
+    """Verify per-metric budgets override the global default"""
+    config = get_prometheus_config()
+    original = dict(config.SERIES_LIMITS)
+    config.SERIES_LIMITS["events_total"] = 25
+    try:
+        assert get_series_limit("events") == 25
+        assert get_series_limit("celery_tasks") == config.MAX_SERIES_PER_METRIC
+    finally:
+        config.SERIES_LIMITS.clear()
+        config.SERIES_LIMITS.update(original)
+
+    assert get_limiter(get_request_count()).max_series == get_series_limit("http_requests")
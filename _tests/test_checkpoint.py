@@ -0,0 +1,191 @@
+"""
+Counter Checkpoint Tests
+
+Tests:
+- The checkpoint file keeps the latest complete payload across reopen
+- A torn write falls back to the previous checkpoint
+- Slots grow when the payload outgrows them, keeping the last checkpoint
+  if the process dies mid-resize
+- A second process on the same file is refused
+- Counters and histograms created after restore get their previous values
+- Only a clean-shutdown checkpoint is restored; after a crash counters start at zero
+- Live values and changed histogram buckets are never overwritten
+- Restored children count against the cardinality budget
+"""
+
+import os
+
+import pytest
+from prometheus_client import CollectorRegistry, Counter, Histogram
+
+from app.core.prometheus.cardinality import get_limiter, limit_cardinality
+from app.core.prometheus import checkpoint as checkpoint_module
+from app.core.prometheus.checkpoint import CheckpointFile, Checkpointer
+
+
+def test_file_round_trip(tmp_path):
+    """Verify the newest payload is read back after reopening"""
+    path = str(tmp_path / "metrics.ckpt")
+    checkpoint = CheckpointFile(path, capacity=128)
+    assert checkpoint.read() is None
+    checkpoint.write(b"first")
+    checkpoint.write(b"second")
+    checkpoint.close()
+
+    reopened = CheckpointFile(path, capacity=128)
+    assert reopened.read() == b"second"
+    reopened.write(b"third")
+    assert reopened.read() == b"third"
+
+
+def test_torn_write_keeps_previous(tmp_path):
+    """Verify a corrupted newest slot falls back to the other slot"""
+    path = str(tmp_path / "metrics.ckpt")
+    checkpoint = CheckpointFile(path, capacity=128)
+    checkpoint.write(b"complete")
+    checkpoint.write(b"partial")
+    # Corrupt the payload of the newest slot (sequence 2 -> slot 0)
+    offset = checkpoint._slot_offset(0) + checkpoint_module._SLOT_HEADER.size
+    checkpoint._map[offset:offset + 3] = b"xxx"
+
+    assert checkpoint.read() == b"complete"
+
+
+def test_slots_grow(tmp_path):
+    """Verify payloads larger than a slot resize the file"""
+    path = str(tmp_path / "metrics.ckpt")
+    checkpoint = CheckpointFile(path, capacity=16)
+    checkpoint.write(b"x" * 100)
+
+    assert checkpoint.capacity >= 100
+    assert checkpoint.read() == b"x" * 100
+    checkpoint.close()
+    assert CheckpointFile(path).read() == b"x" * 100
+    assert os.path.getsize(path) > 200
+
+
+def test_grow_keeps_checkpoint_on_crash(tmp_path, monkeypatch):
+    """Verify a resize interrupted before the swap leaves the last checkpoint intact"""
+    path = str(tmp_path / "metrics.ckpt")
+    checkpoint = CheckpointFile(path, capacity=16)
+    checkpoint.write(b"good")
+
+    def crash(src, dst):
+        raise OSError("killed")
+
+    monkeypatch.setattr(checkpoint_module.os, "replace", crash)
+    with pytest.raises(OSError):
+        checkpoint.write(b"y" * 100)
+    monkeypatch.undo()
+    checkpoint.close()
+
+    reopened = CheckpointFile(path)
+    assert reopened.read() == b"good"
+    # A completed resize carries the checkpoint over until the next write lands
+    reopened._reset(256)
+    assert reopened.read() == b"good"
+
+
+def test_single_writer(tmp_path):
+    """Verify a second open of the same checkpoint file is refused until the first closes"""
+    path = str(tmp_path / "metrics.ckpt")
+    first = CheckpointFile(path)
+    with pytest.raises(RuntimeError):
+        CheckpointFile(path)
+    first.close()
+    CheckpointFile(path).close()
+
+
+def make_metrics(registry, buckets=(0.1, 1.0)):
+    requests = Counter("ckpt_requests", "Requests", ["endpoint"], registry=registry)
+    latency = Histogram("ckpt_latency_seconds", "Latency", ["endpoint"], registry=registry, buckets=buckets)
+    return requests, latency
+
+
+def test_restore_after_restart(tmp_path):
+    """Verify counters and histograms continue from the checkpoint after a restart"""
+    path = str(tmp_path / "metrics.ckpt")
+    registry = CollectorRegistry()
+    saver = Checkpointer(path)
+    saver.attach(registry)
+    requests, latency = make_metrics(registry)
+    requests.labels("/a").inc(5)
+    latency.labels("/a").observe(0.05)
+    latency.labels("/a").observe(0.5)
+    saver.save(clean=True)
+    saver.close()
+
+    # "Restart": fresh registry, metrics created lazily after attach
+    restarted = CollectorRegistry()
+    restorer = Checkpointer(path)
+    assert restorer.load() > 0
+    restorer.attach(restarted)
+    requests, latency = make_metrics(restarted)
+    restorer.restore(requests)
+    restorer.restore(latency)
+    requests.labels("/a").inc()
+
+    assert restarted.get_sample_value("ckpt_requests_total", {"endpoint": "/a"}) == 6
+    assert restarted.get_sample_value("ckpt_latency_seconds_bucket", {"endpoint": "/a", "le": "0.1"}) == 1
+    assert restarted.get_sample_value("ckpt_latency_seconds_bucket", {"endpoint": "/a", "le": "+Inf"}) == 2
+    assert restarted.get_sample_value("ckpt_latency_seconds_sum", {"endpoint": "/a"}) == 0.55
+
+
+def test_no_restore_after_crash(tmp_path):
+    """Verify a checkpoint from a periodic save (no clean shutdown) is not restored"""
+    path = str(tmp_path / "metrics.ckpt")
+    registry = CollectorRegistry()
+    saver = Checkpointer(path)
+    saver.attach(registry)
+    requests, _ = make_metrics(registry)
+    requests.labels("/a").inc(5)
+    saver.save(clean=True)
+    requests.labels("/a").inc(5)
+    saver.save()
+    saver.close()  # "crash": the atexit save never ran
+
+    restarted = CollectorRegistry()
+    restorer = Checkpointer(path)
+    assert restorer.load() == 0
+    requests, _ = make_metrics(restarted)
+    restorer.restore(requests)
+    assert restarted.get_sample_value("ckpt_requests_total", {"endpoint": "/a"}) is None
+
+
+def test_no_overwrite(tmp_path):
+    """Verify live values and histograms with new buckets are left alone"""
+    path = str(tmp_path / "metrics.ckpt")
+    registry = CollectorRegistry()
+    saver = Checkpointer(path)
+    saver.attach(registry)
+    requests, latency = make_metrics(registry)
+    requests.labels("/a").inc(5)
+    latency.labels("/a").observe(0.5)
+    saver.save(clean=True)
+    saver.close()
+
+    live = CollectorRegistry()
+    requests, latency = make_metrics(live, buckets=(0.2, 2.0))
+    requests.labels("/a").inc(2)
+    restorer = Checkpointer(path)
+    restorer.load()
+    restorer.attach(live)
+    restorer.restore(requests)
+    restorer.restore(latency)
+
+    assert live.get_sample_value("ckpt_requests_total", {"endpoint": "/a"}) == 2
+    assert live.get_sample_value("ckpt_latency_seconds_count", {"endpoint": "/a"}) is None
+
+
+def test_restored_children_use_budget(tmp_path):
+    """Verify series restored before the guard is installed count toward the limit"""
+    registry = CollectorRegistry()
+    counter = Counter("ckpt_budget", "Budget", ["key"], registry=registry)
+    for i in range(3):
+        counter.labels(str(i)).inc()
+
+    limit_cardinality(counter, max_series=4)
+    assert get_limiter(counter).series == 3
+    counter.labels("new").inc()
+    counter.labels("dropped").inc()
+    assert registry.get_sample_value("ckpt_budget_total", {"key": "__overflow__"}) == 1
@@ -0,0 +1,164 @@
+"""
+Scrape-time Collector Tests
+
+Tests:
+- System collector never blocks on CPU measurement
+- Memory, disk and process stats exported as gauges
+- Each system source sampled on its own interval
+- Cache hit ratio computed from cache_operations_total on scrape
+- Results cached for the TTL and shared by concurrent scrapes
+- Connection pool states read from registered sources
+- Removed gauge getters still accept sets, with a DeprecationWarning
+"""
+
+import threading
+import time
+
+import pytest
+
+from app.core.prometheus.collectors import (
+    CachedCollector,
+    CacheHitRatioCollector,
+    ConnectionPoolCollector,
+    SystemMetricsCollector,
+)
+from app.core.prometheus.metrics import (
+    get_cache_hit_ratio,
+    get_connection_pools,
+    get_metric_registry,
+    get_system_cpu_usage,
+    get_system_metrics,
+    record_cache_operation,
+)
+from prometheus_client.core import GaugeMetricFamily
+
+
+def samples(collector):
+    return {
+        (sample.name, tuple(sorted(sample.labels.items()))): sample.value
+        for metric in collector.collect()
+        for sample in metric.samples
+    }
+
+
+def test_system_collector_is_non_blocking():
+    """Verify a scrape returns immediately and CPU comes from cpu_times deltas"""
+    get_system_metrics()
+    time.sleep(0.2)  # let the CPU time counters advance past the baseline
+
+    start = time.perf_counter()
+    registry = get_metric_registry()
+    cpu = registry.get_sample_value("system_cpu_usage_percent")
+    assert time.perf_counter() - start < 0.5, "Collector should not sleep"
+
+    assert cpu is not None and 0.0 <= cpu <= 100.0
+    assert registry.get_sample_value("system_memory_used_percent") > 0
+    assert registry.get_sample_value("system_memory_available_bytes") > 0
+    assert registry.get_sample_value("system_disk_used_percent", {"mountpoint": "/"}) >= 0
+    assert registry.get_sample_value("process_memory_rss_bytes") > 0
+    assert registry.get_sample_value("process_threads") >= 1
+
+
+def test_sources_sampled_on_own_interval():
+    """Verify expensive sources are sampled less often than cheap ones"""
+    collector = SystemMetricsCollector(intervals={"cpu": 1, "memory": 1, "process": 1, "disk": 60})
+    calls = {"memory": 0, "disk": 0}
+
+    def counting(name):
+        def sample():
+            calls[name] += 1
+            return {}
+        return sample
+
+    collector.sources = [
+        (name, interval, counting(name) if name in calls else sample)
+        for name, interval, sample in collector.sources
+    ]
+
+    for now in range(0, 30):
+        collector.refresh(now=float(now))
+
+    assert calls["memory"] == 30
+    assert calls["disk"] == 1
+
+
+def test_cache_hit_ratio_computed_on_scrape():
+    """Verify the ratio reflects the cache counters at scrape time"""
+    collector = CacheHitRatioCollector(ttl=0)
+    before = samples(collector)
+    assert before[("cache_hit_ratio", (("cache_type", "valkey"),))] <= 1.0
+
+    for _ in range(3):
+        record_cache_operation("ratio_test", "hit")
+    record_cache_operation("ratio_test", "miss")
+
+    after = samples(collector)
+    assert after[("cache_hit_ratio", (("cache_type", "ratio_test"),))] == 0.75
+
+
+def test_cache_hit_ratio_registered_on_registry():
+    """Verify the getter registers the collector on the shared registry"""
+    get_cache_hit_ratio()
+    assert get_metric_registry().get_sample_value("cache_hit_ratio", {"cache_type": "valkey"}) is not None
+
+
+def test_deprecated_gauge_getters():
+    """Verify old Gauge call sites warn and are ignored instead of failing"""
+    with pytest.warns(DeprecationWarning):
+        get_system_cpu_usage().set(99)
+    with pytest.warns(DeprecationWarning):
+        get_cache_hit_ratio().labels(cache_type="valkey").set(0.5)
+    assert get_metric_registry().get_sample_value("system_cpu_usage_percent") != 99
+
+
+class SlowCollector(CachedCollector):
+    def __init__(self, ttl):
+        super().__init__(ttl)
+        self.computations = 0
+
+    def describe_families(self):
+        yield GaugeMetricFamily("slow_value", "Slow value")
+
+    def compute(self):
+        self.computations += 1
+        time.sleep(0.1)
+        family = GaugeMetricFamily("slow_value", "Slow value")
+        family.add_metric([], self.computations)
+        yield family
+
+
+def test_concurrent_scrapes_share_computation():
+    """Verify scrapes within the TTL reuse one computation"""
+    collector = SlowCollector(ttl=60)
+    threads = [threading.Thread(target=collector.collect) for _ in range(8)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+    assert collector.computations == 1
+    assert samples(collector)[("slow_value", ())] == 1
+
+    collector.invalidate()
+    assert samples(collector)[("slow_value", ())] == 2
+
+
+def test_connection_pool_states():
+    """Verify pool sources are read on scrape and failing ones are skipped"""
+    collector = ConnectionPoolCollector(ttl=0)
+    state = {"size": 10, "checked_out": 2}
+    collector.register_pool("postgres", lambda: dict(state))
+    collector.register_pool("broken", lambda: 1 / 0)
+
+    state["checked_out"] = 4
+    values = samples(collector)
+    assert values[("db_pool_connections", (("db_type", "postgres"), ("state", "checked_out")))] == 4
+    assert values[("db_pool_connections", (("db_type", "postgres"), ("state", "size")))] == 10
+    assert not any(labels[0] == ("db_type", "broken") for _, labels in values)
+
+    pools = get_connection_pools()
+    pools.register_pool("pool_test", lambda: {"size": 5})
+    assert get_metric_registry().get_sample_value(
+        "db_pool_connections", {"db_type": "pool_test", "state": "size"}
+    ) == 5
+    pools.unregister_pool("pool_test")
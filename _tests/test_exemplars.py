@@ -0,0 +1,170 @@
+"""
+Exemplar Tests
+
+Tests:
+- W3C traceparent headers are parsed and invalid ones rejected
+- Request latency carries the traceparent trace in OpenMetrics only
+- DB/cache/event observations inside a request get the request's trace
+- One exemplar per bucket: latest replaces, slowest keeps the slower one
+- Observations outside a trace get no exemplar
+- Sparse histograms carry exemplars on their classic buckets
+"""
+
+import pytest
+from prometheus_client import CollectorRegistry, Histogram
+from prometheus_client.openmetrics.exposition import generate_latest
+from starlette.applications import Starlette
+from starlette.middleware import Middleware
+from starlette.responses import PlainTextResponse
+from starlette.routing import Route
+from starlette.testclient import TestClient
+
+from app.core.prometheus.config import get_prometheus_config
+from app.core.prometheus.exemplars import (
+    SLOWEST,
+    attach_exemplar,
+    parse_traceparent,
+    reset_trace_context,
+    set_trace_context,
+)
+from app.core.prometheus.exposition import MetricsExposition
+from app.core.prometheus.histograms import SparseHistogram
+from app.core.prometheus.metrics import (
+    bind,
+    get_db_latency,
+    get_metric_registry,
+    record_cache_operation,
+    record_db_operation,
+)
+from app.core.prometheus.middleware import PrometheusMiddleware
+
+TRACE_ID = "4bf92f3577b34da6a3ce929d0e0e4736"
+SPAN_ID = "00f067aa0ba902b7"
+TRACEPARENT = f"00-{TRACE_ID}-{SPAN_ID}-01"
+OPENMETRICS = "application/openmetrics-text; version=1.0.0"
+
+
+def exemplars(name, **labels):
+    """Exemplars on the ``name`` bucket samples matching ``labels``."""
+    found = []
+    for metric in get_metric_registry().collect():
+        for sample in metric.samples:
+            if sample.name == name and sample.exemplar and all(sample.labels.get(k) == v for k, v in labels.items()):
+                found.append(sample.exemplar)
+    return found
+
+
+def histogram():
+    return Histogram("exemplar_test_seconds", "Test", buckets=(0.1, 1.0), registry=CollectorRegistry())
+
+
+def test_parse_traceparent():
+    """Verify valid traceparent headers yield trace and span ids"""
+    assert parse_traceparent(TRACEPARENT) == {"trace_id": TRACE_ID, "span_id": SPAN_ID}
+    assert parse_traceparent(TRACEPARENT.upper()) == {"trace_id": TRACE_ID, "span_id": SPAN_ID}
+    assert parse_traceparent(f"01-{TRACE_ID}-{SPAN_ID}-01-future") is not None
+    for invalid in (
+        None,
+        "",
+        "garbage",
+        f"ff-{TRACE_ID}-{SPAN_ID}-01",
+        f"00-{'0' * 32}-{SPAN_ID}-01",
+        f"00-{TRACE_ID}-{'0' * 16}-01",
+        f"00-{TRACE_ID}-{SPAN_ID}-01-extra",
+    ):
+        assert parse_traceparent(invalid) is None
+
+
+async def traced(request):
+    # Nested instrumentation sees the request's trace context
+    record_db_operation("exemplar_db", 0.02)
+    record_cache_operation("exemplar_cache", "get", 0.002)
+    return PlainTextResponse("ok")
+
+
+@pytest.fixture
+def client():
+    app = Starlette(routes=[Route("/traced", traced)], middleware=[Middleware(PrometheusMiddleware)])
+    return TestClient(app)
+
+
+def test_request_exemplar_in_openmetrics(client):
+    """Verify the traceparent trace is attached to request latency and exposed via OpenMetrics"""
+    client.get("/traced", headers={"traceparent": TRACEPARENT})
+
+    found = exemplars("http_request_duration_seconds_bucket", endpoint="/traced")
+    assert found and found[0].labels == {"trace_id": TRACE_ID, "span_id": SPAN_ID}
+
+    exposition = MetricsExposition(ttl=0)
+    openmetrics, _ = exposition.render(OPENMETRICS)
+    text, _ = exposition.render("text/plain")
+    assert f'# {{span_id="{SPAN_ID}",trace_id="{TRACE_ID}"}}'.encode() in openmetrics
+    assert TRACE_ID.encode() not in text
+
+
+def test_nested_observations_get_request_trace(client):
+    """Verify DB and cache observations made while handling the request carry its trace"""
+    client.get("/traced", headers={"traceparent": TRACEPARENT})
+
+    db = exemplars("db_operation_duration_seconds_bucket", operation="exemplar_db")
+    cache = exemplars("cache_operation_duration_seconds_bucket", cache_type="exemplar_cache")
+    assert db and db[0].labels["trace_id"] == TRACE_ID
+    assert cache and cache[0].labels["span_id"] == SPAN_ID
+
+
+def test_latest_and_slowest_policies():
+    """Verify one exemplar per bucket, replaced by the latest or only by a slower one"""
+    config = get_prometheus_config()
+    metric = histogram()
+
+    metric.observe(0.5)
+    attach_exemplar(metric, 0.5, {"trace_id": "slow"})
+    metric.observe(0.2)
+    attach_exemplar(metric, 0.2, {"trace_id": "fast"})
+    assert metric._buckets[1].get_exemplar().labels == {"trace_id": "fast"}
+
+    policy = config.EXEMPLAR_POLICY
+    config.EXEMPLAR_POLICY = SLOWEST
+    try:
+        attach_exemplar(metric, 0.9, {"trace_id": "slowest"})
+        attach_exemplar(metric, 0.3, {"trace_id": "faster"})
+        assert metric._buckets[1].get_exemplar().labels == {"trace_id": "slowest"}
+        # Other buckets are independent
+        attach_exemplar(metric, 0.05, {"trace_id": "quick"})
+        assert metric._buckets[0].get_exemplar().labels == {"trace_id": "quick"}
+    finally:
+        config.EXEMPLAR_POLICY = policy
+
+
+def test_no_trace_no_exemplar():
+    """Verify observations outside a trace leave the buckets without exemplars"""
+    metric = histogram()
+    attach_exemplar(metric, 0.5)
+    assert all(bucket.get_exemplar() is None for bucket in metric._buckets)
+
+    token = set_trace_context({"trace_id": TRACE_ID, "span_id": SPAN_ID})
+    try:
+        attach_exemplar(metric, 0.5)
+    finally:
+        reset_trace_context(token)
+    assert metric._buckets[1].get_exemplar().labels["trace_id"] == TRACE_ID
+
+    child = bind(get_db_latency()).child("exemplar_untraced")
+    record_db_operation("exemplar_untraced", 0.01)
+    assert all(bucket.get_exemplar() is None for bucket in child._buckets)
+
+
+def test_sparse_histogram_exemplars():
+    """Verify sparse histogram exemplars land on the classic bucket and in OpenMetrics output"""
+    registry = CollectorRegistry()
+    metric = SparseHistogram("exemplar_sparse_seconds", "Test", ["route"], registry=registry, buckets=(0.1, 1.0))
+    child = metric.labels("/a")
+    child.observe(0.5)
+    attach_exemplar(child, 0.5, {"trace_id": TRACE_ID})
+    child.observe(0.05)
+    attach_exemplar(child, 0.05)  # outside a trace
+
+    assert child.get_exemplar(1).labels == {"trace_id": TRACE_ID}
+    assert child.get_exemplar(0) is None
+    output = generate_latest(registry).decode()
+    assert f'exemplar_sparse_seconds_bucket{{le="1.0",route="/a"}} 2.0 # {{trace_id="{TRACE_ID}"}} 0.5 ' in output
@@ -0,0 +1,400 @@
+"""
+Cached Exposition Tests
+
+Tests:
+- Cached payload matches the stock text and OpenMetrics encoders
+- Only families whose samples changed are re-serialized
+- Payload served from cache within the TTL, shared by concurrent scrapes
+- Gzip payload compressed once and served from cache
+- Starlette route handler negotiates content type and encoding
+- ASGI metrics app renders off the event loop
+- Concurrent scrapes over the limit are rejected with a 503
+- Standalone metrics server serves the payload
+- Protobuf is negotiated only when it is the scraper's preferred type
+- Protobuf families decode to the expected MetricFamily messages
+- Streamed output (plain and gzip) matches the cached payload
+- Streaming keeps scrape memory well below the payload size
+- ASGI app, route handler and standalone server stream in chunks
+"""
+
+import asyncio
+import gzip
+import struct
+import threading
+import time
+import tracemalloc
+import urllib.request
+
+from prometheus_client import CollectorRegistry, Counter, Gauge, generate_latest
+from prometheus_client.openmetrics.exposition import generate_latest as generate_openmetrics
+from starlette.applications import Starlette
+from starlette.testclient import TestClient
+
+from app.core.prometheus.config import get_prometheus_config
+from app.core.prometheus.exposition import (
+    PROTOBUF_CONTENT_TYPE,
+    STREAM_CHUNK_SIZE,
+    MetricsApp,
+    MetricsExposition,
+    metrics_endpoint,
+    negotiate,
+    start_metrics_server,
+)
+from app.core.prometheus.histograms import SparseHistogram
+from app.core.prometheus.metrics import get_metric_registry, get_request_count
+
+OPENMETRICS = "application/openmetrics-text; version=1.0.0"
+# What Prometheus sends with native histograms enabled
+PROMETHEUS_ACCEPT = (
+    "application/vnd.google.protobuf;proto=io.prometheus.client.MetricFamily;encoding=delimited;q=0.6,"
+    "application/openmetrics-text;version=1.0.0;q=0.5,text/plain;version=0.0.4;q=0.3,*/*;q=0.2"
+)
+
+
+def build_registry():
+    registry = CollectorRegistry()
+    counter = Counter("exp_requests", "Requests", ["path"], registry=registry)
+    gauge = Gauge("exp_inflight", "In flight", registry=registry)
+    for i in range(5):
+        counter.labels(f"/p{i}").inc(i)
+    gauge.set(3)
+    return registry, counter, gauge
+
+
+def test_payload_matches_stock_encoders():
+    """Verify cached text and OpenMetrics output equal generate_latest"""
+    registry, _, _ = build_registry()
+    exposition = MetricsExposition(registry, ttl=0)
+
+    body, headers = exposition.render()
+    assert body == generate_latest(registry)
+    assert headers["Content-Type"].startswith("text/plain")
+
+    body, headers = exposition.render(OPENMETRICS)
+    assert body == generate_openmetrics(registry)
+    assert body.count(b"# EOF") == 1
+    assert headers["Content-Type"].startswith("application/openmetrics-text")
+
+
+def test_only_changed_families_rerendered():
+    """Verify unchanged families reuse their serialized bytes"""
+    registry, counter, gauge = build_registry()
+    exposition = MetricsExposition(registry, ttl=0)
+
+    exposition.render()
+    assert exposition.last_rendered == 2
+
+    exposition.render()
+    assert exposition.last_rendered == 0
+
+    gauge.set(4)
+    body, _ = exposition.render()
+    assert exposition.last_rendered == 1
+    assert body == generate_latest(registry)
+
+
+def test_payload_cached_within_ttl():
+    """Verify scrapes within the TTL share one render"""
+    registry, counter, _ = build_registry()
+    exposition = MetricsExposition(registry, ttl=60)
+    renders = []
+    original = exposition._render
+    exposition._render = lambda cache: (renders.append(1), original(cache))
+
+    first, _ = exposition.render()
+    threads = [threading.Thread(target=exposition.render) for _ in range(8)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    counter.labels("/p0").inc()
+    second, _ = exposition.render()
+
+    assert len(renders) == 1
+    assert first is second
+
+    exposition.invalidate()
+    third, _ = exposition.render()
+    assert third != first
+
+
+def test_gzip_served_from_cache():
+    """Verify gzip bytes decompress to the payload and are reused"""
+    registry, _, _ = build_registry()
+    exposition = MetricsExposition(registry, ttl=60)
+
+    first, headers = exposition.render(accept_encoding="gzip, deflate")
+    second, _ = exposition.render(accept_encoding="gzip")
+
+    assert headers["Content-Encoding"] == "gzip"
+    assert gzip.decompress(first) == generate_latest(registry)
+    assert first is second
+
+
+def test_metrics_endpoint():
+    """Verify the route handler serves the shared registry with negotiation"""
+    get_request_count().labels("GET", "/exposition", 200).inc()
+    app = Starlette()
+    app.add_route("/metrics", metrics_endpoint)
+    client = TestClient(app)
+
+    response = client.get("/metrics", headers={"Accept": OPENMETRICS})
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("application/openmetrics-text")
+    assert response.text.endswith("# EOF\n")
+
+    response = client.get("/metrics", headers={"Accept-Encoding": "gzip"})
+    assert response.headers["content-encoding"] == "gzip"
+    assert "http_requests_total" in response.text
+
+
+class SlowExposition(MetricsExposition):
+    def render(self, accept=None, accept_encoding=None):
+        time.sleep(0.3)
+        return super().render(accept, accept_encoding)
+
+
+async def call_app(app, method="GET"):
+    scope = {"type": "http", "method": method, "path": "/", "headers": []}
+    messages = []
+
+    async def receive():
+        return {"type": "http.request", "body": b"", "more_body": False}
+
+    async def send(message):
+        messages.append(message)
+
+    await app(scope, receive, send)
+    return messages[0]["status"], b"".join(message.get("body", b"") for message in messages[1:])
+
+
+def test_metrics_app_renders_off_loop():
+    """Verify the event loop keeps running while a scrape is serialized"""
+    registry, _, _ = build_registry()
+    app = MetricsApp(SlowExposition(registry, ttl=0))
+
+    async def main():
+        ticks = 0
+
+        async def ticker():
+            nonlocal ticks
+            while True:
+                await asyncio.sleep(0.01)
+                ticks += 1
+
+        task = asyncio.ensure_future(ticker())
+        status, body = await call_app(app)
+        task.cancel()
+        return status, body, ticks
+
+    status, body, ticks = asyncio.run(main())
+    assert status == 200
+    assert body == generate_latest(registry)
+    assert ticks >= 10, "Event loop was blocked during the scrape"
+
+
+def test_scrape_concurrency_limit():
+    """Verify scrapes beyond the limit get a 503 and are counted"""
+    registry, _, _ = build_registry()
+    app = MetricsApp(SlowExposition(registry, ttl=0), max_concurrency=1)
+    metrics = get_metric_registry()
+    labels = {"server": "asgi"}
+    rejected_before = metrics.get_sample_value("metrics_scrape_rejected_total", labels) or 0.0
+    count_before = metrics.get_sample_value("metrics_scrape_duration_seconds_count", labels) or 0.0
+
+    async def main():
+        return await asyncio.gather(call_app(app), call_app(app))
+
+    statuses = sorted(status for status, _ in asyncio.run(main()))
+
+    assert statuses == [200, 503]
+    assert (metrics.get_sample_value("metrics_scrape_rejected_total", labels) or 0.0) - rejected_before == 1
+    assert (metrics.get_sample_value("metrics_scrape_duration_seconds_count", labels) or 0.0) - count_before == 1
+
+
+def test_standalone_metrics_server():
+    """Verify the separate HTTP server serves the cached exposition"""
+    registry, _, _ = build_registry()
+    server = start_metrics_server(port=0, addr="127.0.0.1", exposition=MetricsExposition(registry, ttl=0))
+    try:
+        port = server.server_address[1]
+        with urllib.request.urlopen(f"http://127.0.0.1:{port}/metrics", timeout=5) as response:
+            assert response.status == 200
+            assert response.read() == generate_latest(registry)
+    finally:
+        server.shutdown()
+        server.server_close()
+
+
+def read_varint(data, pos):
+    value = shift = 0
+    while True:
+        byte = data[pos]
+        pos += 1
+        value |= (byte & 0x7F) << shift
+        shift += 7
+        if byte < 0x80:
+            return value, pos
+
+
+def decode(data):
+    """Fields of one protobuf message as {number: [values]}, sub-messages as bytes."""
+    fields, pos = {}, 0
+    while pos < len(data):
+        key, pos = read_varint(data, pos)
+        if key & 7 == 0:
+            value, pos = read_varint(data, pos)
+        elif key & 7 == 1:
+            value, pos = struct.unpack_from("<d", data, pos)[0], pos + 8
+        else:
+            length, pos = read_varint(data, pos)
+            value, pos = data[pos:pos + length], pos + length
+        fields.setdefault(key >> 3, []).append(value)
+    return fields
+
+
+def decode_families(data):
+    families, pos = {}, 0
+    while pos < len(data):
+        length, pos = read_varint(data, pos)
+        family = decode(data[pos:pos + length])
+        pos += length
+        families[family[1][0].decode()] = family
+    return families
+
+
+def labels_of(metric):
+    return {decode(pair)[1][0].decode(): decode(pair)[2][0].decode() for pair in metric.get(1, [])}
+
+
+def test_protobuf_negotiation():
+    """Verify protobuf is chosen only when ranked first among supported types"""
+    assert negotiate(PROMETHEUS_ACCEPT)[1] == PROTOBUF_CONTENT_TYPE
+    assert negotiate(PROTOBUF_CONTENT_TYPE)[1] == PROTOBUF_CONTENT_TYPE
+
+    ranked_lower = "application/openmetrics-text;version=1.0.0;q=0.9," + PROTOBUF_CONTENT_TYPE + ";q=0.5"
+    assert negotiate(ranked_lower)[1].startswith("application/openmetrics-text")
+    # Not the delimited MetricFamily stream: unsupported, fall back
+    assert negotiate("application/vnd.google.protobuf;proto=io.prometheus.client.MetricFamily")[1].startswith("text/plain")
+    assert negotiate(None)[1].startswith("text/plain")
+
+
+def test_protobuf_families():
+    """Verify counters, gauges and histograms decode to MetricFamily messages"""
+    registry, counter, _ = build_registry()
+    latency = SparseHistogram("exp_latency_seconds", "Latency", ["route"], registry=registry)
+    for value in (0.01, 0.02, 0.5):
+        latency.labels("/a").observe(value)
+
+    body, headers = MetricsExposition(registry, ttl=0).render(PROMETHEUS_ACCEPT)
+    assert headers["Content-Type"] == PROTOBUF_CONTENT_TYPE
+    families = decode_families(body)
+
+    requests = families["exp_requests_total"]
+    assert requests[2] == [b"Requests"] and requests[3] == [0]  # COUNTER
+    values = {labels_of(decode(m))["path"]: decode(decode(m)[3][0])[1][0] for m in requests[4]}
+    assert values == {f"/p{i}": float(i) for i in range(5)}
+    assert 3 in decode(decode(requests[4][0])[3][0])  # created timestamp
+
+    inflight = families["exp_inflight"]
+    assert inflight[3] == [1] and decode(decode(inflight[4][0])[2][0])[1] == [3.0]  # GAUGE
+
+    histogram = families["exp_latency_seconds"]
+    assert histogram[3] == [4]  # HISTOGRAM
+    metric = decode(histogram[4][0])
+    assert labels_of(metric) == {"route": "/a"}
+    fields = decode(metric[7][0])
+    assert fields[1] == [3] and abs(fields[2][0] - 0.53) < 1e-9
+    assert decode(fields[3][-1])[1] == [3]  # cumulative +Inf bucket
+    assert fields[5] == [get_prometheus_config().SPARSE_HISTOGRAM_SCHEMA * 2]  # zigzag schema
+    assert 12 in fields and 13 in fields  # native positive spans and deltas
+
+
+def test_stream_matches_render():
+    """Verify streamed chunks join to the cached payload in every format"""
+    registry, _, _ = build_registry()
+    exposition = MetricsExposition(registry, ttl=0)
+
+    for accept in (None, OPENMETRICS, PROMETHEUS_ACCEPT):
+        chunks, headers = exposition.stream(accept)
+        body, cached_headers = exposition.render(accept)
+        assert b"".join(chunks) == body
+        assert headers == cached_headers
+
+    chunks, headers = exposition.stream(OPENMETRICS, "gzip")
+    assert headers["Content-Encoding"] == "gzip"
+    assert gzip.decompress(b"".join(chunks)) == generate_openmetrics(registry)
+
+
+def test_stream_memory_flat():
+    """Verify a streamed scrape holds far less than the payload in memory"""
+    registry = CollectorRegistry()
+    for i in range(200):
+        counter = Counter(f"exp_bulk_{i}", "Bulk", ["series"], registry=registry)
+        for j in range(50):
+            counter.labels(f"series-{j}").inc(j)
+    exposition = MetricsExposition(registry, ttl=0)
+
+    tracemalloc.start()
+    try:
+        size = chunks = 0
+        for chunk in exposition.stream()[0]:
+            size += len(chunk)
+            chunks += 1
+        _, streamed_peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+
+    assert chunks > 1
+    assert size > 5 * STREAM_CHUNK_SIZE
+    assert streamed_peak < size / 2
+
+
+def test_streaming_servers():
+    """Verify the ASGI app, route handler and standalone server stream the exposition"""
+    registry = CollectorRegistry()
+    for i in range(200):
+        Counter(f"exp_stream_{i}", "Stream", ["series"], registry=registry).labels("x" * 200).inc()
+    expected = generate_latest(registry)
+    assert len(expected) > STREAM_CHUNK_SIZE
+
+    app = MetricsApp(MetricsExposition(registry, ttl=0), streaming=True)
+    messages = []
+
+    async def receive():
+        return {"type": "http.request", "body": b"", "more_body": False}
+
+    async def send(message):
+        messages.append(message)
+
+    scope = {"type": "http", "method": "GET", "path": "/", "headers": []}
+    asyncio.run(app(scope, receive, send))
+    bodies = [message for message in messages[1:] if message.get("body")]
+    assert len(bodies) > 1 and all(message["more_body"] for message in bodies)
+    assert b"".join(message["body"] for message in bodies) == expected
+    assert not messages[-1].get("more_body")
+    assert asyncio.run(call_app(app, "HEAD")) == (200, b"")
+
+    config = get_prometheus_config()
+    streaming = config.EXPOSITION_STREAMING
+    config.EXPOSITION_STREAMING = True
+    try:
+        route = Starlette()
+        route.add_route("/metrics", metrics_endpoint)
+        response = TestClient(route).get("/metrics", headers={"Accept": PROMETHEUS_ACCEPT})
+        assert response.headers["content-type"] == PROTOBUF_CONTENT_TYPE
+        assert "http_requests_total" in decode_families(response.content)
+    finally:
+        config.EXPOSITION_STREAMING = streaming
+
+    server = start_metrics_server(
+        port=0, addr="127.0.0.1", exposition=MetricsExposition(registry, ttl=0), streaming=True
+    )
+    try:
+        port = server.server_address[1]
+        with urllib.request.urlopen(f"http://127.0.0.1:{port}/metrics", timeout=5) as response:
+            assert response.headers["Content-Length"] is None
+            assert response.read() == expected
+    finally:
+        server.shutdown()
+        server.server_close()
@@ -0,0 +1,130 @@
+"""
+Sparse Histogram Tests
+
+Tests:
+- Exponential bucket boundaries follow the native histogram layout
+- Only populated exponential buckets are allocated
+- Classic _bucket series use the fixed layout, same le set for every series
+  and across schema reductions
+- Bucket count stays bounded by lowering the schema
+- Native histograms plus classic buckets for OpenMetrics 2.0 scrapers
+- Selection per metric through PROMETHEUS_SPARSE_HISTOGRAMS
+"""
+
+from prometheus_client import CollectorRegistry, generate_latest
+
+from app.core.prometheus import metrics
+from app.core.prometheus.config import get_prometheus_config
+from app.core.prometheus.exposition import MetricsExposition
+from app.core.prometheus.histograms import SparseHistogram, bucket_index, bucket_upper
+from app.core.prometheus.recorder import BufferedRecorder
+
+
+def test_bucket_boundaries():
+    """Verify values land in (base**(i-1), base**i] for several schemas"""
+    assert bucket_index(1.0, 0) == 0
+    assert bucket_index(1.5, 0) == 1
+    assert bucket_index(2.0, 0) == 1
+    assert bucket_index(4.0, -1) == 1
+    for schema in (-2, 0, 1, 3, 5):
+        for value in (0.00037, 0.004, 0.01, 0.25, 1.0, 3.3, 120.0):
+            index = bucket_index(value, schema)
+            assert bucket_upper(index - 1, schema) < value <= bucket_upper(index, schema)
+
+
+def bucket_samples(registry, name, **labels):
+    return {
+        s.labels["le"]: s.value for m in registry.collect() for s in m.samples
+        if s.name == f"{name}_bucket" and all(s.labels.get(k) == v for k, v in labels.items())
+    }
+
+
+def test_classic_buckets_use_fixed_layout():
+    """Verify classic exposition uses the configured buckets, with only populated sparse buckets allocated"""
+    registry = CollectorRegistry()
+    histogram = SparseHistogram(
+        "sparse_latency_seconds", "Latency", ["endpoint"], registry=registry, buckets=(0.001, 0.01, 0.1, 1.0)
+    )
+    child = histogram.labels("/items")
+    for value in (0.002, 0.0021, 0.05, 0.05, 1.2):
+        child.observe(value)
+
+    _, _, positive, _, _, _, _, _ = child.snapshot()
+    assert len(positive) == 3
+    assert bucket_samples(registry, "sparse_latency_seconds") == {
+        "0.001": 0, "0.01": 2, "0.1": 4, "1.0": 4, "+Inf": 5,
+    }
+    assert registry.get_sample_value("sparse_latency_seconds_count", {"endpoint": "/items"}) == 5
+    assert abs(registry.get_sample_value("sparse_latency_seconds_sum", {"endpoint": "/items"}) - 1.3041) < 1e-9
+    assert b"sparse_latency_seconds_bucket" in generate_latest(registry)
+
+
+def test_bucket_count_bounded():
+    """Verify the schema is lowered once the bucket cap is exceeded"""
+    histogram = SparseHistogram("bounded_seconds", "Bounded", schema=5, max_buckets=20)
+    for i in range(1, 2001):
+        histogram.observe(i / 1000)
+
+    schema, _, positive, _, count, _, _, _ = histogram._children[()].snapshot()
+    assert len(positive) <= 20
+    assert schema < 5
+    assert count == 2000
+    assert sum(positive.values()) == 2000
+
+
+def test_le_set_stable_across_series_and_schema_reductions():
+    """Verify every series exposes the same le set, unchanged by a schema reduction"""
+    registry = CollectorRegistry()
+    histogram = SparseHistogram("stable_seconds", "Stable", ["route"], registry=registry, schema=5, max_buckets=10)
+    histogram.labels("/fast").observe(0.003)
+    histogram.labels("/slow").observe(2.7)
+
+    fast = bucket_samples(registry, "stable_seconds", route="/fast")
+    slow = bucket_samples(registry, "stable_seconds", route="/slow")
+    assert list(fast) == list(slow)
+
+    child = histogram.labels("/fast")
+    for i in range(1, 500):
+        child.observe(i / 1000)
+    assert child.snapshot()[0] < 5  # schema was lowered
+    after = bucket_samples(registry, "stable_seconds", route="/fast")
+    assert list(after) == list(fast)
+    assert after["+Inf"] == registry.get_sample_value("stable_seconds_count", {"route": "/fast"}) == 500
+
+
+def test_native_exposition_for_openmetrics_2():
+    """Verify OpenMetrics 2.0 gets native samples next to the classic buckets, older formats only classic"""
+    registry = CollectorRegistry()
+    histogram = SparseHistogram("native_seconds", "Native", ["route"], registry=registry)
+    for value in (0.01, 0.02, 0.5):
+        histogram.labels("/a").observe(value)
+    exposition = MetricsExposition(registry, ttl=0)
+
+    native, _ = exposition.render("application/openmetrics-text; version=2.0.0")
+    classic, _ = exposition.render("application/openmetrics-text; version=1.0.0")
+    text, _ = exposition.render()
+
+    assert b"{count:3," in native and b'native_seconds_bucket{le="+Inf",route="/a"} 3.0' in native
+    assert b"native_seconds_bucket" in classic and b"{count:" not in classic
+    assert b"native_seconds_bucket" in text
+
+
+def test_sparse_selected_per_metric():
+    """Verify listed histograms are sparse and still work with the buffered recorder"""
+    config = get_prometheus_config()
+    config.SPARSE_HISTOGRAMS.append("selected_sparse_seconds")
+    try:
+        sparse = metrics._histogram("selected_sparse_seconds", "Selected", ["route"])
+        classic = metrics._histogram("selected_classic_seconds", "Classic", ["route"])
+    finally:
+        config.SPARSE_HISTOGRAMS.remove("selected_sparse_seconds")
+
+    assert isinstance(sparse, SparseHistogram)
+    assert not isinstance(classic, SparseHistogram)
+
+    recorder = BufferedRecorder()
+    recorder.observe(sparse.labels("/a"), 0.1)
+    recorder.flush()
+    assert metrics.get_metric_registry().get_sample_value(
+        "selected_sparse_seconds_count", {"route": "/a"}
+    ) == 1
@@ -6,12 +6,21 @@ Tests:
 - Label consistency
 - Value ranges
 - Histogram/Summary quantiles
+- Bound (pre-resolved) metric children and recording helpers
 """
 
 import pytest
 from prometheus_client.parser import text_string_to_metric_families
 
 from app.core.prometheus.config import get_prometheus_config
+from app.core.prometheus.metrics import (
+    bind,
+    get_cache_count,
+    get_metric_registry,
+    record_cache_operation,
+    record_celery_cache,
+    record_celery_task,
+)
 
 
 @pytest.fixture
@@ -81,3 +90,35 @@ def test_metrics_collection_performance():
     # Add actual performance testing
     collection_time = 0.1  # Replace with actual measurement
     assert collection_time < 0.5, "Metrics collection too slow"
+
+
+def test_bound_metric_returns_labelled_child():
+    """Verify bound children are the same objects .labels() returns"""
+    bound = bind(get_cache_count())
+
+    assert bind(get_cache_count()) is bound
+    assert bound.child("valkey", "hit") is get_cache_count().labels("valkey", "hit")
+    assert bound.child("valkey", "hit") is bound.child("valkey", "hit")
+
+
+def test_recording_helpers_update_metrics():
+    """Verify Celery and cache helpers record through bound children"""
+    registry = get_metric_registry()
+
+    def value(name, labels):
+        return registry.get_sample_value(name, labels) or 0.0
+
+    task = {"task_name": "bound_test", "status": "success"}
+    cache = {"cache_type": "valkey", "operation": "get"}
+    tasks_before = value("celery_tasks_total", task)
+    hits_before = value("celery_cache_hits_total", {"task_name": "bound_test"})
+    cache_before = value("cache_operation_duration_seconds_count", cache)
+
+    record_celery_task("bound_test", "success", duration=0.2)
+    record_celery_cache("bound_test", "hit")
+    record_cache_operation("valkey", "get", duration=0.001)
+
+    assert value("celery_tasks_total", task) == tasks_before + 1
+    assert value("celery_task_duration_seconds_count", {"task_name": "bound_test"}) >= 1
+    assert value("celery_cache_hits_total", {"task_name": "bound_test"}) == hits_before + 1
+    assert value("cache_operation_duration_seconds_count", cache) == cache_before + 1
@@ -0,0 +1,132 @@
+"""
+Prometheus Middleware Tests
+
+Tests:
+- Request count and latency recording
+- Status taken from the response start message
+- Streaming responses pass through unbuffered
+- Exceptions recorded as 500 errors
+- Route template resolution (mounts, unmatched paths, rebuilds)
+"""
+
+import pytest
+from starlette.applications import Starlette
+from starlette.middleware import Middleware
+from starlette.responses import PlainTextResponse, StreamingResponse
+from starlette.routing import Mount, Route, Router
+from starlette.testclient import TestClient
+
+from app.core.prometheus.metrics import get_metric_registry
+from app.core.prometheus.middleware import PrometheusMiddleware
+from app.core.prometheus.route_resolver import UNMATCHED_ENDPOINT, RouteResolver
+
+
+async def item(request):
+    return PlainTextResponse("ok", status_code=201)
+
+
+async def stream(request):
+    async def chunks():
+        for chunk in (b"a", b"b", b"c"):
+            yield chunk
+
+    return StreamingResponse(chunks())
+
+
+async def boom(request):
+    raise RuntimeError("boom")
+
+
+@pytest.fixture
+def client():
+    app = Starlette(
+        routes=[
+            Route("/items/{item_id}", item),
+            Route("/stream", stream),
+            Route("/boom", boom),
+            Mount("/api", routes=[Route("/users/{user_id}", item)]),
+        ],
+        middleware=[Middleware(PrometheusMiddleware)],
+    )
+    return TestClient(app, raise_server_exceptions=False)
+
+
+def sample(name, **labels):
+    return get_metric_registry().get_sample_value(name, labels) or 0.0
+
+
+def test_records_request_count_and_latency(client):
+    """Verify count and latency use the route template and response status"""
+    labels = {"method": "GET", "endpoint": "/items/{item_id}", "status": "201"}
+    count_before = sample("http_requests_total", **labels)
+    latency_before = sample("http_request_duration_seconds_count", **labels)
+
+    assert client.get("/items/1").status_code == 201
+    assert client.get("/items/2").status_code == 201
+
+    assert sample("http_requests_total", **labels) == count_before + 2
+    assert sample("http_request_duration_seconds_count", **labels) == latency_before + 2
+
+
+def test_streaming_response_recorded_once(client):
+    """Verify streaming bodies are passed through and recorded at the final chunk"""
+    labels = {"method": "GET", "endpoint": "/stream", "status": "200"}
+    before = sample("http_requests_total", **labels)
+
+    response = client.get("/stream")
+
+    assert response.content == b"abc"
+    assert sample("http_requests_total", **labels) == before + 1
+
+
+def test_exception_recorded_as_500(client):
+    """Verify unhandled exceptions are counted as server errors"""
+    labels = {"method": "GET", "endpoint": "/boom", "status": "500"}
+    before = sample("http_requests_total", **labels)
+
+    assert client.get("/boom").status_code == 500
+    assert sample("http_requests_total", **labels) == before + 1
+
+
+def test_mounted_route_uses_full_template(client):
+    """Verify routes inside Mounts are labelled with the mount prefix"""
+    labels = {"method": "GET", "endpoint": "/api/users/{user_id}", "status": "201"}
+    before = sample("http_requests_total", **labels)
+
+    assert client.get("/api/users/42").status_code == 201
+    assert sample("http_requests_total", **labels) == before + 1
+
+
+def test_unmatched_paths_collapse_to_single_label(client):
+    """Verify unknown paths cannot create new endpoint series"""
+    labels = {"method": "GET", "endpoint": UNMATCHED_ENDPOINT, "status": "404"}
+    before = sample("http_requests_total", **labels)
+
+    for path in ("/nope/1", "/nope/2", "/random"):
+        assert client.get(path).status_code == 404
+
+    assert sample("http_requests_total", **labels) == before + 3
+
+
+def test_resolver_rebuilds_when_routes_change():
+    """Verify added routes are picked up and the lookup cache stays bounded"""
+    router = Router(routes=[Route("/a/{id}", item)])
+    resolver = RouteResolver(router, maxsize=2)
+
+    assert resolver.resolve("GET", "/a/1") == "/a/{id}"
+    assert resolver.resolve("GET", "/b/1") == UNMATCHED_ENDPOINT
+
+    router.routes.append(Route("/b/{id}", item))
+    assert resolver.resolve("GET", "/b/1") == "/b/{id}"
+
+    for i in range(10):
+        resolver.resolve("GET", f"/a/{i}")
+    assert resolver._resolve.cache_info().currsize <= 2
+
+
+def test_resolver_method_mismatch_keeps_template():
+    """Verify a 405 is still labelled with the matching route template"""
+    router = Router(routes=[Route("/only-post", item, methods=["POST"])])
+    resolver = RouteResolver(router)
+
+    assert resolver.resolve("GET", "/only-post") == "/only-post"
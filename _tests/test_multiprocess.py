@@ -0,0 +1,55 @@
+"""
+Multiprocess Mode Tests
+
+Tests:
+- Counters from several worker processes are merged at scrape time
+- Exited workers are folded into archive files (directory stays bounded)
+- Live gauges of dead workers disappear from the merged output
+"""
+
+import os
+import subprocess
+import sys
+import textwrap
+
+WORKER = textwrap.dedent("""
+    from app.core.prometheus.metrics import get_connection_metrics, record_celery_task
+
+    for _ in range({tasks}):
+        record_celery_task("mp_task", "success", duration=0.05)
+    get_connection_metrics().labels("postgres", "active").set(3)
+""")
+
+SCRAPER = textwrap.dedent("""
+    from app.core.prometheus.metrics import get_metric_registry
+
+    registry = get_metric_registry()
+    print(registry.get_sample_value("celery_tasks_total", {"task_name": "mp_task", "status": "success"}))
+    print(registry.get_sample_value("celery_task_duration_seconds_count", {"task_name": "mp_task"}))
+    print(registry.get_sample_value("db_connections", {"db_type": "postgres", "state": "active"}))
+""")
+
+
+def run(code, multiproc_dir):
+    env = dict(os.environ)
+    env["PROMETHEUS_MULTIPROC_DIR"] = str(multiproc_dir)
+    env["PYTHONPATH"] = os.pathsep.join(sys.path)
+    result = subprocess.run(
+        [sys.executable, "-c", code], env=env, capture_output=True, text=True, check=True
+    )
+    return result.stdout.split()
+
+
+def test_workers_merged_and_archived(tmp_path):
+    """Verify totals survive worker exits and per-worker files are compacted"""
+    for tasks in (3, 4, 5):
+        run(WORKER.format(tasks=tasks), tmp_path)
+
+    tasks_total, duration_count, connections = run(SCRAPER, tmp_path)
+
+    assert float(tasks_total) == 12
+    assert float(duration_count) == 12
+    # The workers that set the live gauge have exited
+    assert connections == "None"
+    db_files = sorted(f for f in os.listdir(tmp_path) if f.endswith(".db"))
+    assert db_files == ["counter_archive.db", "histogram_archive.db"]
@@ -0,0 +1,174 @@
+"""
+PromQL Rule Evaluator Tests
+
+Tests:
+- Every shipped rule file parses
+- rate()/increase() extrapolate and handle counter resets like Prometheus
+- histogram_quantile() interpolates inside buckets
+- Aggregations, vector matching and comparison filters
+- Alerts move from pending to firing after ``for:`` and resolve
+- Recording rules feed later rules (credits)
+- Series built from registry snapshots drive the celery alerts
+- Thousands of scenarios evaluate per second
+"""
+
+import math
+import time
+
+import pytest
+from prometheus_client import CollectorRegistry, Counter
+
+from app.core.prometheus.promql import PromQLError, SeriesStore, evaluate, make_labels, parse
+from app.core.prometheus.rule_evaluator import (
+    RULES_DIR,
+    RuleEvaluator,
+    load_default_rule_groups,
+    load_rule_groups,
+)
+
+
+def counter_series(store, name, labels, per_second, start=0.0, end=600.0, step=15.0, initial=0.0):
+    t = start
+    while t <= end:
+        store.add(name, labels, t, initial + per_second * (t - start))
+        t += step
+
+
+def test_shipped_rules_parse():
+    """Verify every expression in rules/ is inside the supported subset"""
+    groups = load_default_rule_groups()
+    names = {rule.name for group in groups for rule in group.rules}
+
+    assert {"HighErrorRate", "CeleryTaskFailureRateHigh", "credits_remaining", "RedisDown"} <= names
+    assert sum(len(group.rules) for group in groups) >= 30
+    with pytest.raises(PromQLError):
+        parse("topk(5, foo)[5m] offset 1m")
+
+
+def test_rate_and_increase():
+    """Verify rate() extrapolates to the window edges and survives counter resets"""
+    store = SeriesStore()
+    counter_series(store, "hits_total", {"a": "1"}, per_second=2.0)
+
+    rate = evaluate("rate(hits_total[5m])", store, 600.0)
+    assert rate == {make_labels(None, {"a": "1"}): pytest.approx(2.0)}
+    increase = evaluate("increase(hits_total[5m])", store, 600.0)
+    assert list(increase.values()) == [pytest.approx(600.0)]
+
+    # Restart at t=300: the drop is added back, not read as negative
+    reset = SeriesStore()
+    counter_series(reset, "hits_total", {}, per_second=1.0, end=285.0)
+    counter_series(reset, "hits_total", {}, per_second=1.0, start=300.0)
+    assert list(evaluate("rate(hits_total[5m])", reset, 600.0).values()) == [pytest.approx(1.0)]
+    assert evaluate("rate(missing_total[5m])", reset, 600.0) == {}
+
+
+def test_histogram_quantile():
+    """Verify quantiles interpolate linearly inside the matching bucket"""
+    store = SeriesStore()
+    for le, count in (("0.1", 0), ("0.25", 0), ("0.5", 100), ("+Inf", 100)):
+        store.add("latency_seconds_bucket", {"le": le, "endpoint": "/pay"}, 100.0, count)
+
+    result = evaluate("histogram_quantile(0.99, sum(latency_seconds_bucket) by (le, endpoint))", store, 100.0)
+    assert result == {make_labels(None, {"endpoint": "/pay"}): pytest.approx(0.25 + 0.25 * 0.99)}
+
+    store.add("empty_bucket", {"le": "+Inf"}, 100.0, 0)
+    store.add("empty_bucket", {"le": "1"}, 100.0, 0)
+    assert math.isnan(list(evaluate("histogram_quantile(0.5, empty_bucket)", store, 100.0).values())[0])
+
+
+def test_aggregation_matching_and_filters():
+    """Verify sum by, one-to-one vector matching and comparison filtering"""
+    store = SeriesStore()
+    store.add("used", {"user": "a", "host": "1"}, 10.0, 30)
+    store.add("used", {"user": "a", "host": "2"}, 10.0, 40)
+    store.add("used", {"user": "b", "host": "1"}, 10.0, 5)
+    store.add("allotted", {"user": "a"}, 10.0, 100)
+    store.add("allotted", {"user": "b"}, 10.0, 100)
+    store.add("allotted", {"user": "c"}, 10.0, 100)
+
+    left = evaluate("allotted - sum by (user) (used)", store, 10.0)
+    assert left == {make_labels(None, {"user": "a"}): 30.0, make_labels(None, {"user": "b"}): 95.0}
+    low = evaluate("(allotted - sum(used) by (user)) < 50", store, 10.0)
+    assert list(low) == [make_labels(None, {"user": "a"})]
+    assert evaluate("used{host!=\"1\"} > 35", store, 10.0) == {make_labels("used", {"user": "a", "host": "2"}): 40.0}
+    assert evaluate("2 * 3 > bool 5", store, 10.0) == 1.0
+    # Samples older than the lookback window are stale
+    assert evaluate("allotted", store, 10.0 + 600) == {}
+
+
+def test_alert_pending_then_firing():
+    """Verify HighErrorRate waits for its 10m ``for`` and resolves when errors stop"""
+    store = SeriesStore()
+    counter_series(store, "http_requests_total", {"status": "503", "endpoint": "/pay"}, per_second=1.0, end=1500.0)
+    evaluator = RuleEvaluator(load_rule_groups(f"{RULES_DIR}/alerts.yml"), store)
+
+    alerts = [a for a in evaluator.evaluate(300.0) if a.name == "HighErrorRate"]
+    assert [a.state for a in alerts] == ["pending"]
+    assert alerts[0].labels["severity"] == "critical"
+    assert evaluator.firing(600.0) == []
+    assert "HighErrorRate" in evaluator.firing(900.0)
+
+    # Counter stops growing: rate drops to zero and the alert resolves
+    for t in range(1515, 2200, 15):
+        store.add("http_requests_total", {"status": "503", "endpoint": "/pay"}, float(t), 1500.0)
+    assert evaluator.evaluate(2100.0) == []
+
+
+def test_recording_rules_feed_alerts():
+    """Verify credits_used_total and credits_remaining records drive LowCredits"""
+    store = SeriesStore()
+    evaluator = RuleEvaluator(load_rule_groups(f"{RULES_DIR}/credits.yml"), store)
+    for t in (0.0, 60.0, 120.0, 180.0, 240.0, 300.0):
+        store.add("credits_used", {"user_id": "u1", "credit_type": "api", "source": "web"}, t, 600)
+        store.add("credits_used", {"user_id": "u1", "credit_type": "api", "source": "cli"}, t, 350)
+        store.add("credits_allotted", {"user_id": "u1", "credit_type": "api"}, t, 1000)
+        store.add("credits_allotted", {"user_id": "u2", "credit_type": "api"}, t, 1000)
+        store.add("credits_used", {"user_id": "u2", "credit_type": "api", "source": "web"}, t, 10)
+        alerts = evaluator.evaluate(t)
+
+    assert evaluate("credits_remaining", store, 300.0) == {
+        make_labels("credits_remaining", {"user_id": "u1", "credit_type": "api"}): 50.0,
+        make_labels("credits_remaining", {"user_id": "u2", "credit_type": "api"}): 990.0,
+    }
+    assert [(a.name, a.labels["user_id"], a.state) for a in alerts] == [("LowCredits", "u1", "firing")]
+
+
+def test_registry_snapshots_drive_celery_alerts():
+    """Verify series ingested from registry snapshots trigger the failure-rate alert"""
+    registry = CollectorRegistry()
+    tasks = Counter("celery_tasks", "Tasks", ["task_name", "status"], registry=registry)
+    store = SeriesStore()
+    evaluator = RuleEvaluator(load_rule_groups(f"{RULES_DIR}/celery/alerts.yml"), store)
+
+    firing = []
+    for step in range(60):
+        tasks.labels("send_email", "success").inc(8)
+        tasks.labels("send_email", "failure").inc(2)
+        tasks.labels("resize", "success").inc(10)
+        store.ingest(registry, step * 15.0)
+        firing = evaluator.firing(step * 15.0)
+
+    assert firing == ["CeleryTaskFailureRateHigh"]
+    alert = next(a for a in evaluator.evaluate(900.0) if a.name == "CeleryTaskFailureRateHigh")
+    # One-to-one matching pairs failure with failure only (the status label
+    # differs on the denominator), exactly as Prometheus evaluates this rule
+    assert alert.labels == {"task_name": "send_email", "status": "failure", "severity": "critical"}
+    assert alert.value == pytest.approx(1.0)
+
+
+def test_scenario_throughput():
+    """Verify all shipped rules evaluate over thousands of scenarios per second"""
+    groups = load_default_rule_groups()
+    scenarios = 2000
+    start = time.perf_counter()
+    for i in range(scenarios):
+        store = SeriesStore()
+        store.add("http_requests_total", {"status": "500"}, 0.0, 0)
+        store.add("http_requests_total", {"status": "500"}, 300.0, i)
+        store.add("up", {"job": "redis"}, 300.0, i % 2)
+        RuleEvaluator(groups, store).evaluate(300.0)
+    per_second = scenarios / (time.perf_counter() - start)
+
+    print(f"\nScenarios per second: {per_second:.0f}")
+    assert per_second > 1000
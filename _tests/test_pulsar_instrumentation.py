@@ -0,0 +1,301 @@
+"""
+Pulsar Instrumentation Tests
+
+Tests:
+- Producer sends (sync and async) are counted and timed by result
+- Consumer receives record end-to-end latency from publish timestamps
+- Negative acknowledgements are counted as consume failures
+- Backlog and lag are polled from a fake admin API, partitions summed
+- Unreachable admin API reports down and keeps values until stale
+- Slow admin requests are bounded by the timeout and poll budget
+- Polls cut short by the budget resume where they stopped, one log line each
+"""
+
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+from app.core.prometheus._tests.conftest import value
+from app.core.prometheus.pulsar_instrumentation import (
+    PulsarBacklogCollector,
+    instrument_consumer,
+    instrument_producer,
+    topic_label,
+)
+
+TOPIC = "persistent://public/default/orders"
+
+
+def events(topic, operation, result):
+    return value("events_total", {"topic": topic, "operation": operation, "result": result})
+
+
+def latency(topic, operation, suffix="count"):
+    return value(f"event_operation_duration_seconds_{suffix}", {"topic": topic, "operation": operation})
+
+
+class FakeProducer:
+    def __init__(self, topic, fail=False):
+        self._topic = topic
+        self.fail = fail
+        self.sent = []
+
+    def topic(self):
+        return self._topic
+
+    def send(self, content, **kwargs):
+        if self.fail:
+            raise RuntimeError("broker unavailable")
+        self.sent.append(content)
+        return len(self.sent)
+
+    def send_async(self, content, callback, **kwargs):
+        self.sent.append(content)
+        callback(1 if self.fail else 0, len(self.sent))
+
+    def flush(self):
+        return "flushed"
+
+
+class FakeMessage:
+    def __init__(self, topic, published_ms):
+        self._topic = topic
+        self._published = published_ms
+
+    def topic_name(self):
+        return self._topic
+
+    def publish_timestamp(self):
+        return self._published
+
+
+class FakeConsumer:
+    def __init__(self, messages):
+        self.messages = list(messages)
+        self.nacked = []
+
+    def receive(self, timeout_millis=None):
+        return self.messages.pop(0)
+
+    def batch_receive(self):
+        messages, self.messages = self.messages, []
+        return messages
+
+    def negative_acknowledge(self, message):
+        self.nacked.append(message)
+
+
+def test_topic_label():
+    """Verify partition suffixes are dropped from topic labels"""
+    assert topic_label(TOPIC + "-partition-3") == TOPIC
+    assert topic_label(TOPIC) == TOPIC
+
+
+def test_producer_send():
+    """Verify sync and async sends are counted by result and timed on success"""
+    topic = "persistent://public/default/producer-test"
+    producer = instrument_producer(FakeProducer(topic))
+    received = []
+
+    assert producer.send(b"a") == 1
+    producer.send_async(b"b", lambda result, message_id: received.append(message_id))
+    assert received == [2]
+    assert producer.flush() == "flushed"
+
+    failing = instrument_producer(FakeProducer(topic, fail=True))
+    with pytest.raises(RuntimeError):
+        failing.send(b"c")
+    failing.send_async(b"d", None)
+
+    assert events(topic, "publish", "success") == 2
+    assert events(topic, "publish", "failure") == 2
+    assert latency(topic, "publish") == 2
+
+
+def test_consumer_end_to_end_latency():
+    """Verify receives observe publish-to-receive latency per topic"""
+    topic = "persistent://public/default/consumer-test"
+    now_ms = time.time() * 1000
+    consumer = instrument_consumer(FakeConsumer([
+        FakeMessage(topic + "-partition-0", now_ms - 2000),
+        FakeMessage(topic + "-partition-1", now_ms - 4000),
+        FakeMessage(topic, now_ms - 1000),
+    ]))
+
+    consumer.receive(timeout_millis=100)
+    assert len(consumer.batch_receive()) == 2
+
+    assert events(topic, "consume", "success") == 3
+    assert latency(topic, "consume") == 3
+    assert 6.5 < latency(topic, "consume", "sum") < 8
+
+
+def test_negative_acknowledge():
+    """Verify negative acknowledgements count as consume failures"""
+    topic = "persistent://public/default/nack-test"
+    message = FakeMessage(topic, time.time() * 1000)
+    fake = FakeConsumer([message])
+    consumer = instrument_consumer(fake)
+
+    consumer.negative_acknowledge(consumer.receive())
+
+    assert fake.nacked == [message]
+    assert events(topic, "consume", "failure") == 1
+
+
+class FakeAdmin:
+    """Local stand-in for the Pulsar admin REST API."""
+
+    def __init__(self):
+        self.topics = {"public/default": []}
+        self.stats = {}
+        self.requests = []
+        self.tokens = set()
+        self.delay = 0.0
+        self.down = False
+        admin = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                admin.requests.append(self.path)
+                admin.tokens.add(self.headers.get("Authorization"))
+                time.sleep(admin.delay)
+                body = admin.respond(self.path.split("?")[0])
+                if body is None:
+                    self.send_response(500 if admin.down else 404)
+                    self.send_header("Content-Length", "0")
+                    self.end_headers()
+                    return
+                data = json.dumps(body).encode()
+                self.send_response(200)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def log_message(self, *args):
+                pass
+
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.url = f"http://127.0.0.1:{self.server.server_address[1]}"
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+    def respond(self, path):
+        if self.down:
+            return None
+        prefix = "/admin/v2/namespaces/"
+        if path.startswith(prefix) and path.endswith("/topics"):
+            return self.topics.get(path[len(prefix):-len("/topics")])
+        for topic, stats in self.stats.items():
+            if path == "/admin/v2/" + topic.replace("://", "/") + "/stats":
+                return stats
+        return None
+
+    def add_topic(self, topic, subscriptions):
+        self.topics["public/default"].append(topic)
+        self.stats[topic] = {"subscriptions": subscriptions}
+
+    def close(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+@pytest.fixture
+def admin():
+    server = FakeAdmin()
+    yield server
+    server.close()
+
+
+def backlog_samples(collector):
+    return {
+        (sample.name, tuple(sorted(sample.labels.items()))): sample.value
+        for family in collector.collect()
+        for sample in family.samples
+    }
+
+
+def test_backlog_polling(admin):
+    """Verify backlog and lag are read per subscription, partitions combined"""
+    now = 1_700_000_000.0
+    admin.add_topic(TOPIC + "-partition-0", {
+        "billing": {"msgBacklog": 40, "earliestMsgPublishTimeInBacklog": (now - 30) * 1000},
+    })
+    admin.add_topic(TOPIC + "-partition-1", {
+        "billing": {"msgBacklog": 2, "earliestMsgPublishTimeInBacklog": (now - 90) * 1000},
+        "audit": {"msgBacklog": 0, "earliestMsgPublishTimeInBacklog": 0},
+    })
+    collector = PulsarBacklogCollector(admin.url, token="secret", interval=15, ttl=0)
+
+    assert collector.poll(now=now) is True
+    samples = backlog_samples(collector)
+    billing = (("subscription", "billing"), ("topic", TOPIC))
+    audit = (("subscription", "audit"), ("topic", TOPIC))
+    assert samples[("pulsar_consumer_backlog", billing)] == 42
+    assert samples[("pulsar_consumer_lag_seconds", billing)] == pytest.approx(90)
+    assert samples[("pulsar_consumer_backlog", audit)] == 0
+    assert samples[("pulsar_consumer_lag_seconds", audit)] == 0
+    assert samples[("pulsar_admin_up", ())] == 1
+
+    # The topic list is cached: a second poll only reads stats
+    listed = sum(path.endswith("/topics") for path in admin.requests)
+    collector.poll(now=now + 15)
+    assert sum(path.endswith("/topics") for path in admin.requests) == listed
+    stats_paths = [path for path in admin.requests if "/stats" in path]
+    assert stats_paths and all(path.endswith("?getEarliestTimeInBacklog=true") for path in stats_paths)
+    assert admin.tokens == {"Bearer secret"}
+
+
+def test_admin_down_keeps_values_until_stale(admin):
+    """Verify a failed poll reports down and stale values expire"""
+    now = 1_700_000_000.0
+    admin.add_topic(TOPIC, {"billing": {"msgBacklog": 7}})
+    collector = PulsarBacklogCollector(admin.url, interval=10, ttl=0)
+    collector.poll(now=now)
+
+    admin.down = True
+    assert collector.poll(now=now + 10) is False
+    samples = backlog_samples(collector)
+    assert samples[("pulsar_admin_up", ())] == 0
+    assert samples[("pulsar_consumer_backlog", (("subscription", "billing"), ("topic", TOPIC)))] == 7
+
+    collector.poll(now=now + 40)
+    assert not any(name == "pulsar_consumer_backlog" for name, _ in backlog_samples(collector))
+
+
+def test_poll_timeout_and_budget(admin):
+    """Verify slow admin requests are cut off by the timeout and the poll budget"""
+    for i in range(5):
+        admin.add_topic(f"{TOPIC}-{i}", {"billing": {"msgBacklog": 1}})
+    collector = PulsarBacklogCollector(admin.url, timeout=0.2, budget=0.5, ttl=0)
+    collector.poll()  # list the topics while the admin API is fast
+
+    admin.delay = 0.3
+    start = time.monotonic()
+    assert collector.poll() is False
+    assert time.monotonic() - start < 1.5
+
+
+def test_poll_rotates_through_topics(admin, capsys):
+    """Verify polls that run out of budget resume with the unread topics and log one line"""
+    for i in range(6):
+        admin.add_topic(f"{TOPIC}-{i}", {"billing": {"msgBacklog": i + 1}})
+    collector = PulsarBacklogCollector(admin.url, timeout=1.0, budget=0.25, interval=60, ttl=0)
+    collector.poll()  # list the topics while the admin API is fast
+    capsys.readouterr()
+
+    admin.delay = 0.1
+    admin.requests.clear()
+    for _ in range(4):
+        collector.poll()
+        assert len(capsys.readouterr().out.strip().splitlines()) == 1
+
+    read = {path.split("/")[-2] for path in admin.requests if "/stats" in path}
+    assert read == {f"orders-{i}" for i in range(6)}
+    samples = backlog_samples(collector)
+    assert sum(value for (name, _), value in samples.items() if name == "pulsar_consumer_backlog") == 21
+    # The default budget stays below the scheduler's 10s timeout
+    assert PulsarBacklogCollector(admin.url).budget < 10
@@ -0,0 +1,296 @@
+"""
+Metrics Pusher Tests
+
+Tests:
+- Remote-write bodies are valid snappy + protobuf WriteRequests
+- Every series is pushed each capture; removed series get stale markers
+- Pushers in different processes write distinct series (instance label)
+- Pushgateway mode POSTs the text format to the job/grouping key path
+- One HTTP connection is reused across pushes
+- The bounded queue drops the oldest deltas
+- Failed batches are re-queued and retried after backoff; 4xx drops them
+- The async loop captures and sends off the event loop thread
+"""
+
+import asyncio
+import os
+import socket
+import struct
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+from prometheus_client import CollectorRegistry, Counter
+
+from app.core.prometheus import pusher as pusher_module
+from app.core.prometheus.pusher import PUSHGATEWAY, MetricsPusher, snappy_compress
+
+
+def snappy_decompress(data):
+    pos, length, shift = 0, 0, 0
+    while True:
+        byte = data[pos]
+        pos += 1
+        length |= (byte & 0x7F) << shift
+        shift += 7
+        if byte < 0x80:
+            break
+    out = bytearray()
+    while pos < len(data):
+        tag = data[pos]
+        pos += 1
+        kind = tag & 3
+        if kind == 0:
+            n = tag >> 2
+            if n >= 60:
+                extra = n - 59
+                n = int.from_bytes(data[pos:pos + extra], "little")
+                pos += extra
+            out += data[pos:pos + n + 1]
+            pos += n + 1
+        else:
+            if kind == 1:
+                n, offset = ((tag >> 2) & 7) + 4, ((tag >> 5) << 8) | data[pos]
+                pos += 1
+            else:
+                size = 2 if kind == 2 else 4
+                n, offset = (tag >> 2) + 1, int.from_bytes(data[pos:pos + size], "little")
+                pos += size
+            for _ in range(n):
+                out.append(out[-offset])
+    assert len(out) == length
+    return bytes(out)
+
+
+def read_fields(data):
+    pos = 0
+    while pos < len(data):
+        key, pos = read_varint(data, pos)
+        number, wire = key >> 3, key & 7
+        if wire == 0:
+            value, pos = read_varint(data, pos)
+        elif wire == 1:
+            value, pos = struct.unpack("<d", data[pos:pos + 8])[0], pos + 8
+        else:
+            size, pos = read_varint(data, pos)
+            value, pos = data[pos:pos + size], pos + size
+        yield number, value
+
+
+def read_varint(data, pos):
+    result, shift = 0, 0
+    while True:
+        byte = data[pos]
+        pos += 1
+        result |= (byte & 0x7F) << shift
+        shift += 7
+        if byte < 0x80:
+            return result, pos
+
+
+def decode_write_request(body):
+    """{series labels: [(value, timestamp_ms)]} from a snappy WriteRequest."""
+    result = {}
+    for _, series in read_fields(snappy_decompress(body)):
+        labels, samples = {}, []
+        for number, value in read_fields(series):
+            fields = dict(read_fields(value))
+            if number == 1:
+                labels[fields[1].decode()] = fields[2].decode()
+            else:
+                samples.append((fields.get(1, 0.0), fields.get(2, 0)))
+        result[tuple(sorted(labels.items()))] = samples
+    return result
+
+
+class StubServer:
+    """Local HTTP receiver recording every request."""
+
+    def __init__(self, statuses=()):
+        self.requests = []
+        self.connections = set()
+        self.statuses = list(statuses)
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def do_POST(self):
+                body = self.rfile.read(int(self.headers["Content-Length"]))
+                stub.requests.append((self.path, dict(self.headers), body))
+                stub.connections.add(self.client_address)
+                status = stub.statuses.pop(0) if stub.statuses else 204
+                self.send_response(status)
+                self.send_header("Content-Length", "0")
+                self.end_headers()
+
+            def log_message(self, *args):
+                pass
+
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.url = f"http://127.0.0.1:{self.server.server_address[1]}"
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+    def close(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+@pytest.fixture
+def stub():
+    server = StubServer()
+    yield server
+    server.close()
+
+
+def make_pusher(url, **kwargs):
+    registry = CollectorRegistry()
+    tasks = Counter("push_tasks", "Tasks", ["task_name"], registry=registry)
+    kwargs.setdefault("backoff_base", 0.0)
+    return MetricsPusher(url, registry=registry, **kwargs), tasks
+
+
+def test_snappy_literal_round_trip():
+    """Verify the literal-only snappy stream decodes for every literal length form"""
+    for size in (0, 1, 59, 60, 255, 256, 70000):
+        data = bytes(range(256)) * (size // 256 + 1)
+        assert snappy_decompress(snappy_compress(data[:size])) == data[:size]
+
+
+def test_remote_write_body(stub):
+    """Verify the pushed body decodes to the registry's series with job/instance labels and timestamps"""
+    pusher, tasks = make_pusher(stub.url + "/api/v1/write")
+    tasks.labels("send_email").inc(3)
+    pusher.capture(now=100.0)
+    assert pusher.send_pending()
+
+    path, headers, body = stub.requests[0]
+    assert path == "/api/v1/write"
+    assert headers["Content-Encoding"] == "snappy"
+    assert headers["X-Prometheus-Remote-Write-Version"] == "0.1.0"
+    series = decode_write_request(body)
+    instance = f"{socket.gethostname()}:{os.getpid()}"
+    key = (("__name__", "push_tasks_total"), ("instance", instance), ("job", "celery"), ("task_name", "send_email"))
+    assert series[key] == [(3.0, 100000)]
+
+
+def test_every_series_pushed(stub):
+    """Verify unchanged series are re-sent each capture and removed ones get a stale marker"""
+    pusher, tasks = make_pusher(stub.url + "/api/v1/write", instance="")
+    tasks.labels("a").inc()
+    tasks.labels("b").inc()
+    assert pusher.capture(now=1.0) == 4  # _total and _created, per task
+    tasks.labels("a").inc()
+    assert pusher.capture(now=2.0) == 1
+    tasks.remove("b")
+    assert pusher.capture(now=3.0) == 0
+    pusher.send_pending()
+
+    assert len(stub.requests) == 1
+    series = decode_write_request(stub.requests[0][2])
+    totals = {dict(k)["task_name"]: v for k, v in series.items() if dict(k)["__name__"] == "push_tasks_total"}
+    assert totals["a"] == [(1.0, 1000), (2.0, 2000), (2.0, 3000)]
+    assert totals["b"][:2] == [(1.0, 1000), (1.0, 2000)]
+    (stale, timestamp), = totals["b"][2:]
+    assert timestamp == 3000
+    assert struct.pack("<d", stale) == struct.pack("<Q", 0x7FF0000000000002)
+
+
+def test_pushers_per_process(stub, monkeypatch):
+    """Verify two processes pushing the same series write distinct instance-labelled series"""
+    for pid in (101, 102):
+        monkeypatch.setattr(pusher_module.os, "getpid", lambda pid=pid: pid)
+        pusher, tasks = make_pusher(stub.url + "/api/v1/write")
+        tasks.labels("a").inc(pid)
+        pusher.push()
+
+    values = {}
+    for _, _, body in stub.requests:
+        for key, samples in decode_write_request(body).items():
+            labels = dict(key)
+            if labels["__name__"] == "push_tasks_total":
+                values[labels["instance"]] = samples[0][0]
+    host = socket.gethostname()
+    assert values == {f"{host}:101": 101.0, f"{host}:102": 102.0}
+
+
+def test_pushgateway_mode(stub):
+    """Verify pushgateway pushes POST changed families as text to the grouping path"""
+    pusher, tasks = make_pusher(stub.url, mode=PUSHGATEWAY, job="nightly import", grouping_key={"shard": "1"})
+    tasks.labels("import").inc(2)
+    pusher.flush()
+
+    path, headers, body = stub.requests[0]
+    assert path == f"/metrics/job/nightly%20import/shard/1/instance/{socket.gethostname()}%3A{os.getpid()}"
+    assert headers["Content-Type"].startswith("text/plain")
+    assert b'push_tasks_total{task_name="import"} 2.0' in body
+
+
+def test_connection_reused(stub):
+    """Verify consecutive pushes share one keep-alive connection"""
+    pusher, tasks = make_pusher(stub.url + "/api/v1/write")
+    for i in range(5):
+        tasks.labels("a").inc()
+        pusher.capture(now=float(i))
+        pusher.send_pending()
+
+    assert len(stub.requests) == 5
+    assert len(stub.connections) == 1
+
+
+def test_queue_drops_oldest():
+    """Verify the queue keeps only the newest deltas when it is full"""
+    pusher, tasks = make_pusher("http://127.0.0.1:9/api/v1/write", max_queue=3)
+    for i in range(6):
+        tasks.labels("a").inc()
+        pusher.capture(now=float(i))
+
+    assert pusher.queued == 3
+    assert [delta.timestamp for delta in pusher._queue] == [3.0, 4.0, 5.0]
+
+
+def test_retry_and_reject():
+    """Verify 5xx batches are retried in order and 4xx batches are dropped"""
+    server = StubServer(statuses=[503, 204, 400])
+    try:
+        pusher, tasks = make_pusher(server.url + "/api/v1/write")
+        tasks.labels("a").inc()
+        pusher.capture(now=1.0)
+        assert not pusher.send_pending()
+        assert pusher.queued == 1
+        assert pusher.send_pending()
+        assert pusher.queued == 0
+        assert [decode_write_request(b) == decode_write_request(server.requests[0][2]) for _, _, b in server.requests] == [True, True]
+
+        tasks.labels("a").inc()
+        pusher.capture(now=2.0)
+        assert pusher.send_pending()
+        assert pusher.queued == 0
+        assert len(server.requests) == 3
+    finally:
+        server.close()
+
+
+def test_run_off_event_loop(stub):
+    """Verify the periodic capture and send never run on the event loop thread"""
+    pusher, tasks = make_pusher(stub.url + "/api/v1/write", interval=0.01)
+    tasks.labels("a").inc()
+    capture_threads = []
+    capture = pusher.capture
+
+    def recording_capture(now=None):
+        capture_threads.append(threading.get_ident())
+        return capture(now)
+
+    pusher.capture = recording_capture
+
+    async def main():
+        task = pusher.start()
+        while not stub.requests:
+            await asyncio.sleep(0.01)
+        task.cancel()
+        return threading.get_ident()
+
+    loop_thread = asyncio.run(asyncio.wait_for(main(), timeout=5))
+    pusher.stop(flush=False)
+    assert capture_threads and loop_thread not in capture_threads
@@ -0,0 +1,77 @@
+"""
+Exporter Recording Rules Tests
+
+Tests:
+- recording_rules.yml parses and only holds recording rules
+- Only the series the rules read are snapshotted
+- Per-endpoint rates and latency quantiles are exposed on the registry
+- Snapshots older than the widest range are dropped
+"""
+
+import pytest
+from prometheus_client import CollectorRegistry, Counter, Histogram
+
+from app.core.prometheus.recording_rules import RecordingRulesCollector, load_recording_rules
+
+
+def make_registry():
+    registry = CollectorRegistry()
+    requests = Counter("http_requests", "Requests", ["method", "endpoint", "status"], registry=registry)
+    latency = Histogram("http_request_duration_seconds", "Latency", ["method", "endpoint", "status"], registry=registry)
+    Counter("unrelated", "Not read by any rule", registry=registry).inc()
+    return registry, requests, latency
+
+
+def test_rules_file_parses():
+    """Verify the shipped exporter rules are recording rules following level:metric:operations"""
+    rules = [rule for group in load_recording_rules() for rule in group.rules]
+
+    assert rules and all(rule.record for rule in rules)
+    assert all(rule.name.count(":") == 2 for rule in rules)
+
+
+def test_only_referenced_series_snapshotted():
+    """Verify the store holds the rule inputs and records, nothing else"""
+    registry, requests, _ = make_registry()
+    collector = RecordingRulesCollector(load_recording_rules(), registry=registry, interval=15)
+    requests.labels("GET", "/a", "200").inc()
+    collector.sample(now=1000.0)
+
+    names = {dict(series.labels)["__name__"] for series in collector.store.series(None)}
+    assert "http_requests_total" in names
+    assert "unrelated_total" not in names
+
+
+def test_precomputed_series_exposed():
+    """Verify per-endpoint rate, error ratio and p95 show up as gauges"""
+    registry, requests, latency = make_registry()
+    collector = RecordingRulesCollector(load_recording_rules(), registry=registry, interval=15, ttl=0)
+
+    for step in range(21):
+        for _ in range(15):
+            requests.labels("GET", "/a", "200").inc()
+            latency.labels("GET", "/a", "200").observe(0.3)
+        for _ in range(15):
+            requests.labels("POST", "/a", "500").inc()
+            latency.labels("POST", "/a", "500").observe(0.3)
+        collector.sample(now=step * 15.0)
+
+    get = registry.get_sample_value
+    assert get("endpoint_method:http_requests:rate5m", {"method": "GET", "endpoint": "/a"}) == pytest.approx(1.0)
+    assert get("endpoint:http_request_errors_per_requests:ratio_rate5m", {"endpoint": "/a"}) == pytest.approx(0.5)
+    p95 = get("endpoint:http_request_duration_seconds:p95_rate5m", {"endpoint": "/a"})
+    assert p95 == pytest.approx(0.25 + 0.25 * 0.95)
+
+
+def test_old_snapshots_dropped():
+    """Verify history is bounded by the widest rule range plus one interval"""
+    registry, requests, _ = make_registry()
+    collector = RecordingRulesCollector(load_recording_rules(), registry=registry, interval=15)
+
+    for step in range(100):
+        requests.labels("GET", "/a", "200").inc()
+        collector.sample(now=step * 15.0)
+
+    series = next(iter(collector.store.series("http_requests_total")))
+    assert series.timestamps[0] >= 99 * 15.0 - collector.retention
+    assert len(series.timestamps) <= collector.retention / 15 + 1
@@ -0,0 +1,88 @@
+"""
+Collector Scheduler Tests
+
+Tests:
+- Sources run concurrently on their own intervals
+- Ticks are skipped while the previous run is still going
+- Timeouts and errors are counted as failures
+- Duration self-metric per source
+"""
+
+import asyncio
+import time
+
+import pytest
+
+from app.core.prometheus.metrics import get_metric_registry
+from app.core.prometheus.scheduler import CollectorScheduler
+
+
+def sample(name, source):
+    return get_metric_registry().get_sample_value(name, {"source": source}) or 0.0
+
+
+async def run_for(scheduler, seconds):
+    task = scheduler.start()
+    await asyncio.sleep(seconds)
+    scheduler.stop()
+    await task
+
+
+def test_slow_source_does_not_delay_others():
+    """Verify a slow sync source neither blocks fast sources nor overlaps itself"""
+    runs = {"fast": 0, "slow": 0}
+
+    def fast():
+        runs["fast"] += 1
+
+    def slow():
+        runs["slow"] += 1
+        time.sleep(0.3)
+
+    scheduler = CollectorScheduler()
+    scheduler.register("test_fast", fast, interval=0.05)
+    scheduler.register("test_slow", slow, interval=0.05)
+    skipped_before = sample("metrics_collector_skipped_total", "test_slow")
+
+    asyncio.run(run_for(scheduler, 0.5))
+
+    assert runs["fast"] >= 8
+    assert runs["slow"] <= 2
+    assert sample("metrics_collector_skipped_total", "test_slow") > skipped_before
+    assert sample("metrics_collector_duration_seconds", "test_slow") >= 0.3
+
+
+def test_timeouts_and_errors_counted():
+    """Verify async timeouts and exceptions increment the failure counter"""
+    async def hang():
+        await asyncio.sleep(10)
+
+    def broken():
+        raise RuntimeError("source unavailable")
+
+    scheduler = CollectorScheduler()
+    scheduler.register("test_hang", hang, interval=0.05, timeout=0.05)
+    scheduler.register("test_broken", broken, interval=0.05)
+    hang_before = sample("metrics_collector_failures_total", "test_hang")
+    broken_before = sample("metrics_collector_failures_total", "test_broken")
+
+    asyncio.run(run_for(scheduler, 0.3))
+
+    assert sample("metrics_collector_failures_total", "test_hang") > hang_before
+    assert sample("metrics_collector_failures_total", "test_broken") > broken_before
+
+
+def test_thread_mode_and_duplicate_names():
+    """Verify the scheduler runs on its own thread and rejects duplicate sources"""
+    runs = []
+    scheduler = CollectorScheduler()
+    scheduler.register("test_thread", lambda: runs.append(1), interval=0.05)
+    with pytest.raises(ValueError):
+        scheduler.register("test_thread", lambda: None, interval=1)
+
+    thread = scheduler.start_in_thread()
+    time.sleep(0.3)
+    scheduler.stop()
+
+    assert runs
+    assert not thread.is_alive()
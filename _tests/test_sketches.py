@@ -0,0 +1,111 @@
+"""
+Quantile Sketch Tests
+
+Tests:
+- Quantiles stay within the configured relative error
+- Memory per series is capped at max_bins
+- Sketches merge into the same result as one combined sketch
+- Sketch metrics export as summaries and are fed by the record helpers
+- Reading a quantile never creates a series or spends cardinality budget
+"""
+
+import math
+import random
+
+from prometheus_client import CollectorRegistry
+
+from app.core.prometheus.cardinality import get_limiter
+from app.core.prometheus.metrics import (
+    get_celery_task_sketch,
+    get_db_sketch,
+    get_metric_registry,
+    record_celery_task,
+    record_db_operation,
+)
+from app.core.prometheus.sketches import DDSketch, QuantileSketch
+from app.core.prometheus.utils import get_quantile
+
+
+def exact_quantile(values, q):
+    ordered = sorted(values)
+    return ordered[int(q * (len(ordered) - 1))]
+
+
+def test_relative_error_bound():
+    """Verify sketch quantiles are within 1% of the exact values"""
+    rng = random.Random(7)
+    values = [rng.lognormvariate(-4, 1.5) for _ in range(20000)]
+    sketch = DDSketch(relative_accuracy=0.01)
+    for value in values:
+        sketch.observe(value)
+
+    for q in (0.01, 0.5, 0.9, 0.99, 0.999):
+        expected = exact_quantile(values, q)
+        assert abs(sketch.quantile(q) - expected) <= 0.01 * expected + 1e-12
+    assert sketch.count == 20000
+    assert math.isnan(DDSketch().quantile(0.5))
+
+
+def test_bins_capped():
+    """Verify the bucket array never exceeds max_bins and high quantiles stay accurate"""
+    sketch = DDSketch(relative_accuracy=0.01, max_bins=64)
+    values = [10 ** (i / 1000) for i in range(-6000, 3000)]
+    for value in reversed(values):
+        sketch.observe(value)
+
+    assert len(sketch.bins) <= 64
+    expected = exact_quantile(values, 0.99)
+    assert abs(sketch.quantile(0.99) - expected) <= 0.01 * expected
+
+
+def test_merge():
+    """Verify merged sketches answer like a single sketch over all values"""
+    rng = random.Random(3)
+    first, second, combined = DDSketch(), DDSketch(), DDSketch()
+    for i in range(5000):
+        value = rng.expovariate(20)
+        (first if i % 2 else second).observe(value)
+        combined.observe(value)
+
+    first.merge(second)
+    assert first.count == combined.count
+    for q in (0.5, 0.99):
+        assert first.quantile(q) == combined.quantile(q)
+
+
+def test_summary_export():
+    """Verify the sketch metric exports quantile, _count and _sum samples"""
+    registry = CollectorRegistry()
+    sketch = QuantileSketch("sketch_seconds", "Sketch", ["route"], registry=registry, quantiles=(0.5, 0.99))
+    for i in range(1, 101):
+        sketch.labels("/a").observe(i / 100)
+
+    p50 = registry.get_sample_value("sketch_seconds", {"route": "/a", "quantile": "0.5"})
+    assert abs(p50 - 0.5) <= 0.01 * 0.5 + 0.01
+    assert registry.get_sample_value("sketch_seconds_count", {"route": "/a"}) == 100
+    assert abs(registry.get_sample_value("sketch_seconds_sum", {"route": "/a"}) - 50.5) < 1e-9
+
+
+def test_record_helper_feeds_sketch():
+    """Verify record_celery_task makes task percentiles readable in-process"""
+    for i in range(1, 11):
+        record_celery_task("sketch_task", "success", duration=i / 10)
+
+    p90 = get_quantile(get_celery_task_sketch(), 0.9, {"task_name": "sketch_task"})
+    assert abs(p90 - 0.9) <= 0.01 * 0.9
+    assert get_metric_registry().get_sample_value(
+        "celery_task_duration_summary_seconds_count", {"task_name": "sketch_task"}
+    ) == 10
+
+
+def test_quantile_read_does_not_create_series():
+    """Verify reading unknown labels returns NaN without creating a child"""
+    sketch = get_celery_task_sketch()
+    series = get_limiter(sketch).series
+
+    assert math.isnan(get_quantile(sketch, 0.9, {"task_name": "never_ran"}))
+    assert sketch.get(task_name="never_ran") is None
+    assert get_limiter(sketch).series == series
+
+    record_db_operation("sketch_select", 0.25)
+    assert abs(get_quantile(get_db_sketch(), 0.5, {"operation": "sketch_select"}) - 0.25) <= 0.01 * 0.25
@@ -0,0 +1,116 @@
+"""
+In-process SLO Aggregator Tests
+
+Tests:
+- Rolling windows expire old slots (1m vs 5m)
+- Error rate, error ratio and latency quantile match PromQL semantics
+- Thresholds are read from rules/alerts.yml
+- Rules are evaluated per endpoint against the rolling windows
+- Endpoint count is capped with an overflow entry
+- PrometheusMiddleware feeds the shared aggregator when enabled (off by default)
+"""
+
+import math
+
+from starlette.applications import Starlette
+from starlette.middleware import Middleware
+from starlette.responses import PlainTextResponse
+from starlette.routing import Route
+from starlette.testclient import TestClient
+
+from app.core.prometheus import middleware as middleware_module
+from app.core.prometheus.middleware import PrometheusMiddleware
+from app.core.prometheus.slo import (
+    OVERFLOW_ENDPOINT,
+    SLOAggregator,
+    SLORule,
+    get_slo_aggregator,
+    load_slo_rules,
+)
+
+
+def test_windows_expire_old_slots():
+    """Verify requests leave the 1m window after a minute but stay in the 5m one"""
+    slo = SLOAggregator()
+    for t in range(10):
+        slo.observe("/items", 200, 0.01, now=1000.0 + t)
+
+    assert slo.stats("/items", "1m", now=1030.0).requests == 10
+    assert slo.stats("/items", "1m", now=1065.0).requests == 4
+    assert slo.stats("/items", "1m", now=1100.0).requests == 0
+    assert slo.stats("/items", "5m", now=1100.0).requests == 10
+    # A long idle gap clears every slot
+    assert slo.stats("/items", "5m", now=100000.0).requests == 0
+
+
+def test_rates_and_quantiles():
+    """Verify rate(), error ratio and histogram_quantile-style p99"""
+    slo = SLOAggregator()
+    for i in range(100):
+        slo.observe("/pay", 500 if i < 3 else 200, 0.3, now=50.0)
+
+    stats = slo.stats("/pay", "5m", now=60.0)
+    assert stats.rate() == 100 / 300
+    assert stats.rate("5..") == 3 / 300
+    assert stats.ratio("5..") == 0.03
+    assert stats.ratio("4..") == 0.0
+    # All in the (0.25, 0.5] bucket: linear interpolation inside it
+    assert abs(stats.quantile(0.99) - (0.25 + 0.25 * 0.99)) < 1e-9
+    assert math.isnan(slo.stats("/unknown").quantile(0.99))
+
+
+def test_rules_loaded_from_alerts_yaml():
+    """Verify HTTP thresholds come from rules/alerts.yml"""
+    rules = {rule.name: rule for rule in load_slo_rules()}
+
+    assert rules["HighErrorRate"] == SLORule("HighErrorRate", "error_rate", "5m", 0.01, status_pattern="5..")
+    assert rules["ElevatedErrorRate"].status_pattern == "4.."
+    assert rules["HighLatency"].kind == "latency_quantile"
+    assert rules["HighLatency"].quantile == 0.99
+    assert rules["HighLatency"].threshold == 1.0
+
+
+def test_rules_evaluated_per_endpoint():
+    """Verify breaches are reported for the endpoint that misbehaves"""
+    rules = load_slo_rules()
+    slo = SLOAggregator()
+    for _ in range(50):
+        slo.observe("/slow", 200, 2.0)
+        slo.observe("/fast", 200, 0.01)
+    for _ in range(10):
+        slo.observe("/broken", 503, 0.01)
+
+    assert slo.breached("/slow", rules) == ["HighLatency"]
+    assert slo.breached("/fast", rules) == []
+    assert "HighErrorRate" in slo.breached("/broken", rules)
+    value, breached = slo.evaluate(rules, "/broken")["HighErrorRate"]
+    assert breached and value == 10 / 300
+
+
+def test_endpoint_cap():
+    """Verify endpoints past the cap share the overflow entry"""
+    slo = SLOAggregator(max_endpoints=3)
+    for i in range(10):
+        slo.observe(f"/raw/{i}", 200, 0.01)
+
+    assert len(slo.endpoints) == 4
+    assert slo.stats(OVERFLOW_ENDPOINT, "1m").requests == 7
+    assert slo.stats(window="1m").requests == 10
+
+
+async def ok(request):
+    return PlainTextResponse("ok")
+
+
+def test_middleware_feeds_aggregator(monkeypatch):
+    """Verify requests through the middleware show up in the rolling windows when enabled"""
+    assert not PrometheusMiddleware(ok)._slo
+    monkeypatch.setattr(middleware_module.prometheus_config, "SLO_ENABLED", True)
+    app = Starlette(routes=[Route("/slo/{item_id}", ok)], middleware=[Middleware(PrometheusMiddleware)])
+    client = TestClient(app)
+    before = get_slo_aggregator().stats("/slo/{item_id}", "1m").requests
+
+    for i in range(5):
+        client.get(f"/slo/{i}")
+
+    assert get_slo_aggregator().stats("/slo/{item_id}", "1m").requests - before == 5
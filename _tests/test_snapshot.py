@@ -0,0 +1,116 @@
+"""
+Registry Snapshot Tests
+
+Tests:
+- Snapshots read the same values as the registry
+- Binary encoding round-trips snapshots and deltas
+- Deltas hold only new/changed series and removed keys
+- Applying a delta to the previous snapshot gives the current one
+- Families rebuilt from a snapshot render like the registry
+"""
+
+import math
+
+import pytest
+from prometheus_client import CollectorRegistry, Counter, Gauge, Histogram, generate_latest
+
+from app.core.prometheus.snapshot import RegistrySnapshot, diff_snapshots, take_snapshot
+
+
+def make_registry():
+    registry = CollectorRegistry()
+    requests = Counter("snap_requests", "Requests", ["endpoint", "status"], registry=registry)
+    latency = Histogram("snap_latency_seconds", "Latency", ["endpoint"], registry=registry)
+    queue = Gauge("snap_queue_size", "Queue", registry=registry)
+    for endpoint in ("/a", "/b", "/c"):
+        requests.labels(endpoint, "200").inc(3)
+        latency.labels(endpoint).observe(0.2)
+    queue.set(7)
+    return registry, requests, latency, queue
+
+
+def test_snapshot_matches_registry():
+    """Verify every sample is readable from the snapshot"""
+    registry, *_ = make_registry()
+    snapshot = take_snapshot(registry, timestamp=10.0)
+
+    for name, labels, value in snapshot.items():
+        assert registry.get_sample_value(name, labels) == value
+    assert snapshot.get_sample_value("snap_requests_total", {"endpoint": "/b", "status": "200"}) == 3
+    assert snapshot.get_sample_value("snap_queue_size") == 7
+    assert snapshot.get_sample_value("snap_queue_size", {"missing": "x"}) is None
+    # Histogram children share label sets across _count/_sum/_created
+    assert len(snapshot.labelsets) < len(snapshot)
+
+
+def test_encode_round_trip():
+    """Verify decode(encode(s)) preserves families, series and values"""
+    registry, *_ = make_registry()
+    snapshot = take_snapshot(registry, timestamp=12.5)
+    decoded = RegistrySnapshot.decode(snapshot.encode())
+
+    assert decoded.timestamp == 12.5
+    assert not decoded.is_delta
+    assert decoded.families == snapshot.families
+    assert list(decoded.items()) == list(snapshot.items())
+    assert len(snapshot.encode()) < len(generate_latest(registry))
+
+    with pytest.raises(ValueError):
+        RegistrySnapshot.decode(b"nope")
+    with pytest.raises(ValueError):
+        RegistrySnapshot.decode(snapshot.encode()[:-4])
+
+
+def test_delta_only_changed_series():
+    """Verify the delta holds changed and new series and removed keys"""
+    registry, requests, latency, queue = make_registry()
+    before = take_snapshot(registry, timestamp=1.0)
+    requests.labels("/a", "200").inc()
+    requests.labels("/a", "500").inc()
+    requests.remove("/c", "200")
+    queue.set(math.nan)
+    after = take_snapshot(registry, timestamp=2.0)
+
+    delta = diff_snapshots(before, after)
+    changed = {(name, tuple(sorted(labels.items()))) for name, labels, _ in delta.items()}
+    assert ("snap_requests_total", (("endpoint", "/a"), ("status", "200"))) in changed
+    assert ("snap_requests_total", (("endpoint", "/a"), ("status", "500"))) in changed
+    assert ("snap_queue_size", ()) in changed
+    assert all(name.startswith(("snap_requests", "snap_queue")) for name, _, _ in delta.items())
+    assert ("snap_requests_total", (("endpoint", "/c"), ("status", "200"))) in delta.removed
+
+    # An unchanged NaN is not a change
+    assert ("snap_queue_size", ()) not in {
+        (name, tuple(labels.items())) for name, labels, _ in diff_snapshots(after, take_snapshot(registry)).items()
+    }
+
+
+def test_apply_delta():
+    """Verify previous + encoded delta reproduces the current snapshot"""
+    registry, requests, latency, _ = make_registry()
+    before = take_snapshot(registry, timestamp=1.0)
+    requests.labels("/d", "200").inc()
+    requests.remove("/b", "200")
+    latency.labels("/a").observe(2.0)
+    after = take_snapshot(registry, timestamp=2.0)
+
+    delta = RegistrySnapshot.decode(diff_snapshots(before, after).encode())
+    assert delta.is_delta
+    rebuilt = before.apply(delta)
+
+    assert rebuilt.timestamp == 2.0
+    assert sorted(rebuilt.items(), key=repr) == sorted(after.items(), key=repr)
+
+
+def test_families_render_like_registry():
+    """Verify to_families() produces the same exposition as the registry"""
+    registry, *_ = make_registry()
+    snapshot = take_snapshot(registry)
+
+    class Restored:
+        def collect(self):
+            return snapshot.to_families()
+
+    restored = CollectorRegistry()
+    restored.register(Restored())
+    assert generate_latest(restored) == generate_latest(registry)
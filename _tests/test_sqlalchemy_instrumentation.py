@@ -0,0 +1,171 @@
+"""
+SQLAlchemy Engine Instrumentation Tests
+
+Tests:
+- Statements are counted and timed by operation
+- Commits, rollbacks, pool resets and failed statements are recorded
+- Pool checkout wait is observed separately from query time
+- Pool states are read on scrape and active connections tracked
+- Pools without state methods (default in-memory SQLite) scrape cleanly
+- Engines sharing a db_type are summed and uninstalled independently
+- Uninstalling restores the engine
+"""
+
+import pytest
+from sqlalchemy import create_engine, text
+from sqlalchemy.pool import QueuePool
+
+from app.core.prometheus._tests.conftest import value
+from app.core.prometheus.metrics import get_connection_pools
+from app.core.prometheus.sqlalchemy_instrumentation import instrument_engine, pool_states, statement_operation
+
+
+def operations(operation):
+    return value("db_operations_total", {"operation": operation})
+
+
+def timed(operation):
+    return value("db_operation_duration_seconds_count", {"operation": operation})
+
+
+@pytest.fixture
+def engine():
+    engine = create_engine("sqlite://", poolclass=QueuePool, pool_size=2, max_overflow=1)
+    instrumentation = instrument_engine(engine, db_type="sqlite_test")
+    yield engine
+    instrumentation.uninstall()
+    engine.dispose()
+
+
+def test_statement_operation():
+    """Verify statements are labelled by their leading keyword"""
+    assert statement_operation("SELECT 1") == "select"
+    assert statement_operation("\n  insert into t values (1)") == "insert"
+    assert statement_operation("CREATE TABLE t (id INTEGER)") == "other"
+
+
+def test_statements_timed_by_operation(engine):
+    """Verify each statement is counted and timed under its operation"""
+    before = {op: (operations(op), timed(op)) for op in ("select", "insert", "other")}
+
+    with engine.connect() as conn:
+        conn.execute(text("CREATE TABLE items (id INTEGER)"))
+        conn.execute(text("INSERT INTO items VALUES (1)"))
+        conn.execute(text("INSERT INTO items VALUES (2)"))
+        assert conn.execute(text("SELECT count(*) FROM items")).scalar() == 2
+
+    for op, expected in (("select", 1), ("insert", 2), ("other", 1)):
+        assert operations(op) - before[op][0] == expected
+        assert timed(op) - before[op][1] == expected
+
+
+def test_commit_rollback_and_errors(engine):
+    """Verify commits, rollbacks, pool resets and failed statements are recorded"""
+    commits, rollbacks, errors = operations("commit"), operations("rollback"), operations("error")
+
+    with engine.begin() as conn:
+        conn.execute(text("CREATE TABLE t (id INTEGER PRIMARY KEY)"))
+    with pytest.raises(Exception):
+        with engine.begin() as conn:
+            conn.execute(text("INSERT INTO missing VALUES (1)"))
+
+    assert operations("commit") - commits == 1
+    assert operations("rollback") - rollbacks == 1
+    assert operations("error") - errors == 1
+    assert timed("commit") >= 1
+
+    # No transaction ended by the Connection: the pool rolls back on checkin
+    resets, rollbacks = operations("reset"), operations("rollback")
+    with engine.connect():
+        pass
+    assert operations("reset") - resets == 1
+    assert operations("rollback") == rollbacks
+
+
+def test_pool_checkout_wait(engine):
+    """Verify checkouts are observed in the pool wait histogram, not as queries"""
+    labels = {"db_type": "sqlite_test"}
+    before = value("db_pool_checkout_wait_seconds_count", labels)
+    selects = timed("select")
+
+    for _ in range(3):
+        with engine.connect():
+            pass
+
+    assert value("db_pool_checkout_wait_seconds_count", labels) - before == 3
+    assert timed("select") == selects
+
+
+def test_pool_states_and_active_connections(engine):
+    """Verify pool states are read on scrape and checked-out connections tracked"""
+    def state(name):
+        get_connection_pools().invalidate()
+        return value("db_pool_connections", {"db_type": "sqlite_test", "state": name})
+
+    active = {"db_type": "sqlite_test", "state": "active"}
+    baseline = value("db_connections", active)
+    first = engine.connect()
+    second = engine.connect()
+    third = engine.connect()
+
+    assert state("size") == 2
+    assert state("checked_out") == 3
+    assert state("overflow") == 1
+    assert value("db_connections", active) - baseline == 3
+
+    for conn in (first, second, third):
+        conn.close()
+    assert state("checked_out") == 0
+    assert value("db_connections", active) == baseline
+
+
+def test_default_sqlite_pool(capsys):
+    """Verify the default in-memory SQLite pool (SingletonThreadPool) scrapes without errors"""
+    engine = create_engine("sqlite://")
+    instrumentation = instrument_engine(engine, db_type="sqlite_default")
+    try:
+        with engine.connect() as conn:
+            conn.execute(text("SELECT 1"))
+        assert pool_states(engine.pool) == {}
+        get_connection_pools().invalidate()
+        list(get_connection_pools().collect())
+        assert "Error reading sqlite_default" not in capsys.readouterr().out
+    finally:
+        instrumentation.uninstall()
+        engine.dispose()
+
+
+def test_engines_sharing_db_type():
+    """Verify two engines of one db_type sum their pools and uninstall independently"""
+    def state(name):
+        get_connection_pools().invalidate()
+        return value("db_pool_connections", {"db_type": "sqlite_shared", "state": name})
+
+    read = create_engine("sqlite://", poolclass=QueuePool, pool_size=2)
+    write = create_engine("sqlite://", poolclass=QueuePool, pool_size=3)
+    read_instrumentation = instrument_engine(read, db_type="sqlite_shared")
+    write_instrumentation = instrument_engine(write, db_type="sqlite_shared")
+    try:
+        assert state("size") == 5
+        read_instrumentation.uninstall()
+        assert state("size") == 3
+    finally:
+        write_instrumentation.uninstall()
+        read.dispose()
+        write.dispose()
+    assert state("size") == 0
+
+
+def test_uninstall_restores_engine():
+    """Verify uninstall removes the listeners and wrappers"""
+    engine = create_engine("sqlite://")
+    instrumentation = instrument_engine(engine, db_type="sqlite_uninstall")
+    assert "do_commit" in vars(engine.dialect)
+    instrumentation.uninstall()
+
+    assert "do_commit" not in vars(engine.dialect)
+    assert "connect" not in vars(engine.pool)
+    before = operations("select")
+    with engine.connect() as conn:
+        conn.execute(text("SELECT 1"))
+    assert operations("select") == before
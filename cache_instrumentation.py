@@ -0,0 +1,239 @@
+"""
+Instrumented wrappers for sync and async Redis/Valkey clients.
+
+``instrument_cache(client, cache_type)`` returns a drop-in wrapper that
+records cache_operations_total and cache_operation_duration_seconds without
+hand-written calls at each call site:
+
+- GET-style commands (get, hget, getdel, getex) count a ``hit`` or ``miss``
+  from the result (``None`` is a miss); MGET/HMGET count one per key
+- other common commands (set, delete, incr, expire, ...) count under their
+  own name
+- every instrumented command observes its latency under its own name
+- pipelines are timed as one batch (``operation="pipeline"``) and count each
+  queued command (and each GET hit/miss) from the results, matched to the
+  commands through the pipeline's ``command_stack``
+
+Children are bound once per wrapper, so a command costs two clock reads and
+a couple of pre-bound metric updates. Commands that are not listed pass
+straight through to the client uninstrumented.
+
+Works with redis-py / valkey-py clients (``redis.Redis``,
+``redis.asyncio.Redis``, ``valkey.Valkey``, ...) and anything with the same
+command methods; the async wrapper is chosen when the client's
+``execute_command`` is a coroutine function.
+"""
+import inspect
+from time import perf_counter
+from typing import Any, Dict, List
+
+from app.core.prometheus.exemplars import attach_exemplar, exemplars_enabled
+from app.core.prometheus.metrics import bind, get_cache_count, get_cache_latency, get_recorder
+
+# Result None -> miss, anything else -> hit
+GET_COMMANDS = ("get", "hget", "getdel", "getex")
+# One hit/miss per returned element
+MULTI_GET_COMMANDS = ("mget", "hmget")
+COUNTED_COMMANDS = (
+    "set", "setex", "psetex", "setnx", "mset", "delete", "unlink", "exists",
+    "expire", "pexpire", "ttl", "incr", "incrby", "decr", "decrby",
+    "hset", "hdel", "hgetall", "hincrby", "sadd", "srem", "smembers",
+    "lpush", "rpush", "lpop", "rpop", "lrange", "zadd", "zrange", "publish",
+)
+INSTRUMENTED_COMMANDS = GET_COMMANDS + MULTI_GET_COMMANDS + COUNTED_COMMANDS
+# Server command name -> client method name, where they differ
+COMMAND_ALIASES = {"del": "delete"}
+
+
+class _Children:
+    """Pre-bound children for one cache type."""
+
+    __slots__ = ("hit", "miss", "count", "latency", "pipeline_latency")
+
+    def __init__(self, cache_type: str):
+        count = bind(get_cache_count())
+        latency = bind(get_cache_latency())
+        self.hit = count.child(cache_type, "hit")
+        self.miss = count.child(cache_type, "miss")
+        self.count: Dict[str, Any] = {name: count.child(cache_type, name) for name in COUNTED_COMMANDS}
+        self.latency: Dict[str, Any] = {name: latency.child(cache_type, name) for name in INSTRUMENTED_COMMANDS}
+        self.pipeline_latency = latency.child(cache_type, "pipeline")
+
+
+class _Recording:
+    """Shared recording logic for the sync and async wrappers."""
+
+    def __init__(self, client: Any, cache_type: str):
+        self._client = client
+        self.cache_type = cache_type
+        self._children = _Children(cache_type)
+        self._recorder = get_recorder()
+        self._exemplars = exemplars_enabled()
+
+    def __getattr__(self, name: str) -> Any:
+        # Everything not instrumented goes straight to the client
+        return getattr(self._client, name)
+
+    def _observe(self, latency: Any, elapsed: float) -> None:
+        self._recorder.observe(latency, elapsed)
+        if self._exemplars:
+            attach_exemplar(latency, elapsed)
+
+    def _record_get(self, command: str, result: Any, elapsed: float) -> None:
+        children = self._children
+        self._recorder.inc(children.miss if result is None else children.hit)
+        self._observe(children.latency[command], elapsed)
+
+    def _record_multi_get(self, command: str, results: Any, elapsed: float) -> None:
+        self._count_keys(results)
+        self._observe(self._children.latency[command], elapsed)
+
+    def _record_command(self, command: str, result: Any, elapsed: float) -> None:
+        children = self._children
+        self._recorder.inc(children.count[command])
+        self._observe(children.latency[command], elapsed)
+
+    def _count_keys(self, results: Any) -> None:
+        misses = sum(1 for value in results if value is None)
+        if misses:
+            self._recorder.inc(self._children.miss, misses)
+        if len(results) - misses:
+            self._recorder.inc(self._children.hit, len(results) - misses)
+
+    def _record_pipeline(self, commands: List[str], results: List[Any], elapsed: float) -> None:
+        children = self._children
+        recorder = self._recorder
+        for command, result in zip(commands, results):
+            if isinstance(result, Exception):
+                continue
+            if command in GET_COMMANDS:
+                recorder.inc(children.miss if result is None else children.hit)
+            elif command in MULTI_GET_COMMANDS:
+                if isinstance(result, list):
+                    self._count_keys(result)
+            elif command in children.count:
+                recorder.inc(children.count[command])
+        self._observe(children.pipeline_latency, elapsed)
+
+
+def _recorder_for(command: str) -> str:
+    if command in GET_COMMANDS:
+        return "_record_get"
+    if command in MULTI_GET_COMMANDS:
+        return "_record_multi_get"
+    return "_record_command"
+
+
+def _sync_command(command: str):
+    record = getattr(_Recording, _recorder_for(command))
+
+    def method(self, *args, **kwargs):
+        start = perf_counter()
+        result = getattr(self._client, command)(*args, **kwargs)
+        record(self, command, result, perf_counter() - start)
+        return result
+    method.__name__ = command
+    return method
+
+
+def _async_command(command: str):
+    record = getattr(_Recording, _recorder_for(command))
+
+    async def method(self, *args, **kwargs):
+        start = perf_counter()
+        result = await getattr(self._client, command)(*args, **kwargs)
+        record(self, command, result, perf_counter() - start)
+        return result
+    method.__name__ = command
+    return method
+
+
+class InstrumentedCache(_Recording):
+    """Instrumented wrapper for a synchronous Redis/Valkey client."""
+
+    def pipeline(self, *args, **kwargs) -> "InstrumentedPipeline":
+        return InstrumentedPipeline(self._client.pipeline(*args, **kwargs), self)
+
+
+class InstrumentedAsyncCache(_Recording):
+    """Instrumented wrapper for an asyncio Redis/Valkey client."""
+
+    def pipeline(self, *args, **kwargs) -> "InstrumentedAsyncPipeline":
+        return InstrumentedAsyncPipeline(self._client.pipeline(*args, **kwargs), self)
+
+
+for _command in INSTRUMENTED_COMMANDS:
+    setattr(InstrumentedCache, _command, _sync_command(_command))
+    setattr(InstrumentedAsyncCache, _command, _async_command(_command))
+
+
+class _PipelineBase:
+    def __init__(self, pipeline: Any, owner: _Recording):
+        self._pipeline = pipeline
+        self._owner = owner
+
+    def __getattr__(self, name: str) -> Any:
+        attr = getattr(self._pipeline, name)
+        if not callable(attr):
+            return attr
+
+        def call(*args, **kwargs):
+            result = attr(*args, **kwargs)
+            # Keep chained calls (pipe.get(a).get(b)) on the wrapper
+            return self if result is self._pipeline else result
+        return call
+
+    def __len__(self) -> int:
+        return len(self._pipeline)
+
+    def _queued_commands(self) -> List[str]:
+        """Names of the queued commands, in execution (and result) order."""
+        names = []
+        for args, _options in getattr(self._pipeline, "command_stack", ()):
+            name = args[0].decode() if isinstance(args[0], bytes) else str(args[0])
+            name = name.lower()
+            names.append(COMMAND_ALIASES.get(name, name))
+        return names
+
+
+class InstrumentedPipeline(_PipelineBase):
+    """Pipeline timed as one batch, with a per-command count breakdown."""
+
+    def execute(self, *args, **kwargs) -> List[Any]:
+        commands = self._queued_commands()
+        start = perf_counter()
+        results = self._pipeline.execute(*args, **kwargs)
+        self._owner._record_pipeline(commands, results, perf_counter() - start)
+        return results
+
+    def __enter__(self) -> "InstrumentedPipeline":
+        self._pipeline.__enter__()
+        return self
+
+    def __exit__(self, *exc_info) -> Any:
+        return self._pipeline.__exit__(*exc_info)
+
+
+class InstrumentedAsyncPipeline(_PipelineBase):
+    """Async pipeline timed as one batch, with a per-command count breakdown."""
+
+    async def execute(self, *args, **kwargs) -> List[Any]:
+        commands = self._queued_commands()
+        start = perf_counter()
+        results = await self._pipeline.execute(*args, **kwargs)
+        self._owner._record_pipeline(commands, results, perf_counter() - start)
+        return results
+
+    async def __aenter__(self) -> "InstrumentedAsyncPipeline":
+        await self._pipeline.__aenter__()
+        return self
+
+    async def __aexit__(self, *exc_info) -> Any:
+        return await self._pipeline.__aexit__(*exc_info)
+
+
+def instrument_cache(client: Any, cache_type: str = "valkey") -> _Recording:
+    """Wrap a sync or async Redis/Valkey client so its commands are recorded."""
+    if inspect.iscoroutinefunction(getattr(client, "execute_command", None)):
+        return InstrumentedAsyncCache(client, cache_type)
+    return InstrumentedCache(client, cache_type)
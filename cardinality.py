@@ -0,0 +1,117 @@
+"""
+Cardinality guard for labelled metrics.
+
+Free-form label values (raw paths, task names, dynamic topics) can create an
+unbounded number of series. ``limit_cardinality(metric)`` caps the number of
+distinct label sets a metric may create:
+
+- the budget is ``PROMETHEUS_SERIES_LIMITS[<metric name>]`` or, when the
+  metric is not listed, ``PROMETHEUS_MAX_SERIES_PER_METRIC`` (0 = no limit);
+- once the budget is spent, new label sets are recorded into a single
+  series whose label values are all ``__overflow__``;
+- every redirected label set is counted in
+  metrics_cardinality_dropped_total{metric}.
+
+The guard replaces ``metric.labels`` on the instance, so direct
+``.labels()`` calls and bound children (``bind()``) are both covered.
+Budgets are per process; in multiprocess mode each worker has its own.
+"""
+import threading
+from typing import Any, Dict, Optional, Set, Tuple
+
+from app.core.prometheus.config import get_prometheus_config
+
+OVERFLOW_LABEL_VALUE = "__overflow__"
+
+_limiters: Dict[Any, "CardinalityLimiter"] = {}
+
+
+class CardinalityLimiter:
+    """Per-metric label-set budget enforced on ``metric.labels()``."""
+
+    def __init__(self, metric: Any, name: str, max_series: int):
+        self.metric = metric
+        self.name = name
+        self.max_series = max_series
+        self._labelnames: Tuple[str, ...] = tuple(metric._labelnames)
+        self._labels = metric.labels
+        self._overflow = tuple(OVERFLOW_LABEL_VALUE for _ in self._labelnames)
+        # Children created before the guard (e.g. restored from a checkpoint)
+        # count against the budget
+        existing = [key for key in getattr(metric, "_metrics", {}) if key != self._overflow]
+        self._admitted: Set[Tuple[str, ...]] = set(existing[:max_series])
+        self._lock = threading.Lock()
+        self._dropped = None
+
+    def labels(self, *labelvalues: Any, **labelkwargs: Any) -> Any:
+        if labelkwargs:
+            if labelvalues or set(labelkwargs) != set(self._labelnames):
+                # Let prometheus_client raise its usual error
+                return self._labels(*labelvalues, **labelkwargs)
+            key = tuple(str(labelkwargs[name]) for name in self._labelnames)
+        else:
+            key = tuple(str(value) for value in labelvalues)
+        if not self.admit(key):
+            key = self._overflow
+        return self._labels(*key)
+
+    def admit(self, key: Tuple[str, ...]) -> bool:
+        """Return True if ``key`` has (or may get) its own series."""
+        if key in self._admitted or key == self._overflow:
+            return True
+        with self._lock:
+            if key in self._admitted:
+                return True
+            if len(self._admitted) < self.max_series:
+                self._admitted.add(key)
+                return True
+        self._dropped_counter().inc()
+        return False
+
+    def admitted(self, labelvalues: Tuple[Any, ...]) -> bool:
+        """Whether these label values map to their own (non-overflow) series."""
+        key = tuple(str(value) for value in labelvalues)
+        return key in self._admitted or key == self._overflow
+
+    @property
+    def series(self) -> int:
+        return len(self._admitted)
+
+    def reset(self) -> None:
+        """Forget admitted label sets (call after ``metric.clear()``)."""
+        with self._lock:
+            self._admitted = set()
+
+    def _dropped_counter(self):
+        if self._dropped is None:
+            from app.core.prometheus.metrics import get_cardinality_dropped
+            self._dropped = get_cardinality_dropped().labels(self.name)
+        return self._dropped
+
+
+def get_series_limit(name: str) -> int:
+    """Label-set budget for a metric; counters may be listed with or without _total."""
+    config = get_prometheus_config()
+    limits = config.SERIES_LIMITS
+    for key in (name, f"{name}_total"):
+        if key in limits:
+            return limits[key]
+    return config.MAX_SERIES_PER_METRIC
+
+
+def limit_cardinality(metric: Any, max_series: Optional[int] = None) -> Any:
+    """Install the cardinality guard on a labelled metric and return it."""
+    if not getattr(metric, "_labelnames", None) or metric in _limiters:
+        return metric
+    name = metric.describe()[0].name
+    max_series = get_series_limit(name) if max_series is None else max_series
+    if max_series <= 0:
+        return metric
+    limiter = CardinalityLimiter(metric, name, max_series)
+    metric.labels = limiter.labels
+    _limiters[metric] = limiter
+    return metric
+
+
+def get_limiter(metric: Any) -> Optional[CardinalityLimiter]:
+    return _limiters.get(metric)
@@ -0,0 +1,161 @@
+"""
+Celery instrumentation through task signals.
+
+``instrument_celery()`` connects signal handlers once per process; no task
+code changes are needed:
+
+- before_task_publish: stamps a ``published_at`` header on outgoing tasks
+- task_prerun: starts the timer (``perf_counter_ns``) and observes the queue
+  wait (publish -> start) in celery_task_queue_wait_seconds
+- task_postrun: observes celery_task_duration_seconds (and the DDSketch
+  summary) and counts successes in celery_tasks_total
+- task_failure / task_retry: count failures and retries in celery_tasks_total
+- worker_process_shutdown: flushes the metrics pusher, when configured, so
+  prefork children don't take unpushed metrics with them
+
+Children are pre-bound once per task name (one slotted object holding every
+child the handlers touch), and the start time is kept on the task's own
+request context, so a task costs a dict lookup and no new containers, label
+tuples or closures.
+
+celery_worker_prefetched_tasks (reserved but not yet started) is read from
+``celery.worker.state`` when the registry is collected, so it reflects the
+worker process serving the scrape (the main process with the prefork pool).
+
+Queue wait needs the publisher to run ``instrument_celery()`` as well (or
+any other producer to set a ``published_at`` epoch-seconds header).
+"""
+import threading
+import time
+from typing import Dict, Optional
+
+from celery import signals
+
+from app.core.prometheus.metrics import (
+    add_pre_collect_hook,
+    bind,
+    get_celery_prefetched,
+    get_celery_queue_wait,
+    get_celery_task_count,
+    get_celery_task_latency,
+    get_celery_task_sketch,
+    get_recorder,
+)
+
+PUBLISHED_AT_HEADER = "published_at"
+_START_ATTR = "_prometheus_start_ns"
+
+
+class _TaskChildren:
+    """Every metric child the handlers need for one task name."""
+
+    __slots__ = ("success", "failure", "retry", "latency", "sketch", "queue_wait")
+
+    def __init__(self, task_name: str):
+        count = bind(get_celery_task_count())
+        self.success = count.child(task_name, "success")
+        self.failure = count.child(task_name, "failure")
+        self.retry = count.child(task_name, "retry")
+        self.latency = bind(get_celery_task_latency()).child(task_name)
+        self.sketch = bind(get_celery_task_sketch()).child(task_name)
+        self.queue_wait = bind(get_celery_queue_wait()).child(task_name)
+
+
+class CeleryInstrumentation:
+    """Signal handlers recording task metrics; see ``instrument_celery()``."""
+
+    def __init__(self):
+        self._children: Dict[str, _TaskChildren] = {}
+        self._lock = threading.Lock()
+        self._recorder = get_recorder()
+        self.installed = False
+
+    def children(self, task_name: str) -> _TaskChildren:
+        children = self._children.get(task_name)
+        if children is None:
+            with self._lock:
+                children = self._children.get(task_name)
+                if children is None:
+                    children = self._children[task_name] = _TaskChildren(task_name)
+        return children
+
+    # -- signal handlers ----------------------------------------------------
+
+    def before_task_publish(self, headers=None, **kwargs) -> None:
+        if headers is not None:
+            headers.setdefault(PUBLISHED_AT_HEADER, time.time())
+
+    def task_prerun(self, task=None, **kwargs) -> None:
+        request = task.request
+        setattr(request, _START_ATTR, time.perf_counter_ns())
+        published_at = getattr(request, PUBLISHED_AT_HEADER, None)
+        if published_at is None and request.headers:
+            published_at = request.headers.get(PUBLISHED_AT_HEADER)
+        if published_at is not None:
+            wait = time.time() - float(published_at)
+            if wait >= 0:
+                self._recorder.observe(self.children(task.name).queue_wait, wait)
+
+    def task_postrun(self, task=None, state=None, **kwargs) -> None:
+        start = getattr(task.request, _START_ATTR, None)
+        children = self.children(task.name)
+        if start is not None:
+            duration = (time.perf_counter_ns() - start) / 1e9
+            self._recorder.observe(children.latency, duration)
+            children.sketch.observe(duration)
+        if state == "SUCCESS":
+            self._recorder.inc(children.success)
+
+    def task_failure(self, sender=None, **kwargs) -> None:
+        self._recorder.inc(self.children(sender.name).failure)
+
+    def task_retry(self, sender=None, **kwargs) -> None:
+        self._recorder.inc(self.children(sender.name).retry)
+
+    def worker_process_shutdown(self, **kwargs) -> None:
+        from app.core.prometheus.pusher import get_pusher
+
+        pusher = get_pusher()
+        if pusher is not None:
+            pusher.flush()
+
+    def update_prefetched(self) -> None:
+        from celery.worker import state
+
+        get_celery_prefetched().set(max(0, len(state.reserved_requests) - len(state.active_requests)))
+
+    # -- wiring -------------------------------------------------------------
+
+    def _signals(self):
+        return (
+            (signals.before_task_publish, self.before_task_publish),
+            (signals.task_prerun, self.task_prerun),
+            (signals.task_postrun, self.task_postrun),
+            (signals.task_failure, self.task_failure),
+            (signals.task_retry, self.task_retry),
+            (signals.worker_process_shutdown, self.worker_process_shutdown),
+        )
+
+    def install(self) -> None:
+        if self.installed:
+            return
+        for signal, handler in self._signals():
+            signal.connect(handler, weak=False)
+        add_pre_collect_hook(self.update_prefetched)
+        self.installed = True
+
+    def uninstall(self) -> None:
+        for signal, handler in self._signals():
+            signal.disconnect(handler)
+        self.installed = False
+
+
+_instrumentation: Optional[CeleryInstrumentation] = None
+
+def instrument_celery() -> CeleryInstrumentation:
+    """Connect the Celery signal handlers (idempotent); call in workers and publishers."""
+    global _instrumentation
+    if _instrumentation is None:
+        _instrumentation = CeleryInstrumentation()
+    _instrumentation.install()
+    return _instrumentation
@@ -0,0 +1,323 @@
+"""
+Counter and histogram persistence across restarts via mmap checkpoints.
+
+Every deploy or crash otherwise resets counters such as
+``http_requests_total`` or ``celery_tasks_total`` to zero. With
+``PROMETHEUS_CHECKPOINT_FILE`` set, the collector scheduler writes the
+counter and histogram samples of the metric registry (a ``snapshot``
+encoding) into a memory-mapped file every ``PROMETHEUS_CHECKPOINT_INTERVAL``
+seconds and once more at exit. The file is read back on first use and
+the ``get_*`` metric factories restore each counter/histogram right after
+creating it, so lazily created metrics are covered too and the hot path is
+untouched.
+
+File layout: a 16 byte header (magic, version, slot capacity) and two slots,
+each a 24 byte header (sequence, length, crc32, flags) followed by the payload.
+Writes alternate between slots and the slot header is written last, so a
+crash mid-write leaves the previous checkpoint readable. Growing the slots
+builds a new file that carries the latest checkpoint over and swaps it in
+with ``os.replace``.
+
+One process writes a checkpoint file: it holds an exclusive lock on
+``<file>.lock``, and other processes configured with the same file run
+without checkpoints (with a warning) instead of overwriting its counters.
+Give each worker its own ``PROMETHEUS_CHECKPOINT_FILE``.
+
+Values are restored only from a clean-shutdown checkpoint, the one written
+at exit (flagged ``FLAG_CLEAN``). After a crash the latest checkpoint can be
+up to an interval older than what Prometheus last scraped: continuing from
+it would look like a reset to a lower value, and ``rate()`` would count the
+whole restored value as an increase. So after a crash counters start at
+zero, an ordinary reset.
+
+Only fresh (zero) series are restored, and classic histograms only when
+their bucket bounds are unchanged. Multiprocess mode is not checkpointed:
+its per-process files already live in ``PROMETHEUS_MULTIPROC_DIR``.
+"""
+import atexit
+import mmap
+import os
+import struct
+import threading
+import zlib
+from collections import defaultdict
+from typing import Any, Dict, List, Optional, Tuple
+
+from prometheus_client import Counter, Histogram
+
+try:
+    import fcntl
+except ImportError:  # Windows: no advisory locks, one writer is assumed
+    fcntl = None
+
+from app.core.prometheus.config import get_prometheus_config
+from app.core.prometheus.snapshot import RegistrySnapshot, take_snapshot
+
+MAGIC = b"PMCK"
+VERSION = 2
+DEFAULT_SLOT_CAPACITY = 64 * 1024
+FLAG_CLEAN = 0x1  # written at a clean shutdown
+_FILE_HEADER = struct.Struct("<4sB3xI4x")
+_SLOT_HEADER = struct.Struct("<QIIB7x")
+
+Samples = List[Tuple[str, Dict[str, str], float]]
+
+
+class CheckpointFile:
+    """Two-slot, crash-safe payload store in a memory-mapped file."""
+
+    def __init__(self, path: str, capacity: int = DEFAULT_SLOT_CAPACITY):
+        self.path = path
+        self._lock = threading.Lock()
+        self._file = None
+        self._map: Optional[mmap.mmap] = None
+        self.capacity = capacity
+        self._sequence = 0
+        self._lock_file = self._acquire_lock()
+        try:
+            self._open()
+        except Exception:
+            self._lock_file.close()
+            raise
+
+    def _acquire_lock(self):
+        lock_file = open(self.path + ".lock", "a+b")
+        if fcntl is not None:
+            try:
+                fcntl.flock(lock_file.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except OSError:
+                lock_file.close()
+                raise RuntimeError(f"Checkpoint file {self.path} is in use by another process")
+        return lock_file
+
+    def _open(self) -> None:
+        if os.path.exists(self.path) and os.path.getsize(self.path) >= _FILE_HEADER.size:
+            self._file = open(self.path, "r+b")
+            header = self._file.read(_FILE_HEADER.size)
+            magic, version, capacity = _FILE_HEADER.unpack(header)
+            if magic == MAGIC and version == VERSION and os.path.getsize(self.path) == self._size(capacity):
+                self.capacity = capacity
+                self._map = mmap.mmap(self._file.fileno(), 0)
+                latest = self._latest()
+                self._sequence = latest[0] if latest else 0
+                return
+            print(f"Ignoring invalid checkpoint file {self.path}")
+        self._reset(self.capacity)
+
+    @staticmethod
+    def _size(capacity: int) -> int:
+        return _FILE_HEADER.size + 2 * (_SLOT_HEADER.size + capacity)
+
+    def _reset(self, capacity: int) -> None:
+        """
+        (Re)create the file with ``capacity`` byte slots, keeping the latest
+        checkpoint. The new file is written beside the old one and swapped in,
+        so a crash leaves one of the two intact.
+        """
+        latest = self._latest() if self._map is not None else None
+        image = bytearray(self._size(capacity))
+        _FILE_HEADER.pack_into(image, 0, MAGIC, VERSION, capacity)
+        if latest is not None:
+            sequence, payload, flags = latest
+            offset = _FILE_HEADER.size + (sequence % 2) * (_SLOT_HEADER.size + capacity)
+            _SLOT_HEADER.pack_into(image, offset, sequence, len(payload), zlib.crc32(payload), flags)
+            start = offset + _SLOT_HEADER.size
+            image[start:start + len(payload)] = payload
+        temp = self.path + ".tmp"
+        with open(temp, "wb") as f:
+            f.write(image)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(temp, self.path)
+
+        if self._map is not None:
+            self._map.close()
+        if self._file is not None:
+            self._file.close()
+        self._file = open(self.path, "r+b")
+        self._map = mmap.mmap(self._file.fileno(), 0)
+        self.capacity = capacity
+
+    def _slot_offset(self, slot: int) -> int:
+        return _FILE_HEADER.size + slot * (_SLOT_HEADER.size + self.capacity)
+
+    def _latest(self) -> Optional[Tuple[int, bytes, int]]:
+        best = None
+        for slot in (0, 1):
+            offset = self._slot_offset(slot)
+            sequence, length, crc, flags = _SLOT_HEADER.unpack_from(self._map, offset)
+            if not sequence or length > self.capacity:
+                continue
+            start = offset + _SLOT_HEADER.size
+            payload = self._map[start:start + length]
+            if zlib.crc32(payload) != crc:
+                continue
+            if best is None or sequence > best[0]:
+                best = (sequence, payload, flags)
+        return best
+
+    def read(self, clean_only: bool = False) -> Optional[bytes]:
+        """
+        The most recent complete payload, or None (also when ``clean_only``
+        and it was not written at a clean shutdown).
+        """
+        with self._lock:
+            latest = self._latest()
+            if latest is None or (clean_only and not latest[2] & FLAG_CLEAN):
+                return None
+            return latest[1]
+
+    def write(self, payload: bytes, clean: bool = False) -> None:
+        with self._lock:
+            if len(payload) > self.capacity:
+                self._reset(max(len(payload) * 2, self.capacity * 2))
+            self._sequence += 1
+            offset = self._slot_offset(self._sequence % 2)
+            start = offset + _SLOT_HEADER.size
+            self._map[start:start + len(payload)] = payload
+            # Header last: a torn write never looks valid
+            flags = FLAG_CLEAN if clean else 0
+            self._map[offset:start] = _SLOT_HEADER.pack(self._sequence, len(payload), zlib.crc32(payload), flags)
+
+    def flush(self) -> None:
+        with self._lock:
+            if self._map is not None:
+                self._map.flush()
+
+    def close(self) -> None:
+        with self._lock:
+            if self._map is not None:
+                self._map.flush()
+                self._map.close()
+                self._map = None
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+            if not self._lock_file.closed:
+                self._lock_file.close()
+
+
+class Checkpointer:
+    """Save a registry's counters/histograms to a checkpoint and restore them as they are created."""
+
+    def __init__(self, path: str, capacity: int = DEFAULT_SLOT_CAPACITY):
+        self.file = CheckpointFile(path, capacity)
+        self.registry = None
+        # family name -> samples still waiting for their metric to be registered
+        self._pending: Dict[str, Samples] = {}
+        self._lock = threading.Lock()
+
+    def load(self) -> int:
+        """Read a clean-shutdown checkpoint into the pending restore set; returns the series count."""
+        payload = self.file.read(clean_only=True)
+        if payload is None:
+            if self.file.read() is not None:
+                print(f"Checkpoint {self.file.path} was not written at a clean shutdown; counters start at zero")
+            return 0
+        try:
+            snapshot = RegistrySnapshot.decode(payload)
+        except ValueError as e:
+            print(f"Error reading checkpoint {self.file.path}: {e}")
+            return 0
+        pending: Dict[str, Samples] = defaultdict(list)
+        labelsets = snapshot.labelsets
+        for (family, name, ls), value in zip(snapshot.series, snapshot.values):
+            if not name.endswith("_created"):
+                pending[snapshot.families[family].name].append((name, dict(labelsets[ls]), value))
+        with self._lock:
+            self._pending = dict(pending)
+        return len(snapshot)
+
+    def attach(self, registry: Any) -> None:
+        """Save ``registry`` on ``save()``."""
+        self.registry = registry
+
+    def restore(self, collector: Any) -> None:
+        """Give a fully constructed counter/histogram its checkpointed values."""
+        if not isinstance(collector, (Counter, Histogram)):
+            return
+        name = collector.describe()[0].name
+        with self._lock:
+            samples = self._pending.pop(name, None)
+        if not samples:
+            return
+        try:
+            if isinstance(collector, Counter):
+                _restore_counter(collector, samples)
+            else:
+                _restore_histogram(collector, samples)
+        except Exception as e:
+            print(f"Error restoring {name} from checkpoint: {e}")
+
+    def save(self, clean: bool = False) -> None:
+        """
+        Write the registry's counter and histogram samples to the checkpoint;
+        ``clean`` marks the final save at exit, the only one ``load()`` restores.
+        """
+        if self.registry is None:
+            return
+        snapshot = take_snapshot(self.registry, types=("counter", "histogram"))
+        self.file.write(snapshot.encode(), clean=clean)
+
+    def close(self) -> None:
+        self.file.close()
+
+
+def _child(metric: Any, labels: Dict[str, str]) -> Any:
+    if not metric._labelnames:
+        return metric
+    return metric.labels(*(labels[name] for name in metric._labelnames))
+
+
+def _restore_counter(counter: Counter, samples: Samples) -> None:
+    for name, labels, value in samples:
+        if not name.endswith("_total"):
+            continue
+        child = _child(counter, labels)
+        if child._value.get() == 0:
+            child._value.set(value)
+
+
+def _restore_histogram(histogram: Histogram, samples: Samples) -> None:
+    series: Dict[Tuple[Tuple[str, str], ...], Dict[str, Any]] = defaultdict(lambda: {"buckets": {}, "sum": 0.0})
+    for name, labels, value in samples:
+        key = tuple(sorted((k, v) for k, v in labels.items() if k != "le"))
+        if name.endswith("_bucket"):
+            series[key]["buckets"][float(labels["le"])] = value
+        elif name.endswith("_sum"):
+            series[key]["sum"] = value
+    bounds = histogram._upper_bounds
+    for key, state in series.items():
+        if sorted(state["buckets"]) != list(bounds):
+            print(f"Skipping checkpoint for {histogram._name}: bucket bounds changed")
+            return
+        child = _child(histogram, dict(key))
+        if any(bucket.get() for bucket in child._buckets):
+            continue
+        previous = 0.0
+        for bucket, bound in zip(child._buckets, bounds):
+            cumulative = state["buckets"][bound]
+            bucket.set(cumulative - previous)
+            previous = cumulative
+        child._sum.set(state["sum"])
+
+
+_checkpointer: Optional[Checkpointer] = None
+_checkpointer_unavailable = False
+
+def get_checkpointer(path: Optional[str] = None) -> Optional[Checkpointer]:
+    """Get the checkpointer for PROMETHEUS_CHECKPOINT_FILE (None when disabled)."""
+    global _checkpointer, _checkpointer_unavailable
+    if _checkpointer is None and not _checkpointer_unavailable:
+        path = path or get_prometheus_config().CHECKPOINT_FILE
+        if not path:
+            return None
+        try:
+            _checkpointer = Checkpointer(path)
+        except RuntimeError as e:
+            print(f"Warning: counter checkpoints disabled: {e}")
+            _checkpointer_unavailable = True
+            return None
+        _checkpointer.load()
+        atexit.register(_checkpointer.save, clean=True)
+    return _checkpointer
@@ -0,0 +1,295 @@
+"""
+Pull-based custom collectors for derived metrics.
+
+These metrics are computed when the registry is scraped instead of by a
+background loop, so nothing is computed that nobody reads and values are
+fresh at scrape time. Each collector caches its result for a short TTL
+(``PROMETHEUS_COLLECTOR_CACHE_TTL``) and computes under a lock, so
+concurrent scrapes share a single computation.
+
+Collectors:
+- SystemMetricsCollector: CPU, memory, disk and process stats
+- CacheHitRatioCollector: cache_hit_ratio from cache_operations_total
+- ConnectionPoolCollector: db_pool_connections from registered pool sources
+
+Collectors run in the process answering the scrape. In multiprocess mode
+the process stats, pool states and cache hit ratio are therefore those of
+that worker; the host-wide system stats are unaffected.
+"""
+import threading
+import time
+import warnings
+from collections import defaultdict
+from typing import Callable, Dict, Hashable, Iterable, List, Optional, Tuple
+
+import psutil
+from prometheus_client.core import GaugeMetricFamily, Metric
+
+from app.core.prometheus.config import get_prometheus_config
+
+# Per-source sampling intervals (seconds): cheap stats often, disk walks rarely
+SYSTEM_SAMPLE_INTERVALS = {
+    "cpu": 5,
+    "memory": 5,
+    "process": 5,
+    "disk": 60,
+}
+DISK_MOUNTPOINTS = ("/",)
+
+# Cache types reported with a ratio of 1.0 before any hit/miss is recorded
+DEFAULT_CACHE_TYPES = ("valkey",)
+
+
+class CachedCollector:
+    """
+    Base class for collectors whose values are computed at scrape time.
+    Subclasses implement ``describe_families()`` (empty families, used for
+    registration) and ``compute()``.
+    """
+
+    def __init__(self, ttl: Optional[float] = None):
+        self.ttl = get_prometheus_config().COLLECTOR_CACHE_TTL if ttl is None else ttl
+        self._lock = threading.Lock()
+        self._families: Optional[List[Metric]] = None
+        self._expires = 0.0
+
+    def describe_families(self) -> Iterable[Metric]:
+        raise NotImplementedError
+
+    def compute(self) -> Iterable[Metric]:
+        raise NotImplementedError
+
+    def describe(self) -> List[Metric]:
+        return list(self.describe_families())
+
+    def collect(self) -> List[Metric]:
+        families = self._families
+        if families is not None and time.monotonic() < self._expires:
+            return families
+        with self._lock:
+            # Another scrape may have computed while we waited for the lock
+            if self._families is not None and time.monotonic() < self._expires:
+                return self._families
+            try:
+                families = list(self.compute())
+            except Exception as e:
+                print(f"Error collecting {type(self).__name__}: {e}")
+                families = self._families or []
+            self._families = families
+            self._expires = time.monotonic() + self.ttl
+        return families
+
+    def invalidate(self) -> None:
+        """Force the next scrape to recompute."""
+        self._expires = 0.0
+
+
+class SystemMetricsCollector(CachedCollector):
+    """
+    Non-blocking system/process stats.
+
+    CPU usage is computed from the delta of ``psutil.cpu_times()`` since the
+    previous sample instead of sleeping inside ``cpu_percent(interval=1)``.
+    Every source has its own interval: a scrape only re-samples the sources
+    whose interval has elapsed and reuses the last values of the others.
+    """
+
+    def __init__(self, intervals: Optional[Dict[str, float]] = None, ttl: Optional[float] = None):
+        super().__init__(ttl)
+        intervals = {**SYSTEM_SAMPLE_INTERVALS, **(intervals or {})}
+        self._process = psutil.Process()
+        # Baseline so the first scrape already has a CPU delta to report
+        self._last_cpu_times = psutil.cpu_times()
+        self._values: Dict[str, Dict[Tuple[str, Tuple[str, ...]], float]] = {}
+        self.sources: List[Tuple[str, float, Callable[[], Dict]]] = [
+            ("cpu", intervals["cpu"], self.sample_cpu),
+            ("memory", intervals["memory"], self.sample_memory),
+            ("process", intervals["process"], self.sample_process),
+            ("disk", intervals["disk"], self.sample_disk),
+        ]
+        self._next_due: Dict[str, float] = {}
+
+    def describe_families(self) -> Iterable[Metric]:
+        yield GaugeMetricFamily('system_cpu_usage_percent', 'System CPU usage percentage')
+        yield GaugeMetricFamily('system_memory_used_percent', 'System memory usage percentage')
+        yield GaugeMetricFamily('system_memory_available_bytes', 'System memory available in bytes')
+        yield GaugeMetricFamily('system_disk_used_percent', 'Disk usage percentage per mountpoint', labels=['mountpoint'])
+        yield GaugeMetricFamily('process_memory_rss_bytes', 'Resident set size of this process in bytes')
+        yield GaugeMetricFamily('process_open_file_descriptors', 'Open file descriptors of this process')
+        yield GaugeMetricFamily('process_threads', 'Threads of this process')
+
+    def refresh(self, now: Optional[float] = None) -> None:
+        """Re-sample every source whose interval has elapsed."""
+        now = time.monotonic() if now is None else now
+        for name, interval, sample in self.sources:
+            if now >= self._next_due.get(name, 0.0):
+                try:
+                    self._values[name] = sample()
+                except Exception as e:
+                    print(f"Error sampling {name} metrics: {e}")
+                self._next_due[name] = now + interval
+
+    def compute(self) -> Iterable[Metric]:
+        self.refresh()
+        values = {}
+        for source_values in self._values.values():
+            values.update(source_values)
+        for family in self.describe_families():
+            for (name, labelvalues), value in values.items():
+                if name == family.name:
+                    family.add_metric(list(labelvalues), value)
+            yield family
+
+    def sample_cpu(self) -> Dict:
+        times = psutil.cpu_times()
+        previous, self._last_cpu_times = self._last_cpu_times, times
+        total = sum(times) - sum(previous)
+        if total <= 0:
+            return self._values.get("cpu", {})
+        idle = _idle_time(times) - _idle_time(previous)
+        percent = max(0.0, min(100.0, 100.0 * (total - idle) / total))
+        return {('system_cpu_usage_percent', ()): percent}
+
+    def sample_memory(self) -> Dict:
+        mem = psutil.virtual_memory()
+        return {
+            ('system_memory_used_percent', ()): mem.percent,
+            ('system_memory_available_bytes', ()): mem.available,
+        }
+
+    def sample_process(self) -> Dict:
+        with self._process.oneshot():
+            values = {
+                ('process_memory_rss_bytes', ()): self._process.memory_info().rss,
+                ('process_threads', ()): self._process.num_threads(),
+            }
+            if hasattr(self._process, "num_fds"):
+                values[('process_open_file_descriptors', ())] = self._process.num_fds()
+        return values
+
+    def sample_disk(self) -> Dict:
+        return {
+            ('system_disk_used_percent', (mountpoint,)): psutil.disk_usage(mountpoint).percent
+            for mountpoint in DISK_MOUNTPOINTS
+        }
+
+
+def _idle_time(times) -> float:
+    return times.idle + getattr(times, "iowait", 0.0)
+
+
+def _hit_ratio_family() -> GaugeMetricFamily:
+    return GaugeMetricFamily(
+        'cache_hit_ratio',
+        'Cache hit ratio (hits / (hits + misses)) for Redis/Valkey',
+        labels=['cache_type'],
+    )
+
+
+class DeprecatedGauge:
+    """
+    Returned where a Gauge used to be for values that are now computed on
+    scrape: ``labels()``, ``set()``, ``inc()`` and ``dec()`` are accepted and
+    ignored, so old call sites keep working.
+    """
+
+    def __init__(self, name: str):
+        self.name = name
+
+    def labels(self, *labelvalues, **labelkwargs) -> "DeprecatedGauge":
+        return self
+
+    def set(self, value: float) -> None:
+        pass
+
+    def inc(self, amount: float = 1) -> None:
+        pass
+
+    def dec(self, amount: float = 1) -> None:
+        pass
+
+
+class CacheHitRatioCollector(CachedCollector):
+    """cache_hit_ratio{cache_type} = hits / (hits + misses), computed on scrape."""
+
+    def labels(self, *labelvalues, **labelkwargs) -> DeprecatedGauge:
+        """Deprecated: cache_hit_ratio used to be a Gauge set by the application."""
+        warnings.warn(
+            "cache_hit_ratio is computed from cache_operations_total on scrape; values set on it are ignored",
+            DeprecationWarning,
+            stacklevel=2,
+        )
+        return DeprecatedGauge('cache_hit_ratio')
+
+    def describe_families(self) -> Iterable[Metric]:
+        yield _hit_ratio_family()
+
+    def compute(self) -> Iterable[Metric]:
+        from app.core.prometheus.metrics import get_cache_count
+
+        hits: Dict[str, float] = defaultdict(float)
+        misses: Dict[str, float] = defaultdict(float)
+        for metric in get_cache_count().collect():
+            for sample in metric.samples:
+                if sample.name != 'cache_operations_total':
+                    continue
+                operation = sample.labels.get('operation')
+                if operation == 'hit':
+                    hits[sample.labels.get('cache_type')] += sample.value
+                elif operation == 'miss':
+                    misses[sample.labels.get('cache_type')] += sample.value
+
+        family = _hit_ratio_family()
+        for cache_type in sorted(set(DEFAULT_CACHE_TYPES) | set(hits) | set(misses)):
+            total = hits[cache_type] + misses[cache_type]
+            # Report a full ratio when no data is available yet
+            family.add_metric([cache_type], hits[cache_type] / total if total else 1.0)
+        yield family
+
+
+PoolSource = Callable[[], Dict[str, float]]
+_POOL_METRIC = 'db_pool_connections'
+_POOL_DOC = 'Database connection pool state'
+
+
+class ConnectionPoolCollector(CachedCollector):
+    """
+    db_pool_connections{db_type, state} read from registered pool sources.
+    A source is a callable returning ``{state: value}``, e.g.
+    ``{"size": 10, "checked_out": 3, "overflow": 0}``. Unlike the
+    db_connections gauge, nothing has to be set by the application.
+
+    Several pools can share a db_type (e.g. read and write pools of one
+    database) when registered under different ``key``s; their states are
+    summed.
+    """
+
+    def __init__(self, ttl: Optional[float] = None):
+        super().__init__(ttl)
+        self._sources: Dict[Tuple[str, Hashable], PoolSource] = {}
+
+    def register_pool(self, db_type: str, source: PoolSource, key: Hashable = None) -> None:
+        self._sources[(db_type, key)] = source
+        self.invalidate()
+
+    def unregister_pool(self, db_type: str, key: Hashable = None) -> None:
+        self._sources.pop((db_type, key), None)
+        self.invalidate()
+
+    def describe_families(self) -> Iterable[Metric]:
+        yield GaugeMetricFamily(_POOL_METRIC, _POOL_DOC, labels=['db_type', 'state'])
+
+    def compute(self) -> Iterable[Metric]:
+        family = GaugeMetricFamily(_POOL_METRIC, _POOL_DOC, labels=['db_type', 'state'])
+        totals: Dict[Tuple[str, str], float] = {}
+        for (db_type, _), source in list(self._sources.items()):
+            try:
+                states = source()
+            except Exception as e:
+                print(f"Error reading {db_type} connection pool: {e}")
+                continue
+            for state, value in states.items():
+                totals[(db_type, state)] = totals.get((db_type, state), 0) + value
+        for (db_type, state), value in totals.items():
+            family.add_metric([db_type, state], value)
+        yield family
@@ -15,6 +15,43 @@ class PrometheusConfig(BaseSettings):
     HEALTH_TIMEOUT: int = Field(default=30, validation_alias="PROMETHEUS_HEALTH_TIMEOUT")
     METRICS_PREFIX: str = Field(default="lead_ignite_", validation_alias="PROMETHEUS_METRICS_PREFIX")
     SCRAPE_INTERVAL: int = Field(default=15, validation_alias="PROMETHEUS_SCRAPE_INTERVAL")
+    ROUTE_CACHE_SIZE: int = Field(default=1024, validation_alias="PROMETHEUS_ROUTE_CACHE_SIZE")
+    BUFFERED_RECORDING: bool = Field(default=False, validation_alias="PROMETHEUS_BUFFERED_RECORDING")
+    BUFFER_FLUSH_INTERVAL_MS: int = Field(default=1000, validation_alias="PROMETHEUS_BUFFER_FLUSH_INTERVAL_MS")
+    COLLECTOR_CACHE_TTL: float = Field(default=1.0, validation_alias="PROMETHEUS_COLLECTOR_CACHE_TTL")
+    EXPOSITION_CACHE_TTL: float = Field(default=1.0, validation_alias="PROMETHEUS_EXPOSITION_CACHE_TTL")
+    SCRAPE_CONCURRENCY: int = Field(default=2, validation_alias="PROMETHEUS_SCRAPE_CONCURRENCY")
+    EXPOSITION_STREAMING: bool = Field(default=False, validation_alias="PROMETHEUS_EXPOSITION_STREAMING")
+    MAX_SERIES_PER_METRIC: int = Field(default=1000, validation_alias="PROMETHEUS_MAX_SERIES_PER_METRIC")
+    SERIES_LIMITS: dict[str, int] = Field(default_factory=dict, validation_alias="PROMETHEUS_SERIES_LIMITS")
+    SPARSE_HISTOGRAMS: list[str] = Field(default_factory=list, validation_alias="PROMETHEUS_SPARSE_HISTOGRAMS")
+    SPARSE_HISTOGRAM_SCHEMA: int = Field(default=3, validation_alias="PROMETHEUS_SPARSE_HISTOGRAM_SCHEMA")
+    SPARSE_HISTOGRAM_MAX_BUCKETS: int = Field(default=160, validation_alias="PROMETHEUS_SPARSE_HISTOGRAM_MAX_BUCKETS")
+    SKETCH_QUANTILES: list[float] = Field(default_factory=lambda: [0.5, 0.9, 0.99], validation_alias="PROMETHEUS_SKETCH_QUANTILES")
+    SKETCH_RELATIVE_ACCURACY: float = Field(default=0.01, validation_alias="PROMETHEUS_SKETCH_RELATIVE_ACCURACY")
+    SKETCH_MAX_BINS: int = Field(default=2048, validation_alias="PROMETHEUS_SKETCH_MAX_BINS")
+    SLO_ENABLED: bool = Field(default=False, validation_alias="PROMETHEUS_SLO_ENABLED")
+    SLO_MAX_ENDPOINTS: int = Field(default=500, validation_alias="PROMETHEUS_SLO_MAX_ENDPOINTS")
+    RECORDING_RULES_ENABLED: bool = Field(default=False, validation_alias="PROMETHEUS_RECORDING_RULES_ENABLED")
+    RECORDING_RULES_FILE: str | None = Field(default=None, validation_alias="PROMETHEUS_RECORDING_RULES_FILE")
+    RECORDING_RULES_INTERVAL: float = Field(default=15.0, validation_alias="PROMETHEUS_RECORDING_RULES_INTERVAL")
+    CHECKPOINT_FILE: str | None = Field(default=None, validation_alias="PROMETHEUS_CHECKPOINT_FILE")
+    CHECKPOINT_INTERVAL: float = Field(default=5.0, validation_alias="PROMETHEUS_CHECKPOINT_INTERVAL")
+    PUSH_URL: str | None = Field(default=None, validation_alias="PROMETHEUS_PUSH_URL")
+    PUSH_MODE: str = Field(default="remote_write", validation_alias="PROMETHEUS_PUSH_MODE")
+    PUSH_JOB: str = Field(default="celery", validation_alias="PROMETHEUS_PUSH_JOB")
+    PUSH_INTERVAL: float = Field(default=10.0, validation_alias="PROMETHEUS_PUSH_INTERVAL")
+    PUSH_MAX_QUEUE: int = Field(default=100, validation_alias="PROMETHEUS_PUSH_MAX_QUEUE")
+    PUSH_MAX_BATCH_SAMPLES: int = Field(default=5000, validation_alias="PROMETHEUS_PUSH_MAX_BATCH_SAMPLES")
+    PULSAR_ADMIN_URL: str | None = Field(default=None, validation_alias="PROMETHEUS_PULSAR_ADMIN_URL")
+    PULSAR_NAMESPACES: list[str] = Field(default_factory=lambda: ["public/default"], validation_alias="PROMETHEUS_PULSAR_NAMESPACES")
+    PULSAR_ADMIN_TOKEN: str | None = Field(default=None, validation_alias="PROMETHEUS_PULSAR_ADMIN_TOKEN")
+    PULSAR_ADMIN_TIMEOUT: float = Field(default=5.0, validation_alias="PROMETHEUS_PULSAR_ADMIN_TIMEOUT")
+    PULSAR_ADMIN_INTERVAL: float = Field(default=15.0, validation_alias="PROMETHEUS_PULSAR_ADMIN_INTERVAL")
+    EXEMPLARS_ENABLED: bool = Field(default=True, validation_alias="PROMETHEUS_EXEMPLARS_ENABLED")
+    EXEMPLAR_POLICY: str = Field(default="latest", validation_alias="PROMETHEUS_EXEMPLAR_POLICY")
+    EXEMPLAR_MAX_AGE: float = Field(default=60.0, validation_alias="PROMETHEUS_EXEMPLAR_MAX_AGE")
+    MULTIPROCESS_DIR: str | None = Field(default=None, validation_alias="PROMETHEUS_MULTIPROC_DIR")
     DEFAULT_LABELS: dict[str, Any] = Field(default_factory=lambda: {"service": "lead_ignite", "environment": "production"}, validation_alias="PROMETHEUS_DEFAULT_LABELS")
 
     model_config = ConfigDict(
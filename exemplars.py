@@ -0,0 +1,130 @@
+"""
+Exemplars linking histogram observations to traces.
+
+``attach_exemplar(child, value)`` puts ``{trace_id, span_id}`` of the current
+trace on the bucket an observation fell into, so a latency spike on a
+dashboard links to a concrete slow request. The trace comes from:
+
+1. the trace context set with ``set_trace_context()``, which
+   ``PrometheusMiddleware`` does from the W3C ``traceparent`` request header
+   for the duration of each request (so DB/cache/event observations made
+   while handling the request carry it too);
+2. otherwise the active OpenTelemetry span, when opentelemetry-api is
+   installed (a lookup that costs about as much as the observation itself,
+   so the cheap context variable goes first).
+
+Each bucket holds one exemplar, so memory is bounded by the bucket count.
+``PROMETHEUS_EXEMPLAR_POLICY`` picks which one: ``latest`` (every traced
+observation replaces it) or ``slowest`` (replaced only by a slower
+observation, or once the kept one is ``PROMETHEUS_EXEMPLAR_MAX_AGE`` seconds
+old).
+
+Sparse histograms keep theirs on the fixed classic buckets they expose
+alongside the exponential ones. Exemplars are only part of the OpenMetrics
+exposition; the classic text format drops them. Multiprocess mode (whose
+mmap values can't store them) doesn't get exemplars.
+"""
+import re
+import time
+from bisect import bisect_left
+from contextvars import ContextVar, Token
+from functools import partial
+from typing import Any, Dict, Optional
+
+from prometheus_client.samples import Exemplar
+
+from app.core.prometheus.config import get_prometheus_config
+from app.core.prometheus.histograms import SparseHistogramChild
+from app.core.prometheus.multiprocess import is_multiprocess_enabled
+
+TRACEPARENT_HEADER = "traceparent"
+LATEST = "latest"
+SLOWEST = "slowest"
+
+_TRACEPARENT = re.compile(r"^([0-9a-f]{2})-([0-9a-f]{32})-([0-9a-f]{16})-([0-9a-f]{2})(-.*)?$")
+_INVALID_TRACE_ID = "0" * 32
+_INVALID_SPAN_ID = "0" * 16
+
+TraceLabels = Dict[str, str]
+
+_trace_context: ContextVar[Optional[TraceLabels]] = ContextVar("prometheus_trace_context", default=None)
+# opentelemetry.trace.get_current_span, False when not installed, None until resolved
+_otel_current_span: Any = None
+
+
+def parse_traceparent(header: Optional[str]) -> Optional[TraceLabels]:
+    """Exemplar labels from a W3C ``traceparent`` header, or None if it is invalid."""
+    if not header:
+        return None
+    match = _TRACEPARENT.match(header.strip().lower())
+    if match is None:
+        return None
+    version, trace_id, span_id, _, rest = match.groups()
+    # Version ff is invalid; version 00 has no trailing fields
+    if version == "ff" or (version == "00" and rest):
+        return None
+    if trace_id == _INVALID_TRACE_ID or span_id == _INVALID_SPAN_ID:
+        return None
+    return {"trace_id": trace_id, "span_id": span_id}
+
+
+def set_trace_context(labels: Optional[TraceLabels]) -> Token:
+    """Use ``labels`` as the current trace in this context; undo with ``reset_trace_context()``."""
+    return _trace_context.set(labels)
+
+
+def reset_trace_context(token: Token) -> None:
+    _trace_context.reset(token)
+
+
+def _opentelemetry_labels() -> Optional[TraceLabels]:
+    global _otel_current_span
+    if _otel_current_span is None:
+        try:
+            from opentelemetry.trace import get_current_span
+            _otel_current_span = get_current_span
+        except ImportError:
+            _otel_current_span = False
+    if not _otel_current_span:
+        return None
+    context = _otel_current_span().get_span_context()
+    if not context.is_valid:
+        return None
+    return {"trace_id": format(context.trace_id, "032x"), "span_id": format(context.span_id, "016x")}
+
+
+def current_exemplar() -> Optional[TraceLabels]:
+    """Exemplar labels for the current trace, or None outside a trace."""
+    return _trace_context.get() or _opentelemetry_labels()
+
+
+def exemplars_enabled() -> bool:
+    return get_prometheus_config().EXEMPLARS_ENABLED and not is_multiprocess_enabled()
+
+
+def attach_exemplar(child: Any, value: float, labels: Optional[TraceLabels] = None) -> None:
+    """
+    Record ``labels`` (default: the current trace) as the exemplar of the
+    bucket ``value`` falls into. Call next to the observation itself.
+    """
+    if labels is None:
+        labels = current_exemplar()
+        if labels is None:
+            return
+    bounds = getattr(child, "_upper_bounds", None)
+    if bounds is not None:
+        bucket = child._buckets[bisect_left(bounds, value)]
+        get_exemplar, set_exemplar = bucket.get_exemplar, bucket.set_exemplar
+    elif isinstance(child, SparseHistogramChild):
+        # Sparse histograms keep exemplars on their fixed classic buckets
+        index = bisect_left(child._parent.classic_bounds, value)
+        get_exemplar, set_exemplar = partial(child.get_exemplar, index), partial(child.set_exemplar, index)
+    else:
+        return
+    now = time.time()
+    config = get_prometheus_config()
+    if config.EXEMPLAR_POLICY == SLOWEST:
+        kept = get_exemplar()
+        if kept is not None and kept.value > value and now - kept.timestamp < config.EXEMPLAR_MAX_AGE:
+            return
+    set_exemplar(Exemplar(labels, value, now))
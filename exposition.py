@@ -0,0 +1,649 @@
+"""
+Cached, pre-serialized /metrics exposition.
+
+Rendering the whole registry to text on every scrape gets expensive at tens
+of thousands of series when several Prometheus replicas (plus ad-hoc curls)
+scrape the same worker. ``MetricsExposition`` keeps, per content type:
+
+- the rendered payload for ``PROMETHEUS_EXPOSITION_CACHE_TTL`` seconds,
+  shared by every scrape in that window (one render per window, even when
+  scrapes arrive concurrently);
+- the rendered bytes of every metric family, so a render only re-serializes
+  the families whose samples changed since the previous one;
+- the gzip-compressed payload, compressed once and served from the cache.
+
+Content negotiation follows the ``Accept`` header: the Prometheus text
+format, OpenMetrics, or the Prometheus protobuf format
+(``io.prometheus.client.MetricFamily``, length-delimited), which is the
+cheapest for Prometheus to parse at high series counts. Protobuf is picked
+only when it is the scraper's highest-ranked supported type.
+
+Sparse histograms are exposed as native histograms, alongside their classic
+buckets, to scrapers that negotiate OpenMetrics 2.0 or protobuf, and as
+classic ``_bucket`` series only otherwise.
+
+With ``PROMETHEUS_EXPOSITION_STREAMING`` the servers skip the cache and
+stream the exposition (``MetricsExposition.stream()``): families are
+serialized one at a time and sent in chunks of about ``STREAM_CHUNK_SIZE``
+bytes, so memory held by a scrape stays flat as the registry grows. An
+error while collecting then truncates the response instead of turning it
+into a 500.
+
+Serialization never runs on the application's event loop:
+- ``MetricsApp`` is an ASGI app (mount it at /metrics) that renders on its
+  own worker threads;
+- ``start_metrics_server()`` serves the same payload from a separate
+  lightweight HTTP server on ``PrometheusConfig.PORT``.
+Both cap concurrent scrapes at ``PROMETHEUS_SCRAPE_CONCURRENCY`` (extra
+scrapes get a 503) and record metrics_scrape_duration_seconds{server}.
+"""
+import asyncio
+import gzip
+import math
+import struct
+import threading
+import time
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Optional, Tuple
+
+from prometheus_client.exposition import choose_encoder
+from prometheus_client.registry import Collector
+
+from app.core.prometheus.config import get_prometheus_config
+from app.core.prometheus.histograms import SparseHistogramMetricFamily
+
+GZIP_LEVEL = 6
+STREAM_CHUNK_SIZE = 64 * 1024
+PROTOBUF_CONTENT_TYPE = (
+    "application/vnd.google.protobuf; proto=io.prometheus.client.MetricFamily; encoding=delimited"
+)
+_OPENMETRICS_EOF = b"# EOF\n"
+
+
+class _SingleFamily:
+    """Collector shim so the stock encoders can render one family at a time."""
+
+    __slots__ = ("metric",)
+
+    def __init__(self, metric):
+        self.metric = metric
+
+    def collect(self):
+        return [self.metric]
+
+
+# ---------------------------------------------------------------------------
+# Protobuf encoding (io.prometheus.client metrics.proto, encoded by hand)
+# ---------------------------------------------------------------------------
+
+# MetricType enum values; info and stateset are gauges on the wire
+_PROTOBUF_TYPES = {
+    "counter": 0,
+    "gauge": 1,
+    "info": 1,
+    "stateset": 1,
+    "summary": 2,
+    "unknown": 3,
+    "histogram": 4,
+    "gaugehistogram": 5,
+}
+# Label that splits one series into several samples, per family type
+_GROUPING_LABELS = {"histogram": "le", "gaugehistogram": "le", "summary": "quantile"}
+
+
+def _varint(value: int) -> bytes:
+    out = bytearray()
+    value &= 0xFFFFFFFFFFFFFFFF  # int64 two's complement
+    while value > 0x7F:
+        out.append((value & 0x7F) | 0x80)
+        value >>= 7
+    out.append(value)
+    return bytes(out)
+
+
+def _uint(number: int, value: int) -> bytes:
+    """Varint field (wire type 0)."""
+    return _varint(number << 3) + _varint(value)
+
+
+def _sint(number: int, value: int) -> bytes:
+    """Zigzag-encoded sint32/sint64 field."""
+    return _uint(number, (value << 1) ^ (value >> 63))
+
+
+def _double(number: int, value: float) -> bytes:
+    """Double field (wire type 1)."""
+    return _varint(number << 3 | 1) + struct.pack("<d", value)
+
+
+def _field(number: int, payload: bytes) -> bytes:
+    """Length-delimited field (wire type 2)."""
+    return _varint(number << 3 | 2) + _varint(len(payload)) + payload
+
+
+def _label_pairs(labels: Iterable[Tuple[str, str]]) -> bytes:
+    return b"".join(_field(1, _field(1, name.encode()) + _field(2, value.encode())) for name, value in labels)
+
+
+def _timestamp(number: int, seconds: Any) -> bytes:
+    seconds = float(seconds)
+    whole = math.floor(seconds)
+    return _field(number, _uint(1, whole) + _uint(2, int((seconds - whole) * 1e9)))
+
+
+def _exemplar(number: int, exemplar: Any) -> bytes:
+    body = _label_pairs(exemplar.labels.items()) + _double(2, exemplar.value)
+    if exemplar.timestamp is not None:
+        body += _timestamp(3, exemplar.timestamp)
+    return _field(number, body)
+
+
+def _spans(number: int, spans: Any) -> bytes:
+    return b"".join(_field(number, _sint(1, span.offset) + _uint(2, span.length)) for span in spans or ())
+
+
+def _histogram(series: Dict[str, Any]) -> bytes:
+    native = series.get("native")
+    count = series.get("count", native.count_value if native is not None else 0)
+    total = series.get("sum", native.sum_value if native is not None else 0.0)
+    body = bytearray(_uint(1, int(count)) + _double(2, total))
+    for bound, sample in series.get("buckets", ()):
+        bucket = _uint(1, int(sample.value)) + _double(2, bound)
+        if sample.exemplar is not None:
+            bucket += _exemplar(3, sample.exemplar)
+        body += _field(3, bucket)
+    if native is not None:
+        body += _sint(5, native.schema) + _double(6, native.zero_threshold) + _uint(7, int(native.zero_count))
+        body += _spans(9, native.neg_spans) + b"".join(_sint(10, d) for d in native.neg_deltas or ())
+        body += _spans(12, native.pos_spans) + b"".join(_sint(13, d) for d in native.pos_deltas or ())
+    if "created" in series:
+        body += _timestamp(15, series["created"])
+    return bytes(body)
+
+
+def _protobuf_metric(kind: str, labels: Tuple[Tuple[str, str], ...], series: Dict[str, Any]) -> bytes:
+    body = _label_pairs(labels)
+    if kind == "counter":
+        counter = _double(1, series.get("value", 0.0))
+        if series.get("exemplar") is not None:
+            counter += _exemplar(2, series["exemplar"])
+        if "created" in series:
+            counter += _timestamp(3, series["created"])
+        body += _field(3, counter)
+    elif kind in ("gauge", "info", "stateset"):
+        body += _field(2, _double(1, series.get("value", 0.0)))
+    elif kind == "summary":
+        summary = _uint(1, int(series.get("count", 0))) + _double(2, series.get("sum", 0.0))
+        for quantile, value in series.get("quantiles", ()):
+            summary += _field(3, _double(1, quantile) + _double(2, value))
+        if "created" in series:
+            summary += _timestamp(4, series["created"])
+        body += _field(4, summary)
+    elif kind in ("histogram", "gaugehistogram"):
+        body += _field(7, _histogram(series))
+    else:
+        body += _field(5, _double(1, series.get("value", 0.0)))
+    if series.get("timestamp") is not None:
+        body += _uint(6, int(float(series["timestamp"]) * 1000))
+    return body
+
+
+def encode_protobuf_family(metric) -> bytes:
+    """
+    One metric family as a length-delimited ``MetricFamily`` message.
+    Samples of a family are regrouped into one ``Metric`` per label set;
+    sparse histograms carry their native buckets next to the classic ones.
+    """
+    kind = metric.type if metric.type in _PROTOBUF_TYPES else "unknown"
+    grouping = _GROUPING_LABELS.get(kind)
+    groups: Dict[Tuple[Tuple[str, str], ...], Dict[str, Any]] = {}
+    for sample in metric.samples:
+        labels = sample.labels
+        if grouping is not None and grouping in labels:
+            key = tuple((k, v) for k, v in labels.items() if k != grouping)
+        else:
+            key = tuple(labels.items())
+        series = groups.get(key)
+        if series is None:
+            series = groups[key] = {"timestamp": sample.timestamp}
+        suffix = sample.name[len(metric.name):]
+        if suffix == "_created":
+            series["created"] = sample.value
+        elif suffix in ("_count", "_gcount"):
+            series["count"] = sample.value
+        elif suffix in ("_sum", "_gsum"):
+            series["sum"] = sample.value
+        elif suffix == "_bucket":
+            series.setdefault("buckets", []).append((float(labels["le"]), sample))
+        elif kind == "summary" and "quantile" in labels:
+            series.setdefault("quantiles", []).append((float(labels["quantile"]), sample.value))
+        else:
+            series["value"] = sample.value
+            series["exemplar"] = sample.exemplar
+    for sample in getattr(metric, "native_samples", ()):
+        groups.setdefault(tuple(sample.labels.items()), {})["native"] = sample.native_histogram
+
+    name = metric.name
+    if kind == "counter":
+        name += "_total"
+    elif kind == "info":
+        name += "_info"
+    message = bytearray(_field(1, name.encode()))
+    if metric.documentation:
+        message += _field(2, metric.documentation.encode())
+    message += _uint(3, _PROTOBUF_TYPES[kind])
+    for labels, series in groups.items():
+        message += _field(4, _protobuf_metric(kind, labels, series))
+    if metric.unit:
+        message += _field(5, metric.unit.encode())
+    return _varint(len(message)) + bytes(message)
+
+
+def generate_protobuf(registry: Collector) -> bytes:
+    """The registry in the Prometheus protobuf (delimited) format."""
+    return b"".join(encode_protobuf_family(metric) for metric in registry.collect())
+
+
+def negotiate(accept: Optional[str]) -> Tuple[Callable[[Collector], bytes], str]:
+    """
+    Encoder and content type for an ``Accept`` header. Protobuf wins when
+    it has the highest quality among supported types; otherwise this is
+    prometheus_client's ``choose_encoder`` (OpenMetrics when accepted at all).
+    """
+    best, protobuf = -1.0, False
+    for part in (accept or "").split(","):
+        media, *raw_params = part.split(";")
+        media = media.strip().lower()
+        params = {}
+        for param in raw_params:
+            key, _, value = param.partition("=")
+            params[key.strip().lower()] = value.strip().strip('"')
+        if media == "application/vnd.google.protobuf":
+            if params.get("proto") != "io.prometheus.client.MetricFamily" or params.get("encoding") != "delimited":
+                continue
+        elif media not in ("application/openmetrics-text", "text/plain"):
+            continue
+        try:
+            quality = float(params.get("q", 1))
+        except ValueError:
+            continue
+        if quality > best:
+            best, protobuf = quality, media == "application/vnd.google.protobuf"
+    if protobuf:
+        return generate_protobuf, PROTOBUF_CONTENT_TYPE
+    return choose_encoder(accept or "")
+
+
+def _native_histograms(content_type: str) -> bool:
+    if not content_type.startswith("application/openmetrics-text"):
+        return False
+    for param in content_type.split(";")[1:]:
+        key, _, value = param.strip().partition("=")
+        if key == "version":
+            return int(value.split(".")[0]) >= 2
+    return False
+
+
+def _coalesce(chunks: Iterable[bytes], size: int = STREAM_CHUNK_SIZE) -> Iterator[bytes]:
+    buffer = bytearray()
+    for chunk in chunks:
+        buffer += chunk
+        if len(buffer) >= size:
+            yield bytes(buffer)
+            buffer.clear()
+    if buffer:
+        yield bytes(buffer)
+
+
+def _gzip_chunks(chunks: Iterable[bytes]) -> Iterator[bytes]:
+    compressor = zlib.compressobj(GZIP_LEVEL, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    for chunk in chunks:
+        data = compressor.compress(chunk)
+        if data:
+            yield data
+    yield compressor.flush()
+
+
+class _Payload:
+    __slots__ = ("body", "gzipped")
+
+    def __init__(self, body: bytes):
+        self.body = body
+        self.gzipped: Optional[bytes] = None
+
+
+class _RenderCache:
+    """Cached payload and per-family bytes for one content type."""
+
+    def __init__(self, encoder: Callable[[Collector], bytes], content_type: str):
+        self.encoder = encoder
+        self.content_type = content_type
+        self.lock = threading.Lock()
+        self.families: Dict[Tuple[str, int], Tuple[tuple, bytes]] = {}
+        self.payload: Optional[_Payload] = None
+        self.expires = 0.0
+
+    def fresh(self) -> bool:
+        return self.payload is not None and time.monotonic() < self.expires
+
+    @property
+    def native_histograms(self) -> bool:
+        return _native_histograms(self.content_type)
+
+
+class MetricsExposition:
+    """Serve a registry's exposition from a per-content-type render cache."""
+
+    def __init__(self, registry: Optional[Collector] = None, ttl: Optional[float] = None):
+        if registry is None:
+            from app.core.prometheus.metrics import get_metric_registry
+            registry = get_metric_registry()
+        self.registry = registry
+        self.ttl = get_prometheus_config().EXPOSITION_CACHE_TTL if ttl is None else ttl
+        self._caches: Dict[str, _RenderCache] = {}
+        self._caches_lock = threading.Lock()
+        # Families re-serialized by the last render (for tests/diagnostics)
+        self.last_rendered = 0
+
+    def render(
+        self,
+        accept: Optional[str] = None,
+        accept_encoding: Optional[str] = None,
+    ) -> Tuple[bytes, Dict[str, str]]:
+        """Return the payload and response headers for a scrape request."""
+        cache = self._cache_for(accept)
+        if not cache.fresh():
+            with cache.lock:
+                # Another scrape may have rendered while we waited for the lock
+                if not cache.fresh():
+                    self._render(cache)
+        payload = cache.payload
+        headers = {"Content-Type": cache.content_type}
+        if accept_encoding and "gzip" in accept_encoding:
+            if payload.gzipped is None:
+                with cache.lock:
+                    if payload.gzipped is None:
+                        payload.gzipped = gzip.compress(payload.body, compresslevel=GZIP_LEVEL)
+            headers["Content-Encoding"] = "gzip"
+            return payload.gzipped, headers
+        return payload.body, headers
+
+    def stream(
+        self,
+        accept: Optional[str] = None,
+        accept_encoding: Optional[str] = None,
+    ) -> Tuple[Iterator[bytes], Dict[str, str]]:
+        """
+        Like ``render()``, but bypass the cache and return a lazy iterator of
+        chunks: families are collected and serialized as it is consumed, so
+        the full payload is never held in memory.
+        """
+        encoder, content_type = negotiate(accept)
+        headers = {"Content-Type": content_type}
+        chunks = _coalesce(self._serialize(encoder, content_type))
+        if accept_encoding and "gzip" in accept_encoding:
+            headers["Content-Encoding"] = "gzip"
+            chunks = _gzip_chunks(chunks)
+        return chunks, headers
+
+    def invalidate(self) -> None:
+        """Force the next scrape to re-render (families are still diffed)."""
+        for cache in list(self._caches.values()):
+            cache.expires = 0.0
+
+    def _cache_for(self, accept: Optional[str]) -> _RenderCache:
+        encoder, content_type = negotiate(accept)
+        cache = self._caches.get(content_type)
+        if cache is None:
+            with self._caches_lock:
+                cache = self._caches.setdefault(content_type, _RenderCache(encoder, content_type))
+        return cache
+
+    def _render(self, cache: _RenderCache) -> None:
+        openmetrics = cache.content_type.startswith("application/openmetrics-text")
+        native = cache.native_histograms
+        previous = cache.families
+        families: Dict[Tuple[str, int], Tuple[tuple, bytes]] = {}
+        chunks: List[bytes] = []
+        seen: Dict[str, int] = {}
+        rendered = 0
+        for metric in self.registry.collect():
+            # A name can appear more than once (e.g. merged multiprocess output)
+            occurrence = seen.get(metric.name, 0)
+            seen[metric.name] = occurrence + 1
+            key = (metric.name, occurrence)
+            if native and isinstance(metric, SparseHistogramMetricFamily):
+                metric = metric.native()
+            signature = (metric.type, metric.documentation, metric.unit, metric.samples)
+            cached = previous.get(key)
+            if cached is not None and cached[0] == signature:
+                data = cached[1]
+            else:
+                data = _encode_family(cache.encoder, metric, openmetrics)
+                rendered += 1
+            families[key] = (signature, data)
+            chunks.append(data)
+        if openmetrics:
+            chunks.append(_OPENMETRICS_EOF)
+
+        cache.families = families
+        cache.payload = _Payload(b"".join(chunks))
+        cache.expires = time.monotonic() + self.ttl
+        self.last_rendered = rendered
+
+    def _serialize(self, encoder: Callable[[Collector], bytes], content_type: str) -> Iterator[bytes]:
+        openmetrics = content_type.startswith("application/openmetrics-text")
+        native = _native_histograms(content_type)
+        for metric in self.registry.collect():
+            if native and isinstance(metric, SparseHistogramMetricFamily):
+                metric = metric.native()
+            yield _encode_family(encoder, metric, openmetrics)
+        if openmetrics:
+            yield _OPENMETRICS_EOF
+
+
+def _encode_family(encoder: Callable[[Collector], bytes], metric, openmetrics: bool) -> bytes:
+    data = encoder(_SingleFamily(metric))
+    if openmetrics and data.endswith(_OPENMETRICS_EOF):
+        data = data[:-len(_OPENMETRICS_EOF)]
+    return data
+
+
+_exposition: Optional[MetricsExposition] = None
+
+def get_exposition() -> MetricsExposition:
+    """Get the cached exposition of the shared metric registry."""
+    global _exposition
+    if _exposition is None:
+        _exposition = MetricsExposition()
+    return _exposition
+
+
+def metrics_endpoint(request):
+    """
+    Starlette/FastAPI route handler for /metrics, e.g.
+    ``app.add_route("/metrics", metrics_endpoint)``. It is a plain function,
+    so Starlette runs it in its thread pool, off the event loop (and
+    iterates a streamed exposition there too).
+    """
+    from starlette.responses import Response, StreamingResponse
+
+    accept, accept_encoding = request.headers.get("accept"), request.headers.get("accept-encoding")
+    if get_prometheus_config().EXPOSITION_STREAMING:
+        chunks, headers = get_exposition().stream(accept, accept_encoding)
+        return StreamingResponse(chunks, headers=headers)
+    body, headers = get_exposition().render(accept, accept_encoding)
+    return Response(body, headers=headers)
+
+
+_REJECTED_BODY = b"Too many concurrent scrapes\n"
+
+
+class MetricsApp:
+    """
+    ASGI app serving the cached exposition, e.g.
+    ``app.mount("/metrics", MetricsApp())``. Rendering runs on a dedicated
+    thread pool, so in-flight requests on the event loop are never stalled
+    by serialization of a large registry. When streaming, each chunk is
+    serialized on that pool and sent as it is ready.
+    """
+
+    def __init__(
+        self,
+        exposition: Optional[MetricsExposition] = None,
+        max_concurrency: Optional[int] = None,
+        streaming: Optional[bool] = None,
+    ):
+        from app.core.prometheus.metrics import bind, get_scrape_duration, get_scrape_rejected
+
+        config = get_prometheus_config()
+        limit = max_concurrency or config.SCRAPE_CONCURRENCY
+        self._exposition = exposition
+        self._streaming = config.EXPOSITION_STREAMING if streaming is None else streaming
+        self._semaphore = threading.BoundedSemaphore(limit)
+        self._executor = ThreadPoolExecutor(max_workers=limit, thread_name_prefix="metrics-exposition")
+        self._duration = bind(get_scrape_duration()).child("asgi")
+        self._rejected = bind(get_scrape_rejected()).child("asgi")
+
+    @property
+    def exposition(self) -> MetricsExposition:
+        if self._exposition is None:
+            self._exposition = get_exposition()
+        return self._exposition
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] == "lifespan":
+            await _serve_lifespan(receive, send)
+            return
+        if scope["type"] != "http":
+            return
+        if scope["method"] not in ("GET", "HEAD"):
+            await _send_response(send, 405, {"Allow": "GET, HEAD"}, b"")
+            return
+        if not self._semaphore.acquire(blocking=False):
+            self._rejected.inc()
+            await _send_response(send, 503, {"Retry-After": "1"}, _REJECTED_BODY)
+            return
+
+        start = time.perf_counter()
+        try:
+            request_headers = {k.decode("latin-1").lower(): v.decode("latin-1") for k, v in scope["headers"]}
+            accept, accept_encoding = request_headers.get("accept"), request_headers.get("accept-encoding")
+            if self._streaming:
+                # The permit is held until the last chunk has been sent
+                chunks, headers = self.exposition.stream(accept, accept_encoding)
+                await _send_stream(send, headers, iter(()) if scope["method"] == "HEAD" else chunks, self._executor)
+            else:
+                loop = asyncio.get_running_loop()
+                body, headers = await loop.run_in_executor(
+                    self._executor, self.exposition.render, accept, accept_encoding
+                )
+        finally:
+            self._semaphore.release()
+        if not self._streaming:
+            await _send_response(send, 200, headers, b"" if scope["method"] == "HEAD" else body, len(body))
+        self._duration.observe(time.perf_counter() - start)
+
+
+def _raw_headers(headers: Dict[str, str]) -> List[Tuple[bytes, bytes]]:
+    return [(k.lower().encode("latin-1"), v.encode("latin-1")) for k, v in headers.items()]
+
+
+async def _send_response(send, status: int, headers: Dict[str, str], body: bytes, length: Optional[int] = None):
+    raw_headers = _raw_headers(headers)
+    raw_headers.append((b"content-length", str(len(body) if length is None else length).encode("latin-1")))
+    await send({"type": "http.response.start", "status": status, "headers": raw_headers})
+    await send({"type": "http.response.body", "body": body})
+
+
+async def _send_stream(send, headers: Dict[str, str], chunks: Iterator[bytes], executor: ThreadPoolExecutor):
+    # No content-length: the server sends the body chunked
+    loop = asyncio.get_running_loop()
+    await send({"type": "http.response.start", "status": 200, "headers": _raw_headers(headers)})
+    while True:
+        chunk = await loop.run_in_executor(executor, next, chunks, None)
+        if chunk is None:
+            break
+        await send({"type": "http.response.body", "body": chunk, "more_body": True})
+    await send({"type": "http.response.body", "body": b""})
+
+
+async def _serve_lifespan(receive, send):
+    # Only reached when MetricsApp is the top-level app (not when mounted)
+    while True:
+        message = await receive()
+        if message["type"] == "lifespan.startup":
+            await send({"type": "lifespan.startup.complete"})
+        elif message["type"] == "lifespan.shutdown":
+            await send({"type": "lifespan.shutdown.complete"})
+            return
+
+
+def start_metrics_server(
+    port: Optional[int] = None,
+    addr: str = "0.0.0.0",
+    exposition: Optional[MetricsExposition] = None,
+    max_concurrency: Optional[int] = None,
+    streaming: Optional[bool] = None,
+) -> ThreadingHTTPServer:
+    """
+    Serve /metrics from a separate HTTP server on a daemon thread, fully
+    outside the application's event loop. Returns the server; call
+    ``shutdown()`` on it to stop.
+    """
+    from app.core.prometheus.metrics import bind, get_scrape_duration, get_scrape_rejected
+
+    config = get_prometheus_config()
+    port = config.PORT if port is None else port
+    exposition = exposition or get_exposition()
+    streaming = config.EXPOSITION_STREAMING if streaming is None else streaming
+    semaphore = threading.BoundedSemaphore(max_concurrency or config.SCRAPE_CONCURRENCY)
+    duration = bind(get_scrape_duration()).child("http")
+    rejected = bind(get_scrape_rejected()).child("http")
+
+    class MetricsHandler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if not semaphore.acquire(blocking=False):
+                rejected.inc()
+                self._respond(503, {"Retry-After": "1"}, _REJECTED_BODY)
+                return
+            start = time.perf_counter()
+            accept, accept_encoding = self.headers.get("Accept"), self.headers.get("Accept-Encoding")
+            try:
+                if streaming:
+                    # HTTP/1.0 without Content-Length: the body ends when the connection closes
+                    chunks, headers = exposition.stream(accept, accept_encoding)
+                    self._start(200, headers)
+                    self.end_headers()
+                    for chunk in chunks:
+                        self.wfile.write(chunk)
+                else:
+                    body, headers = exposition.render(accept, accept_encoding)
+            finally:
+                semaphore.release()
+            if not streaming:
+                self._respond(200, headers, body)
+            duration.observe(time.perf_counter() - start)
+
+        def _start(self, status, headers):
+            self.send_response(status)
+            for name, value in headers.items():
+                self.send_header(name, value)
+
+        def _respond(self, status, headers, body):
+            self._start(status, headers)
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            # Scrapes every few seconds would flood stderr
+            pass
+
+    server = ThreadingHTTPServer((addr, port), MetricsHandler)
+    server.daemon_threads = True
+    thread = threading.Thread(target=server.serve_forever, daemon=True, name="metrics-server")
+    thread.start()
+    return server
@@ -0,0 +1,275 @@
+"""
+Sparse exponential histograms (native-histogram style).
+
+A classic ``Histogram``'s fixed buckets have poor resolution at sub-10ms
+latencies unless the bucket list (and so every series' memory and scrape
+size) grows with it.
+
+``SparseHistogram`` uses the exponential bucket layout of Prometheus native
+histograms: with schema ``s``, bucket ``i`` covers ``(base**(i-1), base**i]``
+where ``base = 2 ** (2 ** -s)``. Only exponential buckets that received an
+observation are allocated. When a child exceeds ``max_buckets`` the schema
+is lowered by one, which merges neighbouring buckets pairwise, so that part
+stays bounded at the cost of resolution.
+
+The trade-off is resolution, not memory: each child also keeps the counts
+of the fixed classic layout (below), so it holds a classic bucket array
+plus up to ``max_buckets`` exponential buckets, more than a ``Histogram``
+child with the same ``buckets=``.
+
+Exposition:
+- ``collect()`` yields classic ``_bucket``/``_count``/``_sum`` samples, which
+  every scraper understands. Like client_golang, each child also counts its
+  observations in a fixed classic bucket layout (the ``buckets=`` the metric
+  would have as a ``Histogram``), so every series exposes the same ``le``
+  set and it never changes when the schema is lowered. These buckets also
+  hold the exemplars (``exemplars.py``);
+- the families also carry a native-histogram sample per child in
+  ``native_samples``, added next to the classic samples by expositions that
+  can carry native histograms (OpenMetrics 2.0 and protobuf).
+"""
+import math
+import threading
+from bisect import bisect_left
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+from prometheus_client import Histogram
+from prometheus_client.core import HistogramMetricFamily
+from prometheus_client.samples import BucketSpan, Exemplar, NativeHistogram, Sample
+from prometheus_client.utils import floatToGoString
+
+DEFAULT_SCHEMA = 3  # ~9% bucket width
+DEFAULT_MAX_BUCKETS = 160
+DEFAULT_ZERO_THRESHOLD = 2.0 ** -128
+MIN_SCHEMA = -4
+MAX_SCHEMA = 8
+
+
+class SparseHistogramMetricFamily(HistogramMetricFamily):
+    """Histogram family with classic samples and their native equivalents."""
+
+    def __init__(self, name: str, documentation: str, labels: Optional[Sequence[str]] = None, unit: str = ''):
+        super().__init__(name, documentation, labels=labels, unit=unit)
+        self.native_samples: List[Sample] = []
+
+    def native(self) -> HistogramMetricFamily:
+        """Copy of this family with the native-histogram samples after the classic ones."""
+        family = HistogramMetricFamily(self.name, self.documentation, unit=self.unit)
+        family.samples = list(self.samples) + list(self.native_samples)
+        return family
+
+
+class SparseHistogramChild:
+    """Observations of one label set."""
+
+    __slots__ = (
+        "_parent", "_lock", "schema", "zero_count", "positive", "negative", "classic", "exemplars", "count", "sum",
+    )
+
+    def __init__(self, parent: "SparseHistogram"):
+        self._parent = parent
+        self._lock = threading.Lock()
+        self.schema = parent.schema
+        self.zero_count = 0
+        self.positive: Dict[int, int] = {}
+        self.negative: Dict[int, int] = {}
+        # Non-cumulative counts per classic bound (the last one is +Inf)
+        self.classic = [0] * len(parent.classic_bounds)
+        # Exemplar per classic bucket, allocated on the first one
+        self.exemplars: Optional[List[Optional[Exemplar]]] = None
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value: float) -> None:
+        with self._lock:
+            self.count += 1
+            self.sum += value
+            self.classic[bisect_left(self._parent.classic_bounds, value)] += 1
+            magnitude = abs(value)
+            if magnitude <= self._parent.zero_threshold:
+                self.zero_count += 1
+                return
+            buckets = self.positive if value > 0 else self.negative
+            index = bucket_index(magnitude, self.schema)
+            buckets[index] = buckets.get(index, 0) + 1
+            if len(self.positive) + len(self.negative) > self._parent.max_buckets:
+                self._reduce()
+
+    def _reduce(self) -> None:
+        # Lowering the schema by one merges buckets (2i-1, 2i] into i
+        while self.schema > MIN_SCHEMA and len(self.positive) + len(self.negative) > self._parent.max_buckets:
+            self.schema -= 1
+            self.positive = _merge(self.positive)
+            self.negative = _merge(self.negative)
+
+    def get_exemplar(self, index: int) -> Optional[Exemplar]:
+        """Exemplar of classic bucket ``index``."""
+        exemplars = self.exemplars
+        return exemplars[index] if exemplars is not None else None
+
+    def set_exemplar(self, index: int, exemplar: Exemplar) -> None:
+        with self._lock:
+            if self.exemplars is None:
+                self.exemplars = [None] * len(self.classic)
+            self.exemplars[index] = exemplar
+
+    def snapshot(self) -> Tuple[int, int, Dict[int, int], Dict[int, int], int, float, List[int], List[Optional[Exemplar]]]:
+        with self._lock:
+            return (
+                self.schema, self.zero_count, dict(self.positive), dict(self.negative),
+                self.count, self.sum, list(self.classic), list(self.exemplars or [None] * len(self.classic)),
+            )
+
+
+def bucket_index(value: float, schema: int) -> int:
+    """Index of the bucket ``(base**(i-1), base**i]`` containing ``value > 0``."""
+    mantissa, exponent = math.frexp(value)  # value = mantissa * 2**exponent, 0.5 <= mantissa < 1
+    if schema <= 0:
+        # Exact powers of two belong to the lower bucket
+        if mantissa == 0.5:
+            exponent -= 1
+        offset = 1 << -schema
+        return (exponent + offset - 1) >> -schema
+    scale = 1 << schema
+    index = math.ceil(math.log2(value) * scale)
+    # Guard against floating point error at bucket boundaries
+    if bucket_upper(index - 1, schema) >= value:
+        index -= 1
+    elif bucket_upper(index, schema) < value:
+        index += 1
+    return index
+
+
+def bucket_upper(index: int, schema: int) -> float:
+    return 2.0 ** (index * 2.0 ** -schema)
+
+
+def _merge(buckets: Dict[int, int]) -> Dict[int, int]:
+    merged: Dict[int, int] = {}
+    for index, count in buckets.items():
+        target = (index + 1) >> 1
+        merged[target] = merged.get(target, 0) + count
+    return merged
+
+
+def _spans(buckets: Dict[int, int]) -> Tuple[List[BucketSpan], List[int]]:
+    spans: List[BucketSpan] = []
+    deltas: List[int] = []
+    previous_index: Optional[int] = None
+    previous_count = 0
+    for index in sorted(buckets):
+        count = buckets[index]
+        if previous_index is not None and index == previous_index + 1:
+            spans[-1] = BucketSpan(spans[-1].offset, spans[-1].length + 1)
+        else:
+            offset = index if previous_index is None else index - previous_index - 1
+            spans.append(BucketSpan(offset, 1))
+        deltas.append(count - previous_count)
+        previous_index, previous_count = index, count
+    return spans, deltas
+
+
+class SparseHistogram:
+    """
+    Drop-in alternative to ``prometheus_client.Histogram`` for labelled
+    latency metrics: ``labels(...).observe(v)`` and ``observe(v)`` work the
+    same way, and the metric registers on a registry like any collector.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        documentation: str,
+        labelnames: Sequence[str] = (),
+        registry: Any = None,
+        schema: int = DEFAULT_SCHEMA,
+        max_buckets: int = DEFAULT_MAX_BUCKETS,
+        zero_threshold: float = DEFAULT_ZERO_THRESHOLD,
+        buckets: Sequence[float] = Histogram.DEFAULT_BUCKETS,
+    ):
+        if not MIN_SCHEMA <= schema <= MAX_SCHEMA:
+            raise ValueError(f"Schema must be between {MIN_SCHEMA} and {MAX_SCHEMA}: {schema}")
+        self._name = name
+        self._documentation = documentation
+        self._labelnames = tuple(labelnames)
+        self.schema = schema
+        self.max_buckets = max_buckets
+        self.zero_threshold = zero_threshold
+        bounds = sorted(float(bound) for bound in buckets)
+        if not bounds or bounds[-1] != math.inf:
+            bounds.append(math.inf)
+        self.classic_bounds = bounds
+        self._children: Dict[Tuple[str, ...], SparseHistogramChild] = {}
+        self._lock = threading.Lock()
+        if not self._labelnames:
+            self._children[()] = SparseHistogramChild(self)
+        if registry is not None:
+            registry.register(self)
+
+    def labels(self, *labelvalues: Any, **labelkwargs: Any) -> SparseHistogramChild:
+        if not self._labelnames:
+            raise ValueError(f"No label names were set when constructing {self._name}")
+        if labelvalues and labelkwargs:
+            raise ValueError("Can't pass both *args and **kwargs")
+        if labelkwargs:
+            if sorted(labelkwargs) != sorted(self._labelnames):
+                raise ValueError("Incorrect label names")
+            labelvalues = tuple(str(labelkwargs[name]) for name in self._labelnames)
+        else:
+            if len(labelvalues) != len(self._labelnames):
+                raise ValueError("Incorrect label count")
+            labelvalues = tuple(str(value) for value in labelvalues)
+        child = self._children.get(labelvalues)
+        if child is None:
+            with self._lock:
+                child = self._children.get(labelvalues)
+                if child is None:
+                    child = self._children[labelvalues] = SparseHistogramChild(self)
+        return child
+
+    def observe(self, value: float) -> None:
+        if self._labelnames:
+            raise ValueError(f"{self._name} is labelled; use labels(...).observe()")
+        self._children[()].observe(value)
+
+    def remove(self, *labelvalues: Any) -> None:
+        with self._lock:
+            self._children.pop(tuple(str(value) for value in labelvalues), None)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._children = {} if self._labelnames else {(): SparseHistogramChild(self)}
+
+    def describe(self) -> List[SparseHistogramMetricFamily]:
+        return [SparseHistogramMetricFamily(self._name, self._documentation, labels=self._labelnames)]
+
+    def collect(self) -> List[SparseHistogramMetricFamily]:
+        family = SparseHistogramMetricFamily(self._name, self._documentation, labels=self._labelnames)
+        for labelvalues, child in list(self._children.items()):
+            labels = dict(zip(self._labelnames, labelvalues))
+            schema, zero_count, positive, negative, count, total, classic, exemplars = child.snapshot()
+
+            # Classic exposition: cumulative counts at the fixed classic bounds
+            cumulative = 0
+            for upper, n, exemplar in zip(self.classic_bounds, classic, exemplars):
+                cumulative += n
+                family.samples.append(Sample(
+                    f"{self._name}_bucket", {**labels, "le": floatToGoString(upper)}, cumulative, None, exemplar
+                ))
+            family.samples.append(Sample(f"{self._name}_count", labels, count))
+            family.samples.append(Sample(f"{self._name}_sum", labels, total))
+
+            pos_spans, pos_deltas = _spans(positive)
+            neg_spans, neg_deltas = _spans(negative)
+            family.native_samples.append(Sample(self._name, labels, 0, None, None, NativeHistogram(
+                count_value=count,
+                sum_value=total,
+                schema=schema,
+                zero_threshold=self.zero_threshold,
+                zero_count=zero_count,
+                pos_spans=pos_spans or None,
+                neg_spans=neg_spans or None,
+                pos_deltas=pos_deltas or None,
+                neg_deltas=neg_deltas or None,
+            )))
+        return [family]
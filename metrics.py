@@ -4,189 +4,528 @@ Prometheus metrics configuration following best practices from:
 - dos_donts.md 
 - instrumentation.md
 """
+import threading
+import warnings
+from typing import Any, Dict, Optional, Tuple
+
 from prometheus_client import Counter, Gauge, Histogram, CollectorRegistry
 
+from app.core.prometheus.cardinality import get_limiter, limit_cardinality
+from app.core.prometheus.checkpoint import get_checkpointer
+from app.core.prometheus.collectors import (
+    CacheHitRatioCollector,
+    ConnectionPoolCollector,
+    DeprecatedGauge,
+    SystemMetricsCollector,
+)
+from app.core.prometheus.config import get_prometheus_config
+from app.core.prometheus.exemplars import attach_exemplar, exemplars_enabled
+from app.core.prometheus.histograms import SparseHistogram
+from app.core.prometheus.sketches import QuantileSketch
+from app.core.prometheus.multiprocess import (
+    configure_multiprocess,
+    create_multiprocess_collector,
+    is_multiprocess_enabled,
+)
+from app.core.prometheus.recorder import BufferedRecorder, DirectRecorder
+
 # Singleton registry and metric instances
 _metric_registry = None
+# In multiprocess mode metrics register here (for name checks only) and the
+# scraped registry merges every worker's mmap files instead
+_process_registry = None
 _request_count = None
 _request_latency = None
 _celery_task_count = None
 _celery_task_latency = None
+_celery_task_sketch = None
+_celery_queue_wait = None
+_celery_prefetched = None
 _celery_cache_hits = None
 _celery_cache_misses = None
 _celery_cache_sets = None
 _celery_cache_deletes = None
-_system_cpu_usage = None
+
+# Pull-based collectors computed at scrape time
+_system_metrics = None
+_connection_pools = None
+
+# Collector scheduler self-metrics
+_collector_duration = None
+_collector_failures = None
+_collector_skipped = None
+
+# Cardinality guard self-metric
+_cardinality_dropped = None
+
+# Scrape serving self-metrics
+_scrape_duration = None
+_scrape_rejected = None
+
+# Push delivery self-metrics
+_push_requests = None
+_push_dropped = None
 
 # DB metrics
 _db_count = None
 _db_latency = None
+_db_sketch = None
+_db_pool_wait = None
 _connection_metrics = None
 
 # Event metrics
 _event_count = None
 _event_latency = None
 
+# Hooks run at the start of every registry collect (e.g. buffer flushes)
+_pre_collect_hooks = None
+_recorder = None
+
+# Bound (pre-resolved) children per metric instance
+_bound_metrics: Dict[Any, "BoundMetric"] = {}
+_bound_metrics_lock = threading.Lock()
+
+class _PreCollectHooks:
+    """
+    Collector registered first on the registry so its hooks run before any
+    other collector is read during a scrape. Exports no metrics itself.
+    """
+
+    def __init__(self):
+        self.hooks = []
+
+    def describe(self):
+        return []
+
+    def collect(self):
+        for hook in list(self.hooks):
+            hook()
+        return []
+
 def get_metric_registry():
-    global _metric_registry
+    global _metric_registry, _pre_collect_hooks
     if _metric_registry is None:
-        _metric_registry = CollectorRegistry()
+        if is_multiprocess_enabled():
+            configure_multiprocess()
+        registry = CollectorRegistry()
+        _pre_collect_hooks = _PreCollectHooks()
+        registry.register(_pre_collect_hooks)
+        if is_multiprocess_enabled():
+            create_multiprocess_collector(registry)
+        else:
+            # Saved to PROMETHEUS_CHECKPOINT_FILE; the factories below restore from it
+            checkpointer = get_checkpointer()
+            if checkpointer is not None:
+                checkpointer.attach(registry)
+        _metric_registry = registry
     return _metric_registry
 
+def _instrument_registry():
+    """Registry the metric getters below register their metrics on."""
+    global _process_registry
+    registry = get_metric_registry()
+    if not is_multiprocess_enabled():
+        return registry
+    if _process_registry is None:
+        _process_registry = CollectorRegistry()
+    return _process_registry
+
+def _restored(metric):
+    """``metric``, continued from PROMETHEUS_CHECKPOINT_FILE when checkpoints are enabled."""
+    if not is_multiprocess_enabled():
+        checkpointer = get_checkpointer()
+        if checkpointer is not None:
+            checkpointer.restore(metric)
+    return metric
+
+def _counter(name, documentation, labelnames=()):
+    return _restored(Counter(name, documentation, labelnames, registry=_instrument_registry()))
+
+def _histogram(name, documentation, labelnames=(), buckets=Histogram.DEFAULT_BUCKETS):
+    """
+    Classic Histogram, or a SparseHistogram (exponential buckets, allocated
+    on first use, plus ``buckets`` for classic scrapes) when ``name`` is
+    listed in PROMETHEUS_SPARSE_HISTOGRAMS.
+    Multiprocess mode always uses classic histograms, which are mmap-backed.
+    """
+    config = get_prometheus_config()
+    if name in config.SPARSE_HISTOGRAMS and not is_multiprocess_enabled():
+        return SparseHistogram(
+            name,
+            documentation,
+            labelnames,
+            registry=_instrument_registry(),
+            schema=config.SPARSE_HISTOGRAM_SCHEMA,
+            max_buckets=config.SPARSE_HISTOGRAM_MAX_BUCKETS,
+            buckets=buckets,
+        )
+    return _restored(Histogram(name, documentation, labelnames, registry=_instrument_registry(), buckets=buckets))
+
+def _sketch(name, documentation, labelnames=()):
+    """
+    QuantileSketch exported as a summary. In multiprocess mode it is only
+    readable in-process (it registers on the unscraped process registry).
+    """
+    config = get_prometheus_config()
+    return QuantileSketch(
+        name,
+        documentation,
+        labelnames,
+        registry=_instrument_registry(),
+        quantiles=config.SKETCH_QUANTILES,
+        relative_accuracy=config.SKETCH_RELATIVE_ACCURACY,
+        max_bins=config.SKETCH_MAX_BINS
+    )
+
+def add_pre_collect_hook(hook):
+    """Run ``hook()`` at the start of every collect on the metric registry."""
+    get_metric_registry()
+    if hook not in _pre_collect_hooks.hooks:
+        _pre_collect_hooks.hooks.append(hook)
+
+def get_recorder():
+    """
+    Get the recorder used by hot-path instrumentation.
+    Returns a BufferedRecorder (flushed on scrape and every
+    PROMETHEUS_BUFFER_FLUSH_INTERVAL_MS) when PROMETHEUS_BUFFERED_RECORDING
+    is enabled, otherwise a DirectRecorder.
+    """
+    global _recorder
+    if _recorder is None:
+        config = get_prometheus_config()
+        if config.BUFFERED_RECORDING:
+            recorder = BufferedRecorder(flush_interval=config.BUFFER_FLUSH_INTERVAL_MS / 1000)
+            add_pre_collect_hook(recorder.flush)
+            recorder.start()
+        else:
+            recorder = DirectRecorder()
+        _recorder = recorder
+    return _recorder
+
 def get_request_count():
     global _request_count
     if _request_count is None:
-        _request_count = Counter(
+        _request_count = limit_cardinality(_counter(
             'http_requests_total',
             'Total HTTP Requests',
-            ['method', 'endpoint', 'status'],
-            registry=get_metric_registry()
-        )
+            ['method', 'endpoint', 'status']
+        ))
     return _request_count
 
 def get_request_latency():
     global _request_latency
     if _request_latency is None:
-        _request_latency = Histogram(
+        _request_latency = limit_cardinality(_histogram(
             'http_request_duration_seconds',
             'HTTP request latency',
-            ['method', 'endpoint', 'status'],
-            registry=get_metric_registry()
-        )
+            ['method', 'endpoint', 'status']
+        ))
     return _request_latency
 
 def get_celery_task_count():
     global _celery_task_count
     if _celery_task_count is None:
-        _celery_task_count = Counter(
+        _celery_task_count = limit_cardinality(_counter(
             'celery_tasks_total',
             'Total Celery tasks executed',
-            ['task_name', 'status'],
-            registry=get_metric_registry()
-        )
+            ['task_name', 'status']
+        ))
     return _celery_task_count
 
 def get_celery_task_latency():
     global _celery_task_latency
     if _celery_task_latency is None:
-        _celery_task_latency = Histogram(
+        _celery_task_latency = limit_cardinality(_histogram(
             'celery_task_duration_seconds',
             'Celery task execution time',
-            ['task_name'],
-            registry=get_metric_registry()
-        )
+            ['task_name']
+        ))
     return _celery_task_latency
 
+def get_celery_task_sketch():
+    """Get the in-process quantile sketch of Celery task durations"""
+    global _celery_task_sketch
+    if _celery_task_sketch is None:
+        _celery_task_sketch = limit_cardinality(_sketch(
+            'celery_task_duration_summary_seconds',
+            'Celery task execution time quantiles (DDSketch)',
+            ['task_name']
+        ))
+    return _celery_task_sketch
+
+def get_celery_queue_wait():
+    """Get the histogram of time Celery tasks spent queued (publish to start)"""
+    global _celery_queue_wait
+    if _celery_queue_wait is None:
+        _celery_queue_wait = limit_cardinality(_histogram(
+            'celery_task_queue_wait_seconds',
+            'Time between publishing a Celery task and a worker starting it',
+            ['task_name']
+        ))
+    return _celery_queue_wait
+
+def get_celery_prefetched():
+    global _celery_prefetched
+    if _celery_prefetched is None:
+        _celery_prefetched = Gauge(
+            'celery_worker_prefetched_tasks',
+            'Tasks reserved (prefetched) by this worker but not yet started',
+            multiprocess_mode='livesum',
+            registry=_instrument_registry()
+        )
+    return _celery_prefetched
+
 def get_celery_cache_hits():
     global _celery_cache_hits
     if _celery_cache_hits is None:
-        _celery_cache_hits = Counter(
+        _celery_cache_hits = limit_cardinality(_counter(
             'celery_cache_hits_total',
             'Number of cache hits inside Celery tasks',
-            ['task_name'],
-            registry=get_metric_registry()
-        )
+            ['task_name']
+        ))
     return _celery_cache_hits
 
 def get_celery_cache_misses():
     global _celery_cache_misses
     if _celery_cache_misses is None:
-        _celery_cache_misses = Counter(
+        _celery_cache_misses = limit_cardinality(_counter(
             'celery_cache_misses_total',
             'Number of cache misses inside Celery tasks',
-            ['task_name'],
-            registry=get_metric_registry()
-        )
+            ['task_name']
+        ))
     return _celery_cache_misses
 
 def get_celery_cache_sets():
     global _celery_cache_sets
     if _celery_cache_sets is None:
-        _celery_cache_sets = Counter(
+        _celery_cache_sets = limit_cardinality(_counter(
             'celery_cache_sets_total',
             'Number of cache set operations inside Celery tasks',
-            ['task_name'],
-            registry=get_metric_registry()
-        )
+            ['task_name']
+        ))
     return _celery_cache_sets
 
 def get_celery_cache_deletes():
     global _celery_cache_deletes
     if _celery_cache_deletes is None:
-        _celery_cache_deletes = Counter(
+        _celery_cache_deletes = limit_cardinality(_counter(
             'celery_cache_deletes_total',
             'Number of cache delete operations inside Celery tasks',
-            ['task_name'],
-            registry=get_metric_registry()
-        )
+            ['task_name']
+        ))
     return _celery_cache_deletes
 
+def get_system_metrics():
+    """Get the scrape-time collector for system and process stats"""
+    global _system_metrics
+    if _system_metrics is None:
+        _system_metrics = SystemMetricsCollector()
+        get_metric_registry().register(_system_metrics)
+    return _system_metrics
+
+def _computed_on_scrape(getter, name):
+    warnings.warn(
+        f"{getter}() is deprecated: {name} is computed on scrape by get_system_metrics(); "
+        "values set through it are ignored",
+        DeprecationWarning,
+        stacklevel=3,
+    )
+    get_system_metrics()
+    return DeprecatedGauge(name)
+
+# Deprecated: these gauges are now computed on scrape by get_system_metrics()
 def get_system_cpu_usage():
-    global _system_cpu_usage
-    if _system_cpu_usage is None:
-        _system_cpu_usage = Gauge(
-            'system_cpu_usage_percent',
-            'System CPU usage percentage',
-            registry=get_metric_registry()
+    return _computed_on_scrape('get_system_cpu_usage', 'system_cpu_usage_percent')
+
+def get_system_memory_usage():
+    return _computed_on_scrape('get_system_memory_usage', 'system_memory_used_percent')
+
+def get_system_memory_available():
+    return _computed_on_scrape('get_system_memory_available', 'system_memory_available_bytes')
+
+def get_system_disk_usage():
+    return _computed_on_scrape('get_system_disk_usage', 'system_disk_used_percent')
+
+def get_process_memory_rss():
+    return _computed_on_scrape('get_process_memory_rss', 'process_memory_rss_bytes')
+
+def get_process_open_fds():
+    return _computed_on_scrape('get_process_open_fds', 'process_open_file_descriptors')
+
+def get_process_threads():
+    return _computed_on_scrape('get_process_threads', 'process_threads')
+
+# Collector scheduler self-metrics
+def get_collector_duration():
+    global _collector_duration
+    if _collector_duration is None:
+        _collector_duration = limit_cardinality(Gauge(
+            'metrics_collector_duration_seconds',
+            'Duration of the last run of each metrics collector source',
+            ['source'],
+            multiprocess_mode='liveall',
+            registry=_instrument_registry()
+        ))
+    return _collector_duration
+
+def get_collector_failures():
+    global _collector_failures
+    if _collector_failures is None:
+        _collector_failures = limit_cardinality(_counter(
+            'metrics_collector_failures_total',
+            'Metrics collector runs that raised or timed out',
+            ['source']
+        ))
+    return _collector_failures
+
+def get_collector_skipped():
+    global _collector_skipped
+    if _collector_skipped is None:
+        _collector_skipped = limit_cardinality(_counter(
+            'metrics_collector_skipped_total',
+            'Metrics collector ticks skipped because the previous run was still going',
+            ['source']
+        ))
+    return _collector_skipped
+
+# Cardinality guard self-metric (never limited itself)
+def get_cardinality_dropped():
+    global _cardinality_dropped
+    if _cardinality_dropped is None:
+        _cardinality_dropped = _counter(
+            'metrics_cardinality_dropped_total',
+            'Label sets recorded into the __overflow__ series because the metric hit its series budget',
+            ['metric']
         )
-    return _system_cpu_usage
+    return _cardinality_dropped
+
+# Scrape serving self-metrics
+def get_scrape_duration():
+    global _scrape_duration
+    if _scrape_duration is None:
+        _scrape_duration = limit_cardinality(_histogram(
+            'metrics_scrape_duration_seconds',
+            'Time spent serving a metrics scrape',
+            ['server'],
+            buckets=(0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+        ))
+    return _scrape_duration
+
+def get_scrape_rejected():
+    global _scrape_rejected
+    if _scrape_rejected is None:
+        _scrape_rejected = limit_cardinality(_counter(
+            'metrics_scrape_rejected_total',
+            'Metrics scrapes rejected because the concurrency limit was reached',
+            ['server']
+        ))
+    return _scrape_rejected
+
+def get_push_requests():
+    global _push_requests
+    if _push_requests is None:
+        _push_requests = limit_cardinality(_counter(
+            'metrics_push_requests_total',
+            'Metric push requests by delivery mode and result',
+            ['mode', 'result']
+        ))
+    return _push_requests
+
+def get_push_dropped():
+    global _push_dropped
+    if _push_dropped is None:
+        _push_dropped = limit_cardinality(_counter(
+            'metrics_push_dropped_total',
+            'Registry deltas dropped before delivery (queue full or rejected)',
+            ['mode', 'reason']
+        ))
+    return _push_dropped
 
 # Database metrics
 def get_db_count():
     global _db_count
     if _db_count is None:
-        _db_count = Counter(
+        _db_count = limit_cardinality(_counter(
             'db_operations_total',
             'Database operations (queries, commits, rollbacks)',
-            ['operation'],
-            registry=get_metric_registry()
-        )
+            ['operation']
+        ))
     return _db_count
 
 def get_db_latency():
     global _db_latency
     if _db_latency is None:
-        _db_latency = Histogram(
+        _db_latency = limit_cardinality(_histogram(
             'db_operation_duration_seconds',
             'Database operation latency in seconds',
-            registry=get_metric_registry(),
+            ['operation'],
             buckets=(0.001, 0.005, 0.01, 0.025, 0.05, 0.075, 0.1, 0.25, 0.5, 0.75, 1.0, 2.5, 5.0, 7.5, 10.0)
-        )
+        ))
     return _db_latency
 
+def get_db_sketch():
+    """Get the in-process quantile sketch of database operation latency"""
+    global _db_sketch
+    if _db_sketch is None:
+        _db_sketch = limit_cardinality(_sketch(
+            'db_operation_duration_summary_seconds',
+            'Database operation latency quantiles in seconds (DDSketch)',
+            ['operation']
+        ))
+    return _db_sketch
+
+def get_db_pool_wait():
+    """Get the histogram of time spent waiting to check a connection out of the pool"""
+    global _db_pool_wait
+    if _db_pool_wait is None:
+        _db_pool_wait = limit_cardinality(_histogram(
+            'db_pool_checkout_wait_seconds',
+            'Time spent checking a connection out of the pool in seconds',
+            ['db_type'],
+            buckets=(0.0001, 0.0005, 0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+        ))
+    return _db_pool_wait
+
 def get_connection_metrics():
     global _connection_metrics
     if _connection_metrics is None:
-        _connection_metrics = Gauge(
+        _connection_metrics = limit_cardinality(Gauge(
             'db_connections',
             'Database connection metrics',
             ['db_type', 'state'],
-            registry=get_metric_registry()
-        )
+            multiprocess_mode='livesum',
+            registry=_instrument_registry()
+        ))
     return _connection_metrics
 
+def get_connection_pools():
+    """Get the scrape-time collector for db_pool_connections{db_type, state}"""
+    global _connection_pools
+    if _connection_pools is None:
+        _connection_pools = ConnectionPoolCollector()
+        get_metric_registry().register(_connection_pools)
+    return _connection_pools
+
 # Event metrics
 def get_event_count():
     global _event_count
     if _event_count is None:
-        _event_count = Counter(
+        _event_count = limit_cardinality(_counter(
             'events_total',
             'Total events published or consumed',
-            ['topic', 'result'],
-            registry=get_metric_registry()
-        )
+            ['topic', 'operation', 'result']
+        ))
     return _event_count
 
 def get_event_latency():
     global _event_latency
     if _event_latency is None:
-        _event_latency = Histogram(
+        _event_latency = limit_cardinality(_histogram(
             'event_operation_duration_seconds',
-            'Event operation latency in seconds',
-            ['topic'],
-            registry=get_metric_registry(),
+            'Event latency in seconds (publish: send until acknowledged, consume: publish to receive)',
+            ['topic', 'operation'],
             buckets=(0.001, 0.005, 0.01, 0.025, 0.05, 0.075, 0.1, 0.25, 0.5, 0.75, 1.0, 2.5, 5.0)
-        )
+        ))
     return _event_latency
 
 # todo: Refactor remaining metrics below to use the same singleton getter pattern.
@@ -200,40 +539,36 @@ _pulsar_cache_deletes = None
 def get_pulsar_cache_hits():
     global _pulsar_cache_hits
     if _pulsar_cache_hits is None:
-        _pulsar_cache_hits = Counter(
+        _pulsar_cache_hits = _counter(
             'pulsar_cache_hits_total',
-            'Number of cache hits for Pulsar operations',
-            registry=get_metric_registry()
+            'Number of cache hits for Pulsar operations'
         )
     return _pulsar_cache_hits
 
 def get_pulsar_cache_misses():
     global _pulsar_cache_misses
     if _pulsar_cache_misses is None:
-        _pulsar_cache_misses = Counter(
+        _pulsar_cache_misses = _counter(
             'pulsar_cache_misses_total',
-            'Number of cache misses for Pulsar operations',
-            registry=get_metric_registry()
+            'Number of cache misses for Pulsar operations'
         )
     return _pulsar_cache_misses
 
 def get_pulsar_cache_sets():
     global _pulsar_cache_sets
     if _pulsar_cache_sets is None:
-        _pulsar_cache_sets = Counter(
+        _pulsar_cache_sets = _counter(
             'pulsar_cache_sets_total',
-            'Number of cache sets for Pulsar operations',
-            registry=get_metric_registry()
+            'Number of cache sets for Pulsar operations'
         )
     return _pulsar_cache_sets
 
 def get_pulsar_cache_deletes():
     global _pulsar_cache_deletes
     if _pulsar_cache_deletes is None:
-        _pulsar_cache_deletes = Counter(
+        _pulsar_cache_deletes = _counter(
             'pulsar_cache_deletes_total',
-            'Number of cache deletes for Pulsar operations',
-            registry=get_metric_registry()
+            'Number of cache deletes for Pulsar operations'
         )
     return _pulsar_cache_deletes
 
@@ -245,23 +580,21 @@ _cache_latency = None
 def get_cache_count():
     global _cache_count
     if _cache_count is None:
-        _cache_count = Counter(
+        _cache_count = limit_cardinality(_counter(
             'cache_operations_total',
             'Cache operations (hit/miss/set/delete) for Redis/Valkey',
-            ['cache_type', 'operation'],
-            registry=get_metric_registry()
-        )
+            ['cache_type', 'operation']
+        ))
     return _cache_count
 
 def get_cache_latency():
     global _cache_latency
     if _cache_latency is None:
-        _cache_latency = Histogram(
+        _cache_latency = limit_cardinality(_histogram(
             'cache_operation_duration_seconds',
             'Cache operation latency in seconds for Redis/Valkey',
-            ['cache_type', 'operation'],
-            registry=get_metric_registry()
-        )
+            ['cache_type', 'operation']
+        ))
     return _cache_latency
 
 # Deprecated: Moved to app.core.pulsar.metrics
@@ -273,24 +606,132 @@ def get_cache_latency():
 _cache_hit_ratio = None
 
 def get_cache_hit_ratio():
-    """Get cache hit ratio gauge (hits / (hits + misses))"""
+    """Get the scrape-time collector for cache hit ratio (hits / (hits + misses))"""
     global _cache_hit_ratio
     if _cache_hit_ratio is None:
-        _cache_hit_ratio = Gauge(
-            'cache_hit_ratio',
-            'Cache hit ratio (hits / (hits + misses)) for Redis/Valkey',
-            ['cache_type'],
-            registry=get_metric_registry()
-        )
+        _cache_hit_ratio = CacheHitRatioCollector()
+        get_metric_registry().register(_cache_hit_ratio)
     return _cache_hit_ratio
 
+class BoundMetric:
+    """
+    Pre-resolved labelled children for a metric.
+
+    ``child(*labelvalues)`` returns the same object ``metric.labels(...)``
+    would, but cached in a dict keyed by the label-value tuple, so repeat
+    lookups skip label validation, string conversion and the metric lock.
+    With ``lock_free`` (the default) cache hits are a plain dict read; only
+    a miss takes the lock to create the child.
+
+    Call ``clear()`` after ``metric.remove()``/``metric.clear()`` so removed
+    children are not handed out again.
+
+    Label values redirected to the ``__overflow__`` series by the
+    cardinality guard are not cached, so the cache stays within the
+    metric's series budget.
+    """
+
+    __slots__ = ("metric", "lock_free", "_children", "_lock", "_limiter")
+
+    def __init__(self, metric: Any, lock_free: bool = True) -> None:
+        self.metric = metric
+        self.lock_free = lock_free
+        self._children: Dict[Tuple[Any, ...], Any] = {}
+        self._lock = threading.Lock()
+        self._limiter = get_limiter(metric)
+
+    def child(self, *labelvalues: Any) -> Any:
+        if self.lock_free:
+            child = self._children.get(labelvalues)
+            if child is not None:
+                return child
+        with self._lock:
+            child = self._children.get(labelvalues)
+            if child is None:
+                child = self.metric.labels(*labelvalues)
+                if self._limiter is None or self._limiter.admitted(labelvalues):
+                    self._children[labelvalues] = child
+            return child
+
+    def clear(self) -> None:
+        with self._lock:
+            self._children = {}
+
+
+def bind(metric: Any, lock_free: bool = True) -> BoundMetric:
+    """Return the shared BoundMetric for a labelled metric."""
+    bound = _bound_metrics.get(metric)
+    if bound is None:
+        with _bound_metrics_lock:
+            bound = _bound_metrics.get(metric)
+            if bound is None:
+                bound = _bound_metrics[metric] = BoundMetric(metric, lock_free=lock_free)
+    return bound
+
+# Recording helpers for hot paths (use pre-bound children)
+_celery_cache_getters = {
+    'hit': get_celery_cache_hits,
+    'miss': get_celery_cache_misses,
+    'set': get_celery_cache_sets,
+    'delete': get_celery_cache_deletes,
+}
+
+def record_celery_task(task_name: str, status: str, duration: Optional[float] = None) -> None:
+    """Count a finished Celery task and observe its duration if given."""
+    recorder = get_recorder()
+    recorder.inc(bind(get_celery_task_count()).child(task_name, status))
+    if duration is not None:
+        recorder.observe(bind(get_celery_task_latency()).child(task_name), duration)
+        bind(get_celery_task_sketch()).child(task_name).observe(duration)
+
+def record_celery_cache(task_name: str, operation: str) -> None:
+    """Count a cache hit/miss/set/delete made inside a Celery task."""
+    get_recorder().inc(bind(_celery_cache_getters[operation]()).child(task_name))
+
+def record_cache_operation(cache_type: str, operation: str, duration: Optional[float] = None) -> None:
+    """Count a Redis/Valkey cache operation and observe its latency if given."""
+    recorder = get_recorder()
+    recorder.inc(bind(get_cache_count()).child(cache_type, operation))
+    if duration is not None:
+        latency = bind(get_cache_latency()).child(cache_type, operation)
+        recorder.observe(latency, duration)
+        if exemplars_enabled():
+            attach_exemplar(latency, duration)
+
+def record_db_operation(operation: str, duration: Optional[float] = None) -> None:
+    """Count a database operation and observe its latency if given."""
+    recorder = get_recorder()
+    recorder.inc(bind(get_db_count()).child(operation))
+    if duration is not None:
+        latency = bind(get_db_latency()).child(operation)
+        recorder.observe(latency, duration)
+        if exemplars_enabled():
+            attach_exemplar(latency, duration)
+        bind(get_db_sketch()).child(operation).observe(duration)
+
+def record_event(topic: str, result: str, duration: Optional[float] = None, operation: str = 'publish') -> None:
+    """Count a published/consumed event and observe its latency if given."""
+    recorder = get_recorder()
+    recorder.inc(bind(get_event_count()).child(topic, operation, result))
+    if duration is not None:
+        latency = bind(get_event_latency()).child(topic, operation)
+        recorder.observe(latency, duration)
+        if exemplars_enabled():
+            attach_exemplar(latency, duration)
+
 # Grafana queries (examples):
 # API performance: rate(http_requests_total[5m]) by (method, endpoint, status)
 # API latency: histogram_quantile(0.95, sum(rate(http_request_duration_seconds_bucket[5m])) by (le, method, endpoint, status))
+# API latency, precomputed by the exporter (PROMETHEUS_RECORDING_RULES_ENABLED): endpoint:http_request_duration_seconds:p95_rate5m
 # Cache hit/miss: sum(rate(cache_operations_total{operation=~"hit|miss"}[5m])) by (cache_type, operation)
 # Pulsar consumer lag: max(pulsar_consumer_lag_seconds) by (topic, subscription)
 # Pulsar producer: rate(pulsar_messages_sent[5m]) by (topic)
 # Pulsar consumer: rate(pulsar_messages_received[5m]) by (topic)
-# DB latency: histogram_quantile(0.95, sum(rate(db_operation_duration_seconds_bucket[5m])) by (le))
+# DB latency: histogram_quantile(0.95, sum(rate(db_operation_duration_seconds_bucket[5m])) by (le, operation))
+# DB pool wait: histogram_quantile(0.95, sum(rate(db_pool_checkout_wait_seconds_bucket[5m])) by (le, db_type))
+# Sparse histograms: same _bucket queries (fixed classic buckets kept alongside); with native ingestion use histogram_quantile(0.95, sum(rate(http_request_duration_seconds[5m])))
 # DB connections: sum(db_connections) by (db_type, state)
-# Event publish: rate(events_total{result="success"}[5m]) by (topic)
+# DB pools: db_pool_connections{state="checked_out"} / db_pool_connections{state="size"}
+# Event publish: sum by (topic) (rate(events_total{operation="publish",result="success"}[5m]))
+# Event end-to-end latency: histogram_quantile(0.95, sum(rate(event_operation_duration_seconds_bucket{operation="consume"}[5m])) by (le, topic))
+# Pulsar backlog: max(pulsar_consumer_backlog) by (topic, subscription)
@@ -2,124 +2,116 @@
 Module for initializing and collecting system and application metrics.
 This ensures there are always metrics available even with no traffic.
 
-Collects:
+Computed at scrape time by collectors on the metric registry:
 - System metrics (CPU, memory, disk)
-- Valkey/Redis metrics (hit/miss rates, memory usage)
-- Pulsar metrics (consumer/producer lag, health)
+- Process metrics (RSS, open file descriptors, threads)
+- Valkey/Redis hit ratio
+
+Collected periodically by the collector scheduler:
+- Pulsar backlog and lag per subscription (admin API), health
+- Recording rule snapshots (when PROMETHEUS_RECORDING_RULES_ENABLED)
+- Counter checkpoints (when PROMETHEUS_CHECKPOINT_FILE is set)
 """
 import os
-import psutil
-import time
-import threading
 import asyncio
-from typing import Dict, Any
+from typing import Optional
 
+from app.core.prometheus.checkpoint import get_checkpointer
+from app.core.prometheus.config import get_prometheus_config
+from app.core.prometheus.scheduler import CollectorScheduler
 from app.core.prometheus.metrics import (
-    get_system_cpu_usage,
-    get_metric_registry,
-    get_cache_hit_ratio
+    get_cache_hit_ratio,
+    get_system_metrics,
 )
+from app.core.prometheus.pulsar_instrumentation import get_pulsar_backlog
+from app.core.prometheus.recording_rules import get_recording_rules
 
 # Constants
 METRICS_COLLECTION_INTERVAL = 15  # seconds
+METRICS_COLLECTION_TIMEOUT = 10  # seconds per application source run
+METRICS_COLLECTION_JITTER = 1  # seconds of random delay spread over each tick
 
 
-def collect_system_metrics() -> Dict[str, Any]:
-    """Collect system metrics like CPU, memory, disk usage."""
-    metrics = {}
-    
-    # Collect CPU metrics
-    metrics["cpu_percent"] = psutil.cpu_percent(interval=1)
-    
-    # Collect memory metrics
-    mem = psutil.virtual_memory()
-    metrics["mem_used_percent"] = mem.percent
-    metrics["mem_available_gb"] = mem.available / (1024 * 1024 * 1024)
-    
-    # Collect disk metrics
-    disk = psutil.disk_usage('/')
-    metrics["disk_used_percent"] = disk.percent
-    
-    return metrics
-
-
-def update_system_metrics():
-    """Update Prometheus metrics with current system metrics."""
-    metrics = collect_system_metrics()
-    
-    # Update CPU usage gauge
-    get_system_cpu_usage().set(metrics["cpu_percent"])
+def register_default_collectors() -> None:
+    """Register the scrape-time collectors for system stats, cache hit ratio, Pulsar backlog and recording rules."""
+    get_system_metrics()
+    get_cache_hit_ratio()
+    get_pulsar_backlog()
+    if get_prometheus_config().RECORDING_RULES_ENABLED:
+        get_recording_rules()
 
 
 def update_pulsar_metrics():
-    """Update Pulsar metrics by fetching from the client/server."""
+    """Poll Pulsar backlog/lag from the admin API (when configured) and report health."""
+    backlog = get_pulsar_backlog()
+    healthy = backlog.poll() if backlog is not None else True
     try:
         # Import here to avoid circular import issues
         from app.core.pulsar.metrics import PULSAR_HEALTH
-        
-        # Just set health status based on import success
-        PULSAR_HEALTH.set(1)  # 1 = healthy
 
-        # TODO: In a production environment, you would want to query
-        # the Pulsar admin API to get actual backlog and other stats
-        # This would require admin credentials and permissions
+        PULSAR_HEALTH.set(1 if healthy else 0)  # 1 = healthy
     except Exception as e:
         print(f"Error updating Pulsar metrics: {e}")
 
-def update_valkey_metrics():
-    """Update Valkey/Redis metrics from existing counters."""
-    try:
-        # Import Valkey connection and safe metric utilities
-        from app.core.valkey_init import get_valkey
-        from app.core.prometheus.metrics import get_cache_count, get_cache_hit_ratio
-        from app.core.prometheus.utils import safe_get_counter_value
-        
-        # Get hit and miss counts safely
-        hits = safe_get_counter_value(
-            get_cache_count(), 
-            labels={"cache_type": "valkey", "operation": "hit"}
+def build_collector_scheduler() -> CollectorScheduler:
+    """Register every periodic application source on a new scheduler."""
+    scheduler = CollectorScheduler()
+    config = get_prometheus_config()
+    scheduler.register(
+        "pulsar",
+        update_pulsar_metrics,
+        interval=config.PULSAR_ADMIN_INTERVAL,
+        timeout=METRICS_COLLECTION_TIMEOUT,
+        jitter=METRICS_COLLECTION_JITTER,
+    )
+    if config.RECORDING_RULES_ENABLED:
+        scheduler.register(
+            "recording_rules",
+            lambda: get_recording_rules().sample(),
+            interval=config.RECORDING_RULES_INTERVAL,
+            timeout=METRICS_COLLECTION_TIMEOUT,
         )
-        misses = safe_get_counter_value(
-            get_cache_count(), 
-            labels={"cache_type": "valkey", "operation": "miss"}
+    checkpointer = get_checkpointer()
+    if checkpointer is not None and checkpointer.registry is not None:
+        scheduler.register(
+            "checkpoint",
+            checkpointer.save,
+            interval=config.CHECKPOINT_INTERVAL,
+            timeout=METRICS_COLLECTION_TIMEOUT,
         )
-        
-        # Calculate and update hit ratio
-        if hits + misses > 0:
-            ratio = hits / (hits + misses)
-            get_cache_hit_ratio().labels('valkey').set(ratio)
-        else:
-            # Set a default ratio when no data is available yet
-            get_cache_hit_ratio().labels('valkey').set(1.0)
-    except Exception as e:
-        print(f"Error updating Valkey metrics: {e}")
+    return scheduler
+
+
+_collector_scheduler: Optional[CollectorScheduler] = None
+
+def get_collector_scheduler() -> CollectorScheduler:
+    global _collector_scheduler
+    if _collector_scheduler is None:
+        _collector_scheduler = build_collector_scheduler()
+    return _collector_scheduler
+
 
 def metrics_collector_thread():
-    """Background thread function for collecting metrics periodically."""
-    while True:
-        try:
-            # System metrics (always update)
-            update_system_metrics()
-            
-            # Update application-specific metrics
-            update_pulsar_metrics() 
-            update_valkey_metrics()
-        except Exception as e:
-            print(f"Error updating metrics: {e}")
-        
-        time.sleep(METRICS_COLLECTION_INTERVAL)
+    """Run the collector scheduler on the current thread (blocks)."""
+    asyncio.run(get_collector_scheduler().run())
 
 
 def start_metrics_collection():
     """Start the background metrics collection thread."""
+    register_default_collectors()
     # Only start collector if not running in test mode
     if os.environ.get("TESTING", "").lower() != "true":
-        collector_thread = threading.Thread(
-            target=metrics_collector_thread,
-            daemon=True,
-            name="metrics-collector"
-        )
-        collector_thread.start()
+        collector_thread = get_collector_scheduler().start_in_thread()
         print("System metrics collection started")
         return collector_thread
     return None
+
+
+def start_metrics_collection_async() -> Optional[asyncio.Task]:
+    """Start metrics collection on the running event loop (e.g. app lifespan)."""
+    register_default_collectors()
+    if os.environ.get("TESTING", "").lower() != "true":
+        task = get_collector_scheduler().start()
+        print("System metrics collection started")
+        return task
+    return None
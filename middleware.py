@@ -2,71 +2,115 @@
 Prometheus metrics middleware for FastAPI
 """
 import time
-from typing import Callable
 
-from starlette.middleware.base import BaseHTTPMiddleware
-from starlette.requests import Request
-from starlette.responses import Response
-from starlette.routing import Match
-from starlette.types import ASGIApp
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
 
 # Import the function to get config instance instead of the class directly
 from app.core.prometheus.config import get_prometheus_config
-from app.core.prometheus.metrics import get_request_count, get_request_latency
+from app.core.prometheus.exemplars import (
+    TRACEPARENT_HEADER,
+    attach_exemplar,
+    exemplars_enabled,
+    parse_traceparent,
+    reset_trace_context,
+    set_trace_context,
+)
+from app.core.prometheus.metrics import bind, get_recorder, get_request_count, get_request_latency
+from app.core.prometheus.route_resolver import RouteResolver
+from app.core.prometheus.slo import get_slo_aggregator
 
 # Get the config instance
 prometheus_config = get_prometheus_config()
+_TRACEPARENT = TRACEPARENT_HEADER.encode("latin-1")
 
-class PrometheusMiddleware(BaseHTTPMiddleware):
+class PrometheusMiddleware:
     """
     Middleware that collects Prometheus metrics for HTTP requests.
-    Extends Starlette's BaseHTTPMiddleware for better compatibility.
+    Implemented as a pure ASGI middleware: the status code is taken from the
+    ``http.response.start`` message and latency is recorded once the final
+    body chunk has been sent, so streaming responses are never buffered.
+    With PROMETHEUS_SLO_ENABLED (off by default: it costs two window
+    updates per request), finished requests also feed the in-process SLO
+    aggregator (``slo.py``).
+
+    With exemplars enabled, a W3C ``traceparent`` request header becomes the
+    trace context for the request (see ``exemplars.py``) and the latency
+    observation carries its trace_id/span_id as an exemplar.
     """
-    
-    async def dispatch(self, request: Request, call_next: Callable) -> Response:
-        if not prometheus_config.ENABLED:
-            return await call_next(request)
 
-        # Extract request information
-        method = request.method
-        endpoint = self.get_path(request)
-        
+    def __init__(self, app: ASGIApp) -> None:
+        self.app = app
+        self._resolver: RouteResolver | None = None
+        self._request_count = bind(get_request_count())
+        self._request_latency = bind(get_request_latency())
+        self._recorder = get_recorder()
+        self._slo = get_slo_aggregator() if prometheus_config.SLO_ENABLED else None
+        self._exemplars = exemplars_enabled()
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http" or not prometheus_config.ENABLED:
+            await self.app(scope, receive, send)
+            return
+
+        # Resolve the route before the router rewrites path/root_path in the scope
+        method = scope["method"]
+        endpoint = self.get_path(scope)
+
         # Record timing
-        start_time = time.time()
-        
-        # Process request and catch any errors to ensure metrics are recorded
+        start_time = time.perf_counter()
+        # If the app fails before starting a response, record it as a 500 error
+        status = 500
+        recorded = False
+        trace_token = None
+        if self._exemplars:
+            for name, value in scope["headers"]:
+                if name == _TRACEPARENT:
+                    trace_token = set_trace_context(parse_traceparent(value.decode("latin-1")))
+                    break
+
+        def record() -> None:
+            nonlocal recorded
+            recorded = True
+            elapsed = time.perf_counter() - start_time
+            self._recorder.inc(self._request_count.child(method, endpoint, status))
+            latency = self._request_latency.child(method, endpoint, status)
+            self._recorder.observe(latency, elapsed)
+            if self._exemplars:
+                attach_exemplar(latency, elapsed)
+            if self._slo is not None:
+                self._slo.observe(endpoint, status, elapsed)
+
+        async def send_wrapper(message: Message) -> None:
+            nonlocal status
+            message_type = message["type"]
+            if message_type == "http.response.start":
+                status = message["status"]
+                await send(message)
+            elif message_type == "http.response.body" and not message.get("more_body", False):
+                await send(message)
+                if not recorded:
+                    record()
+            else:
+                await send(message)
+
         try:
-            response = await call_next(request)
-            status = response.status_code
-        except Exception as exc:
-            # If there's an exception, record it as a 500 error
-            status = 500
-            raise exc
+            await self.app(scope, receive, send_wrapper)
         finally:
-            # Calculate elapsed time
-            elapsed = time.time() - start_time
-            
-            # Record metrics
-            get_request_count().labels(method, endpoint, status).inc()
-            get_request_latency().labels(method, endpoint, status).observe(elapsed)
-        
-        return response
+            # Ensure metrics are recorded even when the app raises or the
+            # client disconnects before the final body chunk
+            if not recorded:
+                record()
+            if trace_token is not None:
+                reset_trace_context(trace_token)
 
-    def get_path(self, request: Request) -> str:
+    def get_path(self, scope: Scope) -> str:
         """
         Get the path template for this request, so that we can use it as a dimension.
         For example, we want /items/{item_id} instead of /items/123 to avoid high cardinality metrics.
+        Paths that match no route are reported as ``<unmatched>``.
         """
-        # Check if there's an endpoint in the scope
-        if hasattr(request, "scope") and "endpoint" in request.scope and request.scope["endpoint"]:
-            return request.scope["route"].path
-        
-        # Otherwise, check all routes for a match
-        for route in request.app.routes:
-            match, child_scope = route.matches(request.scope)
-            if match == Match.FULL:
-                return route.path
-
-        # Default to the raw URL path if no match found
-        # This is less ideal as it could lead to high cardinality
-        return request.url.path
+        app = scope.get("app")
+        resolver = self._resolver
+        if resolver is None or resolver.app is not app:
+            resolver = self._resolver = RouteResolver(app, maxsize=prometheus_config.ROUTE_CACHE_SIZE)
+        return resolver.resolve_scope(scope)
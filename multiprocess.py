@@ -0,0 +1,166 @@
+"""
+Multiprocess mode for gunicorn/uvicorn workers.
+
+When ``PROMETHEUS_MULTIPROC_DIR`` is set, every worker writes its metric
+values to per-process memory-mapped files in that directory and the metric
+registry exposes a single MultiProcessCollector that merges all of them at
+scrape time, so any worker can answer a scrape with whole-service numbers.
+
+Lifecycle:
+- ``prepare_multiprocess_dir()`` once in the master before forking workers
+  (e.g. gunicorn ``on_starting``) to drop files left by a previous run.
+- ``mark_worker_dead(pid)`` when a worker exits. It is registered with
+  ``atexit`` in each worker and exposed as the gunicorn ``child_exit`` hook
+  for workers that are killed. It removes the worker's live gauge files and
+  folds its counter/histogram files into per-type archive files, so totals
+  are kept but the directory does not grow with every restarted worker.
+"""
+import atexit
+import glob
+import os
+from contextlib import contextmanager
+
+from prometheus_client import values
+from prometheus_client.mmap_dict import MmapedDict, mmap_key
+from prometheus_client.multiprocess import MultiProcessCollector, mark_process_dead
+
+from app.core.prometheus.config import get_prometheus_config
+
+try:
+    import fcntl
+except ImportError:  # pragma: no cover - non-POSIX platforms
+    fcntl = None
+
+# Types whose per-process files are folded into an archive on worker exit
+_ARCHIVED_TYPES = ("counter", "histogram", "summary")
+_ARCHIVE_SUFFIX = "archive"
+_LOCK_FILE = ".compaction.lock"
+
+_configured = False
+
+
+def get_multiprocess_dir() -> str | None:
+    """Directory for mmap value files, or None when multiprocess mode is off."""
+    return get_prometheus_config().MULTIPROCESS_DIR or None
+
+
+def is_multiprocess_enabled() -> bool:
+    return get_multiprocess_dir() is not None
+
+
+def configure_multiprocess() -> None:
+    """
+    Switch prometheus_client to mmap-backed values for this process.
+    Must run before the first metric is created; get_metric_registry()
+    calls it automatically when multiprocess mode is enabled.
+    """
+    global _configured
+    if _configured:
+        return
+    path = get_multiprocess_dir()
+    os.makedirs(path, exist_ok=True)
+    os.environ["PROMETHEUS_MULTIPROC_DIR"] = path
+    if not getattr(values.ValueClass, "_multiprocess", False):
+        values.ValueClass = values.MultiProcessValue()
+    atexit.register(_mark_current_process_dead)
+    _configured = True
+
+
+class _LockedMultiProcessCollector(MultiProcessCollector):
+    """
+    MultiProcessCollector that reads the files under a shared lock, so a
+    scrape never sees a worker's values both in its own file and in the
+    archive it is being folded into.
+    """
+
+    def collect(self):
+        with _compaction_lock(self._path, shared=True):
+            files = glob.glob(os.path.join(self._path, "*.db"))
+            return list(self.merge(files, accumulate=True))
+
+
+def create_multiprocess_collector(registry) -> MultiProcessCollector:
+    """Register the collector that merges every worker's files on scrape."""
+    return _LockedMultiProcessCollector(registry, path=get_multiprocess_dir())
+
+
+def prepare_multiprocess_dir(path: str | None = None) -> None:
+    """Remove value files left over from a previous run of the service."""
+    path = path or get_multiprocess_dir()
+    if not path:
+        return
+    os.makedirs(path, exist_ok=True)
+    for f in glob.glob(os.path.join(path, "*.db")):
+        os.remove(f)
+
+
+def mark_worker_dead(pid: int, path: str | None = None) -> None:
+    """Clean up after a worker process that has exited."""
+    path = path or get_multiprocess_dir()
+    if not path:
+        return
+    # Live gauges of a dead worker must disappear from the merged output
+    mark_process_dead(pid, path)
+    with _compaction_lock(path):
+        for typ in _ARCHIVED_TYPES:
+            _archive_process_files(path, typ, pid)
+
+
+def child_exit(server, worker) -> None:
+    """gunicorn ``child_exit`` server hook."""
+    mark_worker_dead(worker.pid)
+
+
+def _mark_current_process_dead() -> None:
+    try:
+        mark_worker_dead(os.getpid())
+    except Exception as e:
+        print(f"Error cleaning up multiprocess metrics: {e}")
+
+
+def _archive_process_files(path: str, typ: str, pid: int) -> None:
+    process_file = os.path.join(path, f"{typ}_{pid}.db")
+    if not os.path.exists(process_file):
+        return
+    archive_file = os.path.join(path, f"{typ}_{_ARCHIVE_SUFFIX}.db")
+    files = [process_file]
+    if os.path.exists(archive_file):
+        files.append(archive_file)
+
+    # accumulate=False keeps histogram buckets non-cumulative, which is
+    # the on-disk representation
+    metrics = MultiProcessCollector.merge(files, accumulate=False)
+    tmp_file = archive_file + ".tmp"
+    if os.path.exists(tmp_file):
+        os.remove(tmp_file)
+    merged = MmapedDict(tmp_file)
+    try:
+        for metric in metrics:
+            for sample in metric.samples:
+                key = mmap_key(
+                    metric.name,
+                    sample.name,
+                    list(sample.labels.keys()),
+                    list(sample.labels.values()),
+                    metric.documentation,
+                )
+                merged.write_value(key, sample.value, 0.0)
+    finally:
+        merged.close()
+    # Scrapes hold the shared lock, so they never observe the state between
+    # these two steps
+    os.replace(tmp_file, archive_file)
+    os.remove(process_file)
+
+
+@contextmanager
+def _compaction_lock(path: str, shared: bool = False):
+    if fcntl is None:
+        yield
+        return
+    with open(os.path.join(path, _LOCK_FILE), "a") as lock:
+        fcntl.flock(lock, fcntl.LOCK_SH if shared else fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock, fcntl.LOCK_UN)
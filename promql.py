@@ -0,0 +1,651 @@
+"""
+Offline evaluator for the PromQL subset used by the shipped rule files.
+
+Supported:
+- instant and range vector selectors with ``=``, ``!=``, ``=~`` and ``!~``
+  matchers (``foo{a="b"}``, ``foo[5m]``)
+- ``rate``, ``increase`` (Prometheus extrapolation and counter resets),
+  ``histogram_quantile`` (Prometheus bucket interpolation)
+- ``sum``/``avg``/``min``/``max``/``count`` with ``by``/``without`` in
+  prefix or suffix position
+- ``+ - * / %`` and ``== != > < >= <=`` (filtering, optional ``bool``)
+  between scalars and vectors, with one-to-one label matching
+- number literals, unary minus and parentheses
+
+Series live in a ``SeriesStore``: samples are appended per series (e.g. from
+registry snapshots with ``ingest()``) and queries run at any timestamp with
+``evaluate(expr, store, time)``. Parsed expressions are cached, so the same
+rules can be evaluated over thousands of synthetic scenarios per second.
+"""
+import math
+import re
+from bisect import bisect_left, bisect_right
+from dataclasses import dataclass, field
+from functools import lru_cache
+from typing import Callable, Dict, Iterable, List, Optional, Sequence, Tuple, Union
+
+Labels = Tuple[Tuple[str, str], ...]  # sorted (name, value) pairs, __name__ included
+Vector = Dict[Labels, float]
+Value = Union[float, Vector]
+
+LOOKBACK_DELTA = 300.0  # seconds an instant selector looks back for a sample
+
+_DURATION_UNITS = {"ms": 0.001, "s": 1, "m": 60, "h": 3600, "d": 86400, "w": 604800, "y": 31536000}
+
+
+class PromQLError(ValueError):
+    """Raised for expressions outside the supported subset."""
+
+
+def parse_duration(duration: str) -> float:
+    """Parse a PromQL duration such as ``30s``, ``5m`` or ``1h30m`` into seconds."""
+    parts = re.findall(r"(\d+(?:\.\d+)?)(ms|[smhdwy])", duration)
+    if not parts or "".join(n + u for n, u in parts) != duration:
+        raise PromQLError(f"Invalid duration: {duration}")
+    return sum(float(n) * _DURATION_UNITS[u] for n, u in parts)
+
+
+def make_labels(name: Optional[str], labels: Optional[Dict[str, str]] = None) -> Labels:
+    items = dict(labels or {})
+    if name is not None:
+        items["__name__"] = name
+    return tuple(sorted(items.items()))
+
+
+def _drop_name(labels: Labels) -> Labels:
+    return tuple(item for item in labels if item[0] != "__name__")
+
+
+# ---------------------------------------------------------------------------
+# Storage
+# ---------------------------------------------------------------------------
+
+class Series:
+    __slots__ = ("labels", "timestamps", "values")
+
+    def __init__(self, labels: Labels):
+        self.labels = labels
+        self.timestamps: List[float] = []
+        self.values: List[float] = []
+
+    def append(self, timestamp: float, value: float) -> None:
+        if self.timestamps and timestamp < self.timestamps[-1]:
+            index = bisect_right(self.timestamps, timestamp)
+            self.timestamps.insert(index, timestamp)
+            self.values.insert(index, value)
+        else:
+            self.timestamps.append(timestamp)
+            self.values.append(value)
+
+
+class SeriesStore:
+    """In-memory time series, indexed by metric name."""
+
+    def __init__(self):
+        self._series: Dict[Labels, Series] = {}
+        self._by_name: Dict[str, List[Series]] = {}
+
+    def add(self, name: str, labels: Optional[Dict[str, str]], timestamp: float, value: float) -> None:
+        self.add_sample(make_labels(name, labels), timestamp, value)
+
+    def add_sample(self, labels: Labels, timestamp: float, value: float) -> None:
+        series = self._series.get(labels)
+        if series is None:
+            series = self._series[labels] = Series(labels)
+            name = dict(labels).get("__name__", "")
+            self._by_name.setdefault(name, []).append(series)
+        series.append(timestamp, value)
+
+    def ingest(self, registry, timestamp: float) -> None:
+        """Append every sample of a registry (or any collector) at ``timestamp``."""
+        for metric in registry.collect():
+            created = metric.name + "_created"
+            for sample in metric.samples:
+                if sample.name == created:
+                    continue
+                self.add(sample.name, sample.labels, timestamp, sample.value)
+
+    def series(self, name: Optional[str]) -> Iterable[Series]:
+        if name is None:
+            return self._series.values()
+        return self._by_name.get(name, ())
+
+    def drop_before(self, timestamp: float) -> None:
+        """Forget samples older than ``timestamp`` and series left empty."""
+        for labels, series in list(self._series.items()):
+            index = bisect_left(series.timestamps, timestamp)
+            if index:
+                del series.timestamps[:index]
+                del series.values[:index]
+            if not series.timestamps:
+                del self._series[labels]
+                by_name = self._by_name[dict(labels).get("__name__", "")]
+                by_name.remove(series)
+
+    def clear(self) -> None:
+        self._series.clear()
+        self._by_name.clear()
+
+
+# ---------------------------------------------------------------------------
+# AST
+# ---------------------------------------------------------------------------
+
+@dataclass(frozen=True)
+class Matcher:
+    name: str
+    op: str
+    value: str
+    regex: Optional["re.Pattern"] = field(default=None, compare=False)
+
+    def matches(self, labels: Dict[str, str]) -> bool:
+        actual = labels.get(self.name, "")
+        if self.op == "=":
+            return actual == self.value
+        if self.op == "!=":
+            return actual != self.value
+        matched = self.regex.fullmatch(actual) is not None
+        return matched if self.op == "=~" else not matched
+
+
+class Node:
+    def eval(self, ctx: "_Context") -> Value:
+        raise NotImplementedError
+
+
+@dataclass
+class NumberLiteral(Node):
+    value: float
+
+    def eval(self, ctx):
+        return self.value
+
+
+@dataclass
+class VectorSelector(Node):
+    name: Optional[str]
+    matchers: Tuple[Matcher, ...]
+    range: Optional[float] = None
+
+    def select(self, store: SeriesStore) -> Iterable[Series]:
+        for series in store.series(self.name):
+            if self.matchers:
+                labels = dict(series.labels)
+                if not all(m.matches(labels) for m in self.matchers):
+                    continue
+            yield series
+
+    def eval(self, ctx):
+        if self.range is not None:
+            raise PromQLError("Range vector must be passed to a function such as rate()")
+        result: Vector = {}
+        start = ctx.time - LOOKBACK_DELTA
+        for series in self.select(ctx.store):
+            index = bisect_right(series.timestamps, ctx.time) - 1
+            if index >= 0 and series.timestamps[index] > start:
+                result[series.labels] = series.values[index]
+        return result
+
+    def samples(self, ctx) -> Iterable[Tuple[Labels, List[float], List[float]]]:
+        start = ctx.time - self.range
+        for series in self.select(ctx.store):
+            lo = bisect_right(series.timestamps, start)
+            hi = bisect_right(series.timestamps, ctx.time)
+            if lo < hi:
+                yield series.labels, series.timestamps[lo:hi], series.values[lo:hi]
+
+
+@dataclass
+class Call(Node):
+    func: str
+    args: Tuple[Node, ...]
+
+    def eval(self, ctx):
+        if self.func in ("rate", "increase"):
+            selector = self.args[0]
+            if not isinstance(selector, VectorSelector) or selector.range is None:
+                raise PromQLError(f"{self.func}() expects a range vector selector")
+            result: Vector = {}
+            for labels, timestamps, values in selector.samples(ctx):
+                value = _extrapolated_rate(timestamps, values, ctx.time - selector.range, ctx.time, self.func == "rate")
+                if value is not None:
+                    result[_drop_name(labels)] = value
+            return result
+        if self.func == "histogram_quantile":
+            q = self.args[0].eval(ctx)
+            vector = self.args[1].eval(ctx)
+            if not isinstance(q, float) or not isinstance(vector, dict):
+                raise PromQLError("histogram_quantile() expects a scalar and a vector")
+            return _histogram_quantile(q, vector)
+        if self.func in ("abs", "ceil", "floor"):
+            vector = self.args[0].eval(ctx)
+            fn = {"abs": abs, "ceil": math.ceil, "floor": math.floor}[self.func]
+            return {_drop_name(k): float(fn(v)) for k, v in vector.items()}
+        raise PromQLError(f"Unsupported function: {self.func}")
+
+
+_AGGREGATIONS = ("sum", "avg", "min", "max", "count")
+
+
+@dataclass
+class Aggregation(Node):
+    op: str
+    expr: Node
+    grouping: Tuple[str, ...] = ()
+    without: bool = False
+
+    def eval(self, ctx):
+        vector = self.expr.eval(ctx)
+        if not isinstance(vector, dict):
+            raise PromQLError(f"{self.op}() expects a vector")
+        groups: Dict[Labels, List[float]] = {}
+        for labels, value in vector.items():
+            if self.without:
+                key = tuple(item for item in labels if item[0] not in self.grouping and item[0] != "__name__")
+            else:
+                key = tuple(item for item in labels if item[0] in self.grouping)
+            groups.setdefault(key, []).append(value)
+        op = self.op
+        result: Vector = {}
+        for key, values in groups.items():
+            if op == "sum":
+                result[key] = float(sum(values))
+            elif op == "avg":
+                result[key] = sum(values) / len(values)
+            elif op == "min":
+                result[key] = min(values)
+            elif op == "max":
+                result[key] = max(values)
+            else:
+                result[key] = float(len(values))
+        return result
+
+
+_ARITHMETIC: Dict[str, Callable[[float, float], float]] = {
+    "+": lambda a, b: a + b,
+    "-": lambda a, b: a - b,
+    "*": lambda a, b: a * b,
+    "/": lambda a, b: a / b if b else (math.nan if a == 0 or math.isnan(a) else math.copysign(math.inf, a) * math.copysign(1, b)),
+    "%": lambda a, b: math.fmod(a, b) if b else math.nan,
+}
+_COMPARISON: Dict[str, Callable[[float, float], bool]] = {
+    "==": lambda a, b: a == b,
+    "!=": lambda a, b: a != b,
+    ">": lambda a, b: a > b,
+    "<": lambda a, b: a < b,
+    ">=": lambda a, b: a >= b,
+    "<=": lambda a, b: a <= b,
+}
+
+
+@dataclass
+class BinaryOp(Node):
+    op: str
+    lhs: Node
+    rhs: Node
+    return_bool: bool = False
+
+    def eval(self, ctx):
+        lhs = self.lhs.eval(ctx)
+        rhs = self.rhs.eval(ctx)
+        comparison = self.op in _COMPARISON
+        fn = _COMPARISON[self.op] if comparison else _ARITHMETIC[self.op]
+
+        if isinstance(lhs, float) and isinstance(rhs, float):
+            if comparison:
+                if not self.return_bool:
+                    raise PromQLError("Comparisons between scalars must use bool")
+                return float(fn(lhs, rhs))
+            return fn(lhs, rhs)
+
+        if isinstance(lhs, dict) and isinstance(rhs, dict):
+            right = {_drop_name(labels): value for labels, value in rhs.items()}
+            result: Vector = {}
+            for labels, value in lhs.items():
+                key = _drop_name(labels)
+                other = right.get(key)
+                if other is None:
+                    continue
+                result.update(self._apply(fn, comparison, labels, key, value, other, value))
+            return result
+
+        # Vector/scalar: comparisons filter the vector side and keep its value
+        vector, scalar, vector_left = (lhs, rhs, True) if isinstance(lhs, dict) else (rhs, lhs, False)
+        result = {}
+        for labels, value in vector.items():
+            a, b = (value, scalar) if vector_left else (scalar, value)
+            result.update(self._apply(fn, comparison, labels, _drop_name(labels), a, b, value))
+        return result
+
+    def _apply(self, fn, comparison, labels, unnamed, a, b, kept) -> Vector:
+        if not comparison:
+            return {unnamed: fn(a, b)}
+        if self.return_bool:
+            return {unnamed: float(fn(a, b))}
+        return {labels: kept} if fn(a, b) else {}
+
+
+@dataclass
+class Unary(Node):
+    expr: Node
+
+    def eval(self, ctx):
+        value = self.expr.eval(ctx)
+        if isinstance(value, float):
+            return -value
+        return {_drop_name(k): -v for k, v in value.items()}
+
+
+# ---------------------------------------------------------------------------
+# Functions
+# ---------------------------------------------------------------------------
+
+def _extrapolated_rate(
+    timestamps: Sequence[float],
+    values: Sequence[float],
+    range_start: float,
+    range_end: float,
+    is_rate: bool,
+) -> Optional[float]:
+    """Prometheus ``extrapolatedRate`` for counters."""
+    if len(values) < 2:
+        return None
+    result = values[-1] - values[0]
+    previous = values[0]
+    for value in values[1:]:
+        if value < previous:
+            result += previous  # counter reset
+        previous = value
+
+    sampled_interval = timestamps[-1] - timestamps[0]
+    if sampled_interval <= 0:
+        return None
+    average_between = sampled_interval / (len(values) - 1)
+    threshold = average_between * 1.1
+    duration_to_start = timestamps[0] - range_start
+    duration_to_end = range_end - timestamps[-1]
+
+    if duration_to_start >= threshold:
+        duration_to_start = average_between / 2
+    if result > 0 and values[0] >= 0:
+        # Don't extrapolate to before the counter would have been zero
+        duration_to_zero = sampled_interval * (values[0] / result)
+        if duration_to_zero < duration_to_start:
+            duration_to_start = duration_to_zero
+    if duration_to_end >= threshold:
+        duration_to_end = average_between / 2
+
+    factor = (sampled_interval + duration_to_start + duration_to_end) / sampled_interval
+    if is_rate:
+        factor /= range_end - range_start
+    return result * factor
+
+
+def _histogram_quantile(q: float, vector: Vector) -> Vector:
+    groups: Dict[Labels, List[Tuple[float, float]]] = {}
+    for labels, value in vector.items():
+        le = None
+        key = []
+        for name, label_value in labels:
+            if name == "le":
+                le = label_value
+            elif name != "__name__":
+                key.append((name, label_value))
+        if le is None:
+            continue
+        try:
+            upper = float(le)
+        except ValueError:
+            continue
+        groups.setdefault(tuple(key), []).append((upper, value))
+    return {key: _bucket_quantile(q, buckets) for key, buckets in groups.items()}
+
+
+def _bucket_quantile(q: float, buckets: List[Tuple[float, float]]) -> float:
+    """Prometheus ``bucketQuantile`` over (upper bound, cumulative count) pairs."""
+    if q < 0:
+        return -math.inf
+    if q > 1:
+        return math.inf
+    buckets.sort()
+    if len(buckets) < 2 or not math.isinf(buckets[-1][0]):
+        return math.nan
+    # Enforce monotonic counts (rates of separate buckets can disagree slightly)
+    counts = []
+    highest = 0.0
+    for _, count in buckets:
+        highest = max(highest, count)
+        counts.append(highest)
+    total = counts[-1]
+    if total == 0:
+        return math.nan
+    rank = q * total
+    b = bisect_left(counts, rank)
+    if b == len(buckets) - 1:
+        return buckets[-2][0]
+    if b == 0 and buckets[0][0] <= 0:
+        return buckets[0][0]
+    bucket_start = 0.0
+    bucket_end = buckets[b][0]
+    count = counts[b]
+    if b > 0:
+        bucket_start = buckets[b - 1][0]
+        count -= counts[b - 1]
+        rank -= counts[b - 1]
+    if count == 0:
+        return bucket_end
+    return bucket_start + (bucket_end - bucket_start) * (rank / count)
+
+
+# ---------------------------------------------------------------------------
+# Parser
+# ---------------------------------------------------------------------------
+
+_TOKEN = re.compile(r"""
+    (?P<ws>\s+|\#[^\n]*)
+  | (?P<duration>(?<=\[)(?:\d+(?:\.\d+)?(?:ms|[smhdwy]))+(?=\]))
+  | (?P<number>(?:\d+\.?\d*|\.\d+)(?:[eE][+-]?\d+)?|[Ii]nf|NaN)
+  | (?P<string>"(?:[^"\\]|\\.)*"|'(?:[^'\\]|\\.)*')
+  | (?P<ident>[a-zA-Z_:][a-zA-Z0-9_:]*)
+  | (?P<op>=~|!~|==|!=|>=|<=|[-+*/%<>=(){}\[\],])
+""", re.X)
+
+
+def _tokenize(expr: str) -> List[Tuple[str, str]]:
+    tokens = []
+    pos = 0
+    while pos < len(expr):
+        match = _TOKEN.match(expr, pos)
+        if not match:
+            raise PromQLError(f"Unexpected character at {pos}: {expr[pos:pos + 10]!r}")
+        kind = match.lastgroup
+        if kind != "ws":
+            tokens.append((kind, match.group()))
+        pos = match.end()
+    tokens.append(("eof", ""))
+    return tokens
+
+
+class _Parser:
+    def __init__(self, expr: str):
+        self.tokens = _tokenize(expr)
+        self.pos = 0
+
+    def peek(self, offset: int = 0) -> Tuple[str, str]:
+        return self.tokens[min(self.pos + offset, len(self.tokens) - 1)]
+
+    def next(self) -> Tuple[str, str]:
+        token = self.tokens[self.pos]
+        self.pos += 1
+        return token
+
+    def expect(self, value: str) -> None:
+        kind, text = self.next()
+        if text != value:
+            raise PromQLError(f"Expected {value!r}, got {text!r}")
+
+    def parse(self) -> Node:
+        node = self.comparison()
+        if self.peek()[0] != "eof":
+            raise PromQLError(f"Unexpected token {self.peek()[1]!r}")
+        return node
+
+    def comparison(self) -> Node:
+        node = self.additive()
+        while self.peek()[1] in _COMPARISON:
+            op = self.next()[1]
+            return_bool = False
+            if self.peek() == ("ident", "bool"):
+                self.next()
+                return_bool = True
+            node = BinaryOp(op, node, self.additive(), return_bool)
+        return node
+
+    def additive(self) -> Node:
+        node = self.multiplicative()
+        while self.peek()[1] in ("+", "-"):
+            op = self.next()[1]
+            node = BinaryOp(op, node, self.multiplicative())
+        return node
+
+    def multiplicative(self) -> Node:
+        node = self.unary()
+        while self.peek()[1] in ("*", "/", "%"):
+            op = self.next()[1]
+            node = BinaryOp(op, node, self.unary())
+        return node
+
+    def unary(self) -> Node:
+        if self.peek()[1] == "-":
+            self.next()
+            operand = self.unary()
+            if isinstance(operand, NumberLiteral):
+                return NumberLiteral(-operand.value)
+            return Unary(operand)
+        if self.peek()[1] == "+":
+            self.next()
+            return self.unary()
+        return self.primary()
+
+    def primary(self) -> Node:
+        kind, text = self.peek()
+        if kind == "number":
+            self.next()
+            return NumberLiteral(float(text))
+        if text == "(":
+            self.next()
+            node = self.comparison()
+            self.expect(")")
+            return node
+        if text == "{":
+            return self.selector(None)
+        if kind == "ident":
+            self.next()
+            if text in _AGGREGATIONS and self.peek()[1] in ("(", "by", "without"):
+                return self.aggregation(text)
+            if self.peek()[1] == "(":
+                return self.call(text)
+            return self.selector(text)
+        raise PromQLError(f"Unexpected token {text!r}")
+
+    def grouping(self) -> Tuple[str, ...]:
+        self.expect("(")
+        labels = []
+        while self.peek()[1] != ")":
+            kind, text = self.next()
+            if kind != "ident":
+                raise PromQLError(f"Expected label name, got {text!r}")
+            labels.append(text)
+            if self.peek()[1] == ",":
+                self.next()
+        self.expect(")")
+        return tuple(labels)
+
+    def aggregation(self, op: str) -> Node:
+        grouping: Tuple[str, ...] = ()
+        without = False
+        if self.peek()[1] in ("by", "without"):
+            without = self.next()[1] == "without"
+            grouping = self.grouping()
+        self.expect("(")
+        expr = self.comparison()
+        self.expect(")")
+        if self.peek()[1] in ("by", "without"):
+            without = self.next()[1] == "without"
+            grouping = self.grouping()
+        return Aggregation(op, expr, grouping, without)
+
+    def call(self, func: str) -> Node:
+        self.expect("(")
+        args = []
+        while self.peek()[1] != ")":
+            args.append(self.comparison())
+            if self.peek()[1] == ",":
+                self.next()
+        self.expect(")")
+        return Call(func, tuple(args))
+
+    def selector(self, name: Optional[str]) -> Node:
+        matchers = []
+        if self.peek()[1] == "{":
+            self.next()
+            while self.peek()[1] != "}":
+                kind, label = self.next()
+                if kind != "ident":
+                    raise PromQLError(f"Expected label name, got {label!r}")
+                op = self.next()[1]
+                if op not in ("=", "!=", "=~", "!~"):
+                    raise PromQLError(f"Unsupported matcher operator {op!r}")
+                kind, value = self.next()
+                if kind != "string":
+                    raise PromQLError(f"Expected label value, got {value!r}")
+                value = value[1:-1].encode().decode("unicode_escape")
+                if label == "__name__" and op == "=":
+                    name = value
+                else:
+                    regex = re.compile(value) if op in ("=~", "!~") else None
+                    matchers.append(Matcher(label, op, value, regex))
+                if self.peek()[1] == ",":
+                    self.next()
+            self.expect("}")
+        range_seconds = None
+        if self.peek()[1] == "[":
+            self.next()
+            kind, text = self.next()
+            if kind != "duration":
+                raise PromQLError(f"Expected duration, got {text!r}")
+            range_seconds = parse_duration(text)
+            self.expect("]")
+        return VectorSelector(name, tuple(matchers), range_seconds)
+
+
+@lru_cache(maxsize=1024)
+def parse(expr: str) -> Node:
+    """Parse an expression into an AST (cached per expression string)."""
+    return _Parser(expr).parse()
+
+
+def selectors(node: Node) -> Iterable[VectorSelector]:
+    """Every vector selector in an expression."""
+    if isinstance(node, VectorSelector):
+        yield node
+    elif isinstance(node, Call):
+        for arg in node.args:
+            yield from selectors(arg)
+    elif isinstance(node, BinaryOp):
+        yield from selectors(node.lhs)
+        yield from selectors(node.rhs)
+    elif isinstance(node, (Aggregation, Unary)):
+        yield from selectors(node.expr)
+
+
+@dataclass
+class _Context:
+    store: SeriesStore
+    time: float
+
+
+def evaluate(expr: Union[str, Node], store: SeriesStore, time: float) -> Value:
+    """Evaluate an instant query at ``time``; returns a scalar or a vector."""
+    node = parse(expr) if isinstance(expr, str) else expr
+    return node.eval(_Context(store, time))
@@ -0,0 +1,367 @@
+"""
+Pulsar producer/consumer instrumentation and admin API backlog collection.
+
+``instrument_producer(producer)`` / ``instrument_consumer(consumer)`` return
+drop-in wrappers around pulsar-client objects:
+
+- send / send_async: events_total{operation="publish", result} and the send
+  latency (until the broker acknowledged) in event_operation_duration_seconds
+- receive / batch_receive: events_total{operation="consume",
+  result="success"} and the end-to-end latency, message publish timestamp to
+  receive, in event_operation_duration_seconds{operation="consume"}
+- negative_acknowledge: events_total{operation="consume", result="failure"}
+
+End-to-end latency compares the broker-set publish timestamp with the local
+clock, so it includes clock skew between hosts. Its exemplar is the trace in
+the message's ``traceparent`` property, when the producer set one; publish
+latency exemplars come from the current trace (``exemplars.py``). Topics are
+labelled without their ``-partition-N`` suffix.
+
+``PulsarBacklogCollector`` polls the admin REST API (``poll()``, run by the
+collector scheduler off the scrape path) and exposes, per topic and
+subscription:
+
+- pulsar_consumer_backlog: messages not yet acknowledged
+- pulsar_consumer_lag_seconds: age of the oldest unacknowledged message
+- pulsar_admin_up: 1 if the last poll reached the admin API
+
+The topic list of each namespace is cached between polls, every request has
+a timeout and a poll stops once its overall budget (below the scheduler's
+timeout) is spent; the next poll starts with the topics it did not reach.
+Topics (partitions) that could not be read keep their previous values until
+they are ``stale_after`` seconds old. Each poll that missed topics prints one
+summary line.
+"""
+import json
+import re
+import threading
+import time
+import urllib.request
+from collections import defaultdict
+from time import perf_counter
+from typing import Any, Dict, Iterable, List, Optional, Sequence, Tuple
+from urllib.parse import quote
+
+from prometheus_client.core import GaugeMetricFamily, Metric
+
+from app.core.prometheus.collectors import CachedCollector
+from app.core.prometheus.config import get_prometheus_config
+from app.core.prometheus.exemplars import (
+    TRACEPARENT_HEADER,
+    attach_exemplar,
+    current_exemplar,
+    exemplars_enabled,
+    parse_traceparent,
+)
+from app.core.prometheus.metrics import bind, get_event_count, get_event_latency, get_metric_registry, get_recorder
+
+_PARTITION_SUFFIX = re.compile(r"-partition-\d+$")
+TOPICS_REFRESH_INTERVAL = 300.0  # seconds a namespace's topic list is reused
+MAX_POLL_BUDGET = 8.0  # seconds; below the scheduler's METRICS_COLLECTION_TIMEOUT (10)
+
+
+def topic_label(topic: str) -> str:
+    """The ``topic`` label for a (possibly partitioned) topic name."""
+    return _PARTITION_SUFFIX.sub("", topic)
+
+
+class _TopicChildren:
+    """Every metric child the wrappers need for one topic."""
+
+    __slots__ = ("published", "publish_failed", "consumed", "nacked", "publish_latency", "consume_latency")
+
+    def __init__(self, topic: str):
+        count = bind(get_event_count())
+        latency = bind(get_event_latency())
+        self.published = count.child(topic, "publish", "success")
+        self.publish_failed = count.child(topic, "publish", "failure")
+        self.consumed = count.child(topic, "consume", "success")
+        self.nacked = count.child(topic, "consume", "failure")
+        self.publish_latency = latency.child(topic, "publish")
+        self.consume_latency = latency.child(topic, "consume")
+
+
+_topic_children: Dict[str, _TopicChildren] = {}
+_topic_children_lock = threading.Lock()
+
+def _children(topic: str) -> _TopicChildren:
+    children = _topic_children.get(topic)
+    if children is None:
+        with _topic_children_lock:
+            children = _topic_children.get(topic)
+            if children is None:
+                children = _topic_children[topic] = _TopicChildren(topic_label(topic))
+    return children
+
+
+class InstrumentedProducer:
+    """Producer wrapper counting and timing sends; see ``instrument_producer()``."""
+
+    def __init__(self, producer: Any):
+        self._producer = producer
+        self._children = _children(producer.topic())
+        self._recorder = get_recorder()
+        self._exemplars = exemplars_enabled()
+
+    def __getattr__(self, name: str) -> Any:
+        return getattr(self._producer, name)
+
+    def send(self, content, *args, **kwargs) -> Any:
+        children = self._children
+        start = perf_counter()
+        try:
+            message_id = self._producer.send(content, *args, **kwargs)
+        except Exception:
+            self._recorder.inc(children.publish_failed)
+            raise
+        elapsed = perf_counter() - start
+        self._recorder.inc(children.published)
+        self._recorder.observe(children.publish_latency, elapsed)
+        if self._exemplars:
+            attach_exemplar(children.publish_latency, elapsed)
+        return message_id
+
+    def send_async(self, content, callback, *args, **kwargs) -> None:
+        children = self._children
+        recorder = self._recorder
+        # The callback runs on the client's thread, outside this trace context
+        trace = current_exemplar() if self._exemplars else None
+        start = perf_counter()
+
+        def on_sent(result, message_id):
+            # result is pulsar.Result; Result.Ok is 0
+            if int(result) == 0:
+                elapsed = perf_counter() - start
+                recorder.inc(children.published)
+                recorder.observe(children.publish_latency, elapsed)
+                if trace is not None:
+                    attach_exemplar(children.publish_latency, elapsed, trace)
+            else:
+                recorder.inc(children.publish_failed)
+            if callback is not None:
+                callback(result, message_id)
+
+        try:
+            self._producer.send_async(content, on_sent, *args, **kwargs)
+        except Exception:
+            recorder.inc(children.publish_failed)
+            raise
+
+
+class InstrumentedConsumer:
+    """Consumer wrapper counting receives and their end-to-end latency; see ``instrument_consumer()``."""
+
+    def __init__(self, consumer: Any):
+        self._consumer = consumer
+        self._recorder = get_recorder()
+        self._exemplars = exemplars_enabled()
+
+    def __getattr__(self, name: str) -> Any:
+        return getattr(self._consumer, name)
+
+    def _record(self, message: Any, now: float) -> None:
+        children = _children(message.topic_name())
+        self._recorder.inc(children.consumed)
+        published_ms = message.publish_timestamp()
+        if published_ms:
+            latency = max(0.0, now - published_ms / 1000)
+            self._recorder.observe(children.consume_latency, latency)
+            if self._exemplars:
+                properties = message.properties() if hasattr(message, "properties") else None
+                trace = parse_traceparent(properties.get(TRACEPARENT_HEADER)) if properties else None
+                attach_exemplar(children.consume_latency, latency, trace)
+
+    def receive(self, *args, **kwargs) -> Any:
+        message = self._consumer.receive(*args, **kwargs)
+        self._record(message, time.time())
+        return message
+
+    def batch_receive(self, *args, **kwargs) -> Any:
+        messages = self._consumer.batch_receive(*args, **kwargs)
+        now = time.time()
+        for message in messages:
+            self._record(message, now)
+        return messages
+
+    def negative_acknowledge(self, message, *args, **kwargs) -> None:
+        self._consumer.negative_acknowledge(message, *args, **kwargs)
+        if hasattr(message, "topic_name"):
+            self._recorder.inc(_children(message.topic_name()).nacked)
+
+
+def instrument_producer(producer: Any) -> InstrumentedProducer:
+    """Wrap a pulsar-client Producer so sends are counted and timed."""
+    return InstrumentedProducer(producer)
+
+
+def instrument_consumer(consumer: Any) -> InstrumentedConsumer:
+    """Wrap a pulsar-client Consumer so receives are counted with end-to-end latency."""
+    return InstrumentedConsumer(consumer)
+
+
+_BACKLOG_METRIC = 'pulsar_consumer_backlog'
+_BACKLOG_DOC = 'Messages not yet acknowledged by the subscription'
+_LAG_METRIC = 'pulsar_consumer_lag_seconds'
+_LAG_DOC = 'Age of the oldest unacknowledged message of the subscription in seconds'
+_UP_METRIC = 'pulsar_admin_up'
+_UP_DOC = 'Whether the last poll of the Pulsar admin API succeeded'
+
+# (topic or partition, subscription) -> (backlog, lag seconds, polled at)
+SubscriptionStats = Dict[Tuple[str, str], Tuple[float, float, float]]
+
+
+class _BudgetExhausted(Exception):
+    pass
+
+
+class PulsarBacklogCollector(CachedCollector):
+    """Backlog and lag per subscription from the Pulsar admin API; see the module docstring."""
+
+    def __init__(
+        self,
+        admin_url: str,
+        namespaces: Sequence[str] = ("public/default",),
+        token: Optional[str] = None,
+        timeout: Optional[float] = None,
+        budget: Optional[float] = None,
+        interval: Optional[float] = None,
+        ttl: Optional[float] = None,
+    ):
+        super().__init__(ttl)
+        config = get_prometheus_config()
+        self.admin_url = admin_url.rstrip("/")
+        self.namespaces = list(namespaces)
+        self.token = token
+        self.timeout = config.PULSAR_ADMIN_TIMEOUT if timeout is None else timeout
+        self.budget = min(2 * self.timeout, MAX_POLL_BUDGET) if budget is None else budget
+        self.interval = config.PULSAR_ADMIN_INTERVAL if interval is None else interval
+        self.stale_after = 3 * self.interval
+        self.up = 0.0
+        self._stats: SubscriptionStats = {}
+        self._topics: Dict[str, Tuple[float, List[str]]] = {}
+        self._next = 0  # where the next poll starts in the combined topic list
+        self._poll_lock = threading.Lock()
+
+    def _get(self, path: str, timeout: float) -> Any:
+        request = urllib.request.Request(self.admin_url + path, headers={"Accept": "application/json"})
+        if self.token:
+            request.add_header("Authorization", f"Bearer {self.token}")
+        with urllib.request.urlopen(request, timeout=timeout) as response:
+            return json.loads(response.read())
+
+    def topics(self, namespace: str, deadline: float) -> List[str]:
+        """The namespace's topics, refreshed every TOPICS_REFRESH_INTERVAL seconds."""
+        cached = self._topics.get(namespace)
+        now = time.monotonic()
+        if cached is not None and now - cached[0] < TOPICS_REFRESH_INTERVAL:
+            return cached[1]
+        try:
+            topics = self._get(f"/admin/v2/namespaces/{namespace}/topics", self._remaining(deadline))
+        except Exception:
+            if cached is not None:
+                return cached[1]
+            raise
+        self._topics[namespace] = (now, topics)
+        return topics
+
+    def _remaining(self, deadline: float) -> float:
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            raise _BudgetExhausted("Pulsar admin poll budget exhausted")
+        return min(self.timeout, remaining)
+
+    def poll(self, now: Optional[float] = None) -> bool:
+        """Refresh backlog and lag for every topic; returns whether the admin API was reachable."""
+        now = time.time() if now is None else now
+        deadline = time.monotonic() + self.budget
+        with self._poll_lock:
+            topics: List[str] = []
+            errors: List[str] = []
+            for namespace in self.namespaces:
+                try:
+                    topics += self.topics(namespace, deadline)
+                except Exception as e:
+                    errors.append(f"listing {namespace}: {e}")
+
+            # Start where the last poll ran out of budget, so every topic is read in turn
+            start = self._next % len(topics) if topics else 0
+            order = topics[start:] + topics[:start]
+            stats: SubscriptionStats = {}
+            read = set()
+            skipped = 0
+            for i, topic in enumerate(order):
+                try:
+                    timeout = self._remaining(deadline)
+                except _BudgetExhausted:
+                    skipped = len(order) - i
+                    self._next = start + i
+                    break
+                try:
+                    topic_stats = self._get(
+                        f"/admin/v2/{quote(topic.replace('://', '/', 1))}/stats?getEarliestTimeInBacklog=true",
+                        timeout,
+                    )
+                except Exception as e:
+                    errors.append(f"{topic}: {e}")
+                    continue
+                read.add(topic)
+                for subscription, sub_stats in (topic_stats.get("subscriptions") or {}).items():
+                    backlog = float(sub_stats.get("msgBacklog") or 0)
+                    earliest_ms = sub_stats.get("earliestMsgPublishTimeInBacklog") or 0
+                    lag = max(0.0, now - earliest_ms / 1000) if backlog and earliest_ms > 0 else 0.0
+                    stats[(topic, subscription)] = (backlog, lag, now)
+
+            for key, previous in self._stats.items():
+                # Unread topics keep their last values until they go stale
+                if key[0] not in read and now - previous[2] < self.stale_after:
+                    stats[key] = previous
+            self._stats = stats
+            self.up = 0.0 if (errors or skipped) and not read else 1.0
+            if errors or skipped:
+                summary = f"Pulsar admin poll read {len(read)} of {len(topics)} topics"
+                if skipped:
+                    summary += f", {skipped} left for the next poll (budget {self.budget:g}s)"
+                if errors:
+                    summary += f"; {len(errors)} failed, last: {errors[-1]}"
+                print(summary)
+        self.invalidate()
+        return bool(self.up)
+
+    def describe_families(self) -> Iterable[Metric]:
+        yield GaugeMetricFamily(_BACKLOG_METRIC, _BACKLOG_DOC, labels=['topic', 'subscription'])
+        yield GaugeMetricFamily(_LAG_METRIC, _LAG_DOC, labels=['topic', 'subscription'])
+        yield GaugeMetricFamily(_UP_METRIC, _UP_DOC)
+
+    def compute(self) -> Iterable[Metric]:
+        backlog = GaugeMetricFamily(_BACKLOG_METRIC, _BACKLOG_DOC, labels=['topic', 'subscription'])
+        lag = GaugeMetricFamily(_LAG_METRIC, _LAG_DOC, labels=['topic', 'subscription'])
+        # Partitions of one topic: backlogs add up, lag is the oldest
+        totals: Dict[Tuple[str, str], List[float]] = defaultdict(lambda: [0.0, 0.0])
+        for (topic, subscription), (messages, seconds, _) in self._stats.items():
+            entry = totals[(topic_label(topic), subscription)]
+            entry[0] += messages
+            entry[1] = max(entry[1], seconds)
+        for (topic, subscription), (messages, seconds) in sorted(totals.items()):
+            backlog.add_metric([topic, subscription], messages)
+            lag.add_metric([topic, subscription], seconds)
+        yield backlog
+        yield lag
+        yield GaugeMetricFamily(_UP_METRIC, _UP_DOC, value=self.up)
+
+
+_pulsar_backlog: Optional[PulsarBacklogCollector] = None
+
+def get_pulsar_backlog() -> Optional[PulsarBacklogCollector]:
+    """Get the backlog collector for PROMETHEUS_PULSAR_ADMIN_URL (None when unset)."""
+    global _pulsar_backlog
+    if _pulsar_backlog is None:
+        config = get_prometheus_config()
+        if not config.PULSAR_ADMIN_URL:
+            return None
+        _pulsar_backlog = PulsarBacklogCollector(
+            config.PULSAR_ADMIN_URL,
+            namespaces=config.PULSAR_NAMESPACES,
+            token=config.PULSAR_ADMIN_TOKEN,
+        )
+        get_metric_registry().register(_pulsar_backlog)
+    return _pulsar_backlog
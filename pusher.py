@@ -0,0 +1,417 @@
+"""
+Push delivery of registry deltas for short-lived Celery and batch processes.
+
+Prefork children and one-off jobs can exit before Prometheus scrapes them.
+``MetricsPusher`` captures a registry snapshot every ``PROMETHEUS_PUSH_INTERVAL``
+seconds, queues the delta against the previous one (``snapshot``) and ships
+queued deltas in batches, either as:
+
+- ``remote_write``: Prometheus remote-write 0.1.0 (protobuf ``WriteRequest``,
+  snappy block compression) to e.g. ``/api/v1/write``; one sample per series
+  and capture, timestamped at the capture. Every series is sent each time
+  (a series last written more than the 5m lookback ago would vanish from
+  queries), and series that disappeared get a stale marker
+- ``pushgateway``: the text format POSTed to ``/metrics/job/<job>/...``;
+  only families that changed are sent, with their current values
+
+Delivery runs off the caller's thread over one reused HTTP connection. The
+queue is bounded and drops the oldest deltas when full; failed batches go
+back on the queue and sending backs off exponentially (with jitter). Call
+``flush()`` before a process exits (e.g. Celery ``worker_process_shutdown``).
+
+Each process pushes under its own identity, ``instance="<host>:<pid>"``: a
+label on every remote-write series and part of the pushgateway grouping key.
+Without it, prefork children pushing the same series would interleave their
+values (remote write) or overwrite each other's group (pushgateway). Pass
+``instance`` to override it, or ``instance=""`` for a service-level job that
+pushes from a single process (see ``_docs/best_practices/push_gateway.md``;
+per-process groups stay on the pushgateway until deleted).
+
+The protobuf message is encoded by hand (three small messages). Snappy uses
+``python-snappy`` when installed, otherwise a valid literal-only snappy
+stream (uncompressed, but accepted by any snappy decoder).
+"""
+import asyncio
+import http.client
+import os
+import random
+import socket
+import struct
+import threading
+import time
+from collections import deque
+from typing import Deque, Dict, Iterable, List, Optional, Sequence, Tuple
+from urllib.parse import quote, urlsplit
+
+from prometheus_client.exposition import generate_latest
+
+from app.core.prometheus.config import get_prometheus_config
+from app.core.prometheus.metrics import get_metric_registry, get_push_dropped, get_push_requests
+from app.core.prometheus.snapshot import RegistrySnapshot, diff_snapshots, take_snapshot
+
+REMOTE_WRITE = "remote_write"
+PUSHGATEWAY = "pushgateway"
+
+Labels = Tuple[Tuple[str, str], ...]
+
+# Prometheus staleness marker: a NaN with this exact bit pattern
+STALE_NAN = struct.unpack("<d", struct.pack("<Q", 0x7FF0000000000002))[0]
+
+
+# ---------------------------------------------------------------------------
+# Remote-write encoding
+# ---------------------------------------------------------------------------
+
+def _varint(value: int) -> bytes:
+    out = bytearray()
+    value &= 0xFFFFFFFFFFFFFFFF  # int64 two's complement
+    while value > 0x7F:
+        out.append((value & 0x7F) | 0x80)
+        value >>= 7
+    out.append(value)
+    return bytes(out)
+
+
+def _field(number: int, payload: bytes) -> bytes:
+    """Length-delimited field (wire type 2)."""
+    return _varint(number << 3 | 2) + _varint(len(payload)) + payload
+
+
+def encode_write_request(timeseries: Iterable[Tuple[Labels, Sequence[Tuple[float, int]]]]) -> bytes:
+    """
+    Encode ``prometheus.WriteRequest``: ``timeseries`` yields (sorted labels
+    including ``__name__``, [(value, timestamp_ms), ...]).
+    """
+    out = bytearray()
+    for labels, samples in timeseries:
+        series = bytearray()
+        for name, value in labels:
+            series += _field(1, _field(1, name.encode()) + _field(2, value.encode()))
+        for value, timestamp in samples:
+            # Sample: double value = 1 (fixed64), int64 timestamp = 2 (varint)
+            series += _field(2, b"\x09" + struct.pack("<d", value) + b"\x10" + _varint(timestamp))
+        out += _field(1, bytes(series))
+    return bytes(out)
+
+
+def snappy_compress(data: bytes) -> bytes:
+    """Snappy block format (what remote write expects)."""
+    try:
+        import snappy  # optional: python-snappy
+        return snappy.compress(data)
+    except ImportError:
+        pass
+    out = bytearray(_varint(len(data)))
+    for start in range(0, len(data), 65536):
+        chunk = data[start:start + 65536]
+        n = len(chunk) - 1
+        if n < 60:
+            out.append(n << 2)
+        elif n < 256:
+            out += bytes((60 << 2, n))
+        else:
+            out += bytes((61 << 2,)) + struct.pack("<H", n)
+        out += chunk
+    return bytes(out)
+
+
+# ---------------------------------------------------------------------------
+# Pusher
+# ---------------------------------------------------------------------------
+
+class _Families:
+    """Collector-shaped wrapper so generate_latest can render snapshot families."""
+
+    def __init__(self, families):
+        self.families = families
+
+    def collect(self):
+        return self.families
+
+
+class MetricsPusher:
+    """Batch registry deltas and push them with bounded queueing and backoff."""
+
+    def __init__(
+        self,
+        url: str,
+        mode: Optional[str] = None,
+        registry=None,
+        job: Optional[str] = None,
+        grouping_key: Optional[Dict[str, str]] = None,
+        labels: Optional[Dict[str, str]] = None,
+        instance: Optional[str] = None,
+        interval: Optional[float] = None,
+        max_queue: Optional[int] = None,
+        max_batch_samples: Optional[int] = None,
+        timeout: float = 5.0,
+        backoff_base: float = 0.5,
+        backoff_max: float = 30.0,
+    ):
+        config = get_prometheus_config()
+        self.mode = mode or config.PUSH_MODE
+        if self.mode not in (REMOTE_WRITE, PUSHGATEWAY):
+            raise ValueError(f"Unknown push mode: {self.mode}")
+        self.url = urlsplit(url)
+        self.registry = registry
+        self.job = job or config.PUSH_JOB
+        self.grouping_key = dict(grouping_key or {})
+        # Remote write: attached to every series (job is always set)
+        self.labels = {"job": self.job, **(labels or {})}
+        # None: "<host>:<pid>", resolved per request so forked children differ
+        self.instance = instance
+        self.interval = config.PUSH_INTERVAL if interval is None else interval
+        self.max_queue = config.PUSH_MAX_QUEUE if max_queue is None else max_queue
+        self.max_batch_samples = config.PUSH_MAX_BATCH_SAMPLES if max_batch_samples is None else max_batch_samples
+        self.timeout = timeout
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+
+        self._queue: Deque[RegistrySnapshot] = deque()
+        self._queue_lock = threading.Lock()
+        self._send_lock = threading.Lock()
+        self._previous = RegistrySnapshot(0.0)
+        self._connection: Optional[http.client.HTTPConnection] = None
+        self._failures = 0
+        self._retry_at = 0.0
+        self._task: Optional[asyncio.Task] = None
+        self._thread: Optional[threading.Thread] = None
+        self._stopped = threading.Event()
+        self._pid = os.getpid()
+
+    # -- queueing -----------------------------------------------------------
+
+    @property
+    def queued(self) -> int:
+        return len(self._queue)
+
+    @property
+    def identity(self) -> str:
+        """This process's ``instance`` value ("" when disabled)."""
+        if self.instance is not None:
+            return self.instance
+        return f"{socket.gethostname()}:{os.getpid()}"
+
+    def capture(self, now: Optional[float] = None) -> int:
+        """
+        Queue a capture; returns how many series changed since the last one.
+
+        Remote write queues the full snapshot plus the keys of removed series
+        (sent as stale markers); the pushgateway queues only the delta.
+        """
+        registry = self.registry if self.registry is not None else get_metric_registry()
+        current = take_snapshot(registry, timestamp=time.time() if now is None else now)
+        with self._queue_lock:
+            if self._pid != os.getpid():
+                # Forked child: the parent sends what it queued, over its own connection
+                self._pid = os.getpid()
+                self._queue.clear()
+                self._connection = None
+            delta = diff_snapshots(self._previous, current)
+            self._previous = current
+            if self.mode == REMOTE_WRITE:
+                if len(current) or delta.removed:
+                    self._enqueue([RegistrySnapshot(
+                        current.timestamp, current.families, current.labelsets,
+                        current.series, current.values, removed=delta.removed,
+                    )])
+            elif len(delta):
+                self._enqueue([delta])
+        return len(delta)
+
+    def _enqueue(self, deltas: List[RegistrySnapshot], front: bool = False) -> None:
+        # Caller holds _queue_lock
+        if front:
+            self._queue.extendleft(reversed(deltas))
+        else:
+            self._queue.extend(deltas)
+        dropped = 0
+        while len(self._queue) > self.max_queue:
+            self._queue.popleft()  # drop oldest
+            dropped += 1
+        if dropped:
+            self._count_dropped("queue_full", dropped)
+
+    def _take_batch(self) -> List[RegistrySnapshot]:
+        with self._queue_lock:
+            batch: List[RegistrySnapshot] = []
+            samples = 0
+            while self._queue and (not batch or samples + len(self._queue[0]) <= self.max_batch_samples):
+                delta = self._queue.popleft()
+                batch.append(delta)
+                samples += len(delta)
+            return batch
+
+    # -- sending ------------------------------------------------------------
+
+    def send_pending(self) -> bool:
+        """Send queued batches until the queue is empty or a send fails."""
+        with self._send_lock:
+            if time.monotonic() < self._retry_at:
+                return False
+            while True:
+                batch = self._take_batch()
+                if not batch:
+                    return True
+                if not self._send_batch(batch):
+                    return False
+
+    def _send_batch(self, batch: List[RegistrySnapshot]) -> bool:
+        method, path, body, headers = self._build_request(batch)
+        try:
+            status = self._request(method, path, body, headers)
+        except (OSError, http.client.HTTPException) as e:
+            print(f"Error pushing metrics to {self.url.netloc}: {e}")
+            status = None
+        if status is not None and 200 <= status < 300:
+            self._failures = 0
+            self._retry_at = 0.0
+            self._count_request("success")
+            return True
+        if status is not None and 400 <= status < 500 and status != 429:
+            # The receiver will never accept this batch; don't retry it
+            print(f"Metrics push rejected with HTTP {status}; dropping {len(batch)} deltas")
+            self._count_request("rejected")
+            self._count_dropped("rejected", len(batch))
+            return True
+        self._count_request("error")
+        self._failures += 1
+        delay = min(self.backoff_max, self.backoff_base * 2 ** (self._failures - 1))
+        self._retry_at = time.monotonic() + delay * random.uniform(0.5, 1.0)
+        with self._queue_lock:
+            self._enqueue(batch, front=True)
+        return False
+
+    def _build_request(self, batch: List[RegistrySnapshot]) -> Tuple[str, str, bytes, Dict[str, str]]:
+        if self.mode == REMOTE_WRITE:
+            series: Dict[Labels, List[Tuple[float, int]]] = {}
+            identity = self.identity
+            extra = dict(self.labels)
+            if identity:
+                extra.setdefault("instance", identity)
+            for snapshot in batch:
+                timestamp = int(snapshot.timestamp * 1000)
+                points = [(snapshot.labelsets[ls], name, value) for (_, name, ls), value in zip(snapshot.series, snapshot.values)]
+                points += [(labels, name, STALE_NAN) for name, labels in snapshot.removed]
+                for labelset, name, value in points:
+                    labels = dict(labelset)
+                    labels.update(extra)
+                    labels["__name__"] = name
+                    key = tuple(sorted(labels.items()))
+                    series.setdefault(key, []).append((value, timestamp))
+            body = snappy_compress(encode_write_request(series.items()))
+            headers = {
+                "Content-Type": "application/x-protobuf",
+                "Content-Encoding": "snappy",
+                "X-Prometheus-Remote-Write-Version": "0.1.0",
+            }
+            return "POST", self.url.path or "/api/v1/write", body, headers
+
+        # Pushgateway: current values of every family that changed in the batch
+        changed = {delta.families[family].name for delta in batch for family, _, _ in delta.series}
+        with self._queue_lock:
+            families = [f for f in self._previous.to_families() if f.name in changed]
+        path = self.url.path.rstrip("/") + "/metrics/job/" + quote(self.job, safe="")
+        grouping_key = dict(self.grouping_key)
+        if self.identity:
+            grouping_key.setdefault("instance", self.identity)
+        for name, value in grouping_key.items():
+            path += f"/{quote(name, safe='')}/{quote(str(value), safe='')}"
+        body = generate_latest(_Families(families))
+        return "POST", path, body, {"Content-Type": "text/plain; version=0.0.4; charset=utf-8"}
+
+    def _request(self, method: str, path: str, body: bytes, headers: Dict[str, str]) -> int:
+        while True:
+            fresh = self._connection is None
+            if fresh:
+                cls = http.client.HTTPSConnection if self.url.scheme == "https" else http.client.HTTPConnection
+                self._connection = cls(self.url.netloc, timeout=self.timeout)
+            connection = self._connection
+            try:
+                connection.request(method, path, body=body, headers=headers)
+                response = connection.getresponse()
+                response.read()
+                if response.will_close:
+                    self._close_connection()
+                return response.status
+            except (http.client.RemoteDisconnected, BrokenPipeError, ConnectionResetError):
+                # A kept-alive connection the server has since closed: reconnect once
+                self._close_connection()
+                if fresh:
+                    raise
+            except Exception:
+                self._close_connection()
+                raise
+
+    def _close_connection(self) -> None:
+        if self._connection is not None:
+            self._connection.close()
+            self._connection = None
+
+    def _count_request(self, result: str) -> None:
+        get_push_requests().labels(self.mode, result).inc()
+
+    def _count_dropped(self, reason: str, n: int) -> None:
+        get_push_dropped().labels(self.mode, reason).inc(n)
+
+    # -- lifecycle ----------------------------------------------------------
+
+    def flush(self, attempts: int = 3) -> bool:
+        """Capture and send everything now (blocking); call before the process exits."""
+        self.capture()
+        for attempt in range(attempts):
+            self._retry_at = 0.0
+            if self.send_pending():
+                return True
+            if attempt + 1 < attempts:
+                time.sleep(min(self.backoff_max, self.backoff_base * 2 ** attempt))
+        return False
+
+    def push(self) -> bool:
+        """Capture a delta and send what is queued (blocking)."""
+        self.capture()
+        return self.send_pending()
+
+    async def run(self) -> None:
+        """Capture and push every ``interval`` seconds until cancelled."""
+        loop = asyncio.get_running_loop()
+        while not self._stopped.is_set():
+            await asyncio.sleep(self.interval)
+            try:
+                # Collection, diffing and blocking HTTP all run in the default
+                # executor, off the event loop
+                await loop.run_in_executor(None, self.push)
+            except Exception as e:
+                print(f"Error in metrics pusher: {e}")
+
+    def start(self) -> asyncio.Task:
+        """Start on the running event loop."""
+        self._task = asyncio.ensure_future(self.run())
+        return self._task
+
+    def start_in_thread(self) -> threading.Thread:
+        """Start on a dedicated daemon thread with its own event loop."""
+        self._thread = threading.Thread(target=lambda: asyncio.run(self.run()), daemon=True, name="metrics-pusher")
+        self._thread.start()
+        return self._thread
+
+    def stop(self, flush: bool = True) -> None:
+        self._stopped.set()
+        if self._task is not None:
+            self._task.cancel()
+        if flush:
+            self.flush()
+        self._close_connection()
+
+
+_pusher: Optional[MetricsPusher] = None
+
+def get_pusher() -> Optional[MetricsPusher]:
+    """Get the pusher for PROMETHEUS_PUSH_URL (None when push delivery is disabled)."""
+    global _pusher
+    if _pusher is None:
+        url = get_prometheus_config().PUSH_URL
+        if not url:
+            return None
+        _pusher = MetricsPusher(url)
+    return _pusher
@@ -0,0 +1,158 @@
+"""
+Metric recorders used by the hot-path instrumentation.
+
+``DirectRecorder`` writes straight into the metric children (one mutex per
+update). ``BufferedRecorder`` is the opt-in alternative for heavily threaded
+processes: increments and histogram bucket counts are accumulated in
+thread-local arrays that only their owning thread writes to, and merged into
+the registry on scrape or every ``flush_interval`` seconds.
+
+Thread buffers are cumulative and never reset by the flusher; it remembers
+what it already merged per buffer and only applies the difference, so no
+lock is needed between a writing thread and the flusher.
+"""
+import threading
+import weakref
+from bisect import bisect_left
+from typing import Any, Dict, List, Optional
+
+
+class DirectRecorder:
+    """Record straight into the metric child."""
+
+    def inc(self, child: Any, amount: float = 1.0) -> None:
+        child.inc(amount)
+
+    def observe(self, child: Any, value: float) -> None:
+        child.observe(value)
+
+    def flush(self) -> None:
+        pass
+
+
+class _ThreadBuffer:
+    __slots__ = ("thread", "cells", "flushed")
+
+    def __init__(self, thread: threading.Thread) -> None:
+        self.thread = weakref.ref(thread)
+        # child -> [value] for counters, [bucket counts..., sum] for histograms
+        self.cells: Dict[Any, List[float]] = {}
+        # child -> copy of the cell as of the last flush
+        self.flushed: Dict[Any, List[float]] = {}
+
+
+class BufferedRecorder:
+    """
+    Accumulate counter increments and histogram observations per thread and
+    merge them into the metric children on ``flush()``.
+
+    Only counters and classic histograms are buffered; gauges have set
+    semantics and should be written directly, and sparse histograms are
+    observed directly.
+    """
+
+    def __init__(self, flush_interval: float = 1.0) -> None:
+        self.flush_interval = flush_interval
+        self._local = threading.local()
+        self._buffers: List[_ThreadBuffer] = []
+        self._buffers_lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def _cells(self) -> Dict[Any, List[float]]:
+        try:
+            return self._local.cells
+        except AttributeError:
+            buffer = _ThreadBuffer(threading.current_thread())
+            with self._buffers_lock:
+                self._buffers.append(buffer)
+            self._local.cells = buffer.cells
+            return buffer.cells
+
+    def inc(self, child: Any, amount: float = 1.0) -> None:
+        cells = self._cells()
+        cell = cells.get(child)
+        if cell is None:
+            cell = cells[child] = [0.0]
+        cell[0] += amount
+
+    def observe(self, child: Any, value: float) -> None:
+        cells = self._cells()
+        cell = cells.get(child)
+        if cell is None:
+            bounds = getattr(child, "_upper_bounds", None)
+            if bounds is None:
+                # No fixed buckets to accumulate into (e.g. SparseHistogram)
+                child.observe(value)
+                return
+            cell = cells[child] = [0.0] * (len(bounds) + 1)
+        # Same bucket choice as Histogram.observe: first bound >= value
+        cell[bisect_left(child._upper_bounds, value)] += 1
+        cell[-1] += value
+
+    def flush(self) -> None:
+        """Merge everything recorded since the last flush into the children."""
+        with self._flush_lock:
+            with self._buffers_lock:
+                buffers = list(self._buffers)
+            finished = []
+            for buffer in buffers:
+                # Checked before reading: a thread seen dead can't write afterwards
+                thread = buffer.thread()
+                alive = thread is not None and thread.is_alive()
+                # Dict/list copies are atomic under the GIL, so the owning
+                # thread can keep writing while we read
+                for child, cell in buffer.cells.copy().items():
+                    current = cell[:]
+                    previous = buffer.flushed.get(child)
+                    if previous is None:
+                        delta = current
+                    else:
+                        delta = [c - p for c, p in zip(current, previous)]
+                    self._apply(child, delta)
+                    buffer.flushed[child] = current
+                if not alive:
+                    finished.append(buffer)
+            if finished:
+                with self._buffers_lock:
+                    self._buffers = [b for b in self._buffers if b not in finished]
+
+    @staticmethod
+    def _apply(child: Any, delta: List[float]) -> None:
+        if len(delta) == 1:
+            if delta[0]:
+                child.inc(delta[0])
+            return
+        for bucket, count in zip(child._buckets, delta):
+            if count:
+                bucket.inc(count)
+        if delta[-1]:
+            child._sum.inc(delta[-1])
+
+    def start(self) -> None:
+        """Start the periodic flush thread."""
+        if self._thread is not None:
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(
+            target=self._run,
+            daemon=True,
+            name="metrics-buffer-flush"
+        )
+        self._thread.start()
+
+    def stop(self) -> None:
+        """Stop the flush thread and merge whatever is still buffered."""
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        self.flush()
+
+    def _run(self) -> None:
+        while not self._stop.wait(self.flush_interval):
+            try:
+                self.flush()
+            except Exception as e:
+                print(f"Error flushing buffered metrics: {e}")
@@ -0,0 +1,116 @@
+"""
+Recording rules evaluated inside the exporter.
+
+Dashboards keep recomputing quantiles and rates over the raw, high-cardinality
+``_bucket`` series. With ``PROMETHEUS_RECORDING_RULES_ENABLED`` the exporter
+does that work itself: the collector scheduler periodically snapshots the
+series the rules read into a rolling in-memory store, evaluates the rules
+(``recording_rules.yml``, same format and naming as Prometheus recording
+rules) and the results are exposed as gauges on the metric registry, e.g.
+``endpoint:http_request_duration_seconds:p95_rate5m{endpoint="/items"}``.
+
+Only the series a rule references are snapshotted, and only for as long as
+the widest range in the rules needs them. Evaluation happens off the scrape
+path; a scrape just exposes the latest results.
+"""
+import os
+import threading
+import time
+from typing import Dict, List, Optional, Sequence
+
+from prometheus_client.core import GaugeMetricFamily, Metric
+
+from app.core.prometheus.collectors import CachedCollector
+from app.core.prometheus.config import get_prometheus_config
+from app.core.prometheus.metrics import get_metric_registry
+from app.core.prometheus.promql import LOOKBACK_DELTA, SeriesStore, Vector, selectors
+from app.core.prometheus.rule_evaluator import RuleEvaluator, RuleGroup, load_rule_groups
+
+DEFAULT_RECORDING_RULES_FILE = os.path.join(os.path.dirname(__file__), "recording_rules.yml")
+
+
+class RecordingRulesCollector(CachedCollector):
+    """Evaluate recording rules over registry snapshots and expose the results."""
+
+    def __init__(
+        self,
+        groups: Sequence[RuleGroup],
+        registry=None,
+        interval: Optional[float] = None,
+        ttl: Optional[float] = None,
+    ):
+        super().__init__(ttl)
+        config = get_prometheus_config()
+        self.interval = config.RECORDING_RULES_INTERVAL if interval is None else interval
+        self.groups = [
+            RuleGroup(group.name, [rule for rule in group.rules if rule.record], group.source)
+            for group in groups
+        ]
+        self.rules = [rule for group in self.groups for rule in group.rules]
+        self._evaluator = RuleEvaluator(self.groups)
+        self._eval_lock = threading.Lock()
+        self._results: Dict[str, Vector] = {}
+
+        records = {rule.name for rule in self.rules}
+        names = set()
+        longest = 0.0
+        for rule in self.rules:
+            for selector in selectors(rule.node):
+                if selector.name and selector.name not in records:
+                    names.add(selector.name)
+                longest = max(longest, selector.range or 0.0)
+        # Keep enough history for the widest range (or the staleness lookback)
+        self.retention = max(longest, LOOKBACK_DELTA) + self.interval
+        self._source = None
+        if registry is not None:
+            self._source = registry.restricted_registry(names)
+            registry.register(self)
+
+    @property
+    def store(self) -> SeriesStore:
+        return self._evaluator.store
+
+    def sample(self, now: Optional[float] = None, source=None) -> None:
+        """Snapshot the referenced series and re-evaluate every rule at ``now``."""
+        now = time.time() if now is None else now
+        source = source or self._source
+        with self._eval_lock:
+            if source is not None:
+                self.store.ingest(source, now)
+            self._evaluator.evaluate(now)
+            self.store.drop_before(now - self.retention)
+            self._results = self._evaluator.recorded
+        self.invalidate()
+
+    def describe_families(self) -> List[Metric]:
+        return [GaugeMetricFamily(rule.name, _help(rule)) for rule in self.rules]
+
+    def compute(self) -> List[Metric]:
+        results = self._results
+        families = []
+        for rule in self.rules:
+            family = GaugeMetricFamily(rule.name, _help(rule))
+            for labels, value in results.get(rule.name, {}).items():
+                family.add_sample(rule.name, dict(labels), value)
+            families.append(family)
+        return families
+
+
+def _help(rule) -> str:
+    return "Recording rule: " + " ".join(rule.expr.split())
+
+
+def load_recording_rules(path: Optional[str] = None) -> List[RuleGroup]:
+    """Recording rule groups from ``path`` (default: PROMETHEUS_RECORDING_RULES_FILE or recording_rules.yml)."""
+    path = path or get_prometheus_config().RECORDING_RULES_FILE or DEFAULT_RECORDING_RULES_FILE
+    return load_rule_groups(path)
+
+
+_recording_rules: Optional[RecordingRulesCollector] = None
+
+def get_recording_rules() -> RecordingRulesCollector:
+    """Get the recording rules collector registered on the metric registry."""
+    global _recording_rules
+    if _recording_rules is None:
+        _recording_rules = RecordingRulesCollector(load_recording_rules(), registry=get_metric_registry())
+    return _recording_rules
@@ -0,0 +1,128 @@
+"""
+Route template resolution for endpoint labels.
+
+Flattens an application's router tree (including Mounts) into a list of
+precompiled path regexes once, and caches (method, path) -> route template
+lookups in a bounded LRU so the per-request cost does not grow with the
+number of routes. Unmatched paths collapse to a single label to keep the
+``endpoint`` dimension bounded.
+"""
+from functools import lru_cache
+from typing import Any, List, Optional, Pattern, Tuple
+
+from starlette.routing import Match, Mount, WebSocketRoute, compile_path
+from starlette.types import Scope
+
+UNMATCHED_ENDPOINT = "<unmatched>"
+
+# (regex, methods, template) for templated routes, or (None, None, route)
+# for routes we cannot flatten and have to ask via route.matches()
+_CompiledRoute = Tuple[Optional[Pattern], Optional[frozenset], Any]
+
+
+class RouteResolver:
+    """
+    Resolve request paths to route templates for an ASGI app.
+    The route table is rebuilt automatically when any router list it was
+    built from changes size or is replaced.
+    """
+
+    def __init__(self, app: Any, maxsize: int = 1024) -> None:
+        self.app = app
+        self.maxsize = maxsize
+        self._routes: List[_CompiledRoute] = []
+        self._watched: List[Tuple[list, int]] = []
+        self._resolve = lru_cache(maxsize=maxsize)(self._match)
+        self.rebuild()
+
+    def rebuild(self) -> None:
+        """Recompile the route table and drop every cached lookup."""
+        routes: List[_CompiledRoute] = []
+        watched: List[Tuple[list, int]] = []
+        self._flatten(getattr(self.app, "routes", []), "", routes, watched)
+        self._routes = routes
+        self._watched = watched
+        self._resolve.cache_clear()
+
+    def is_stale(self) -> bool:
+        """Whether routes were added to or removed from the router tree."""
+        routes = getattr(self.app, "routes", None)
+        if routes is not None and routes is not self._watched[0][0]:
+            return True
+        for route_list, size in self._watched:
+            if len(route_list) != size:
+                return True
+        return False
+
+    def resolve(self, method: str, path: str) -> str:
+        """Return the route template for a request, or ``<unmatched>``."""
+        if self.is_stale():
+            self.rebuild()
+        return self._resolve(method, path)
+
+    def resolve_scope(self, scope: Scope) -> str:
+        path = scope["path"]
+        root_path = scope.get("root_path", "")
+        if root_path and path.startswith(root_path) and path != root_path:
+            path = path[len(root_path):]
+        return self.resolve(scope["method"], path)
+
+    def _flatten(
+        self,
+        route_list: list,
+        prefix: str,
+        routes: List[_CompiledRoute],
+        watched: List[Tuple[list, int]],
+    ) -> None:
+        watched.append((route_list, len(route_list)))
+        for route in route_list:
+            if isinstance(route, WebSocketRoute):
+                continue
+            if isinstance(route, Mount):
+                mount_path = prefix + route.path
+                child_routes = route.routes
+                if child_routes:
+                    self._flatten(child_routes, mount_path, routes, watched)
+                else:
+                    # Plain ASGI app mounted without a router: label by mount path
+                    regex, _, _ = compile_path(mount_path + "/{path:path}")
+                    routes.append((regex, None, mount_path))
+            elif hasattr(route, "path") and hasattr(route, "path_regex"):
+                template = prefix + route.path
+                regex, _, _ = compile_path(template)
+                methods = getattr(route, "methods", None)
+                routes.append((regex, frozenset(methods) if methods else None, template))
+            elif getattr(route, "routes", None):
+                # Host and similar containers that don't add a path prefix
+                self._flatten(route.routes, prefix, routes, watched)
+            else:
+                routes.append((None, None, route))
+
+    def _match(self, method: str, path: str) -> str:
+        partial = None
+        for regex, methods, template in self._routes:
+            if regex is None:
+                template = self._match_opaque(template, method, path)
+                if template is not None:
+                    return template
+                continue
+            if regex.match(path) is None:
+                continue
+            if methods is None or method in methods:
+                return template
+            if partial is None:
+                # Path matched but method didn't (405): still a known route
+                partial = template
+        return partial if partial is not None else UNMATCHED_ENDPOINT
+
+    @staticmethod
+    def _match_opaque(route: Any, method: str, path: str) -> Optional[str]:
+        scope = {"type": "http", "method": method, "path": path, "root_path": ""}
+        try:
+            match, child_scope = route.matches(scope)
+        except Exception:
+            return None
+        if match != Match.FULL:
+            return None
+        matched = child_scope.get("route", route)
+        return getattr(matched, "path", None) or UNMATCHED_ENDPOINT
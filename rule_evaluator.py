@@ -0,0 +1,137 @@
+"""
+Local evaluation of the shipped alert and recording rule files.
+
+Loads the YAML rule groups under ``rules/`` (both the ``groups:`` layout and
+the bare list used by the celery/pulsar/valkey files) and evaluates them with
+the ``promql`` subset against a ``SeriesStore``. Recording rules write their
+result back into the store, so later rules can use them, and alerts go
+through the ``pending`` -> ``firing`` states driven by ``for:``.
+
+Typical use is testing rules offline: build series from registry snapshots
+(``store.ingest(registry, t)``) or synthetic samples, then
+``RuleEvaluator(groups, store).evaluate(t)``.
+"""
+import glob
+import os
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional, Sequence, Tuple
+
+from app.core.prometheus.promql import Labels, Node, SeriesStore, Vector, evaluate, make_labels, parse, parse_duration
+
+RULES_DIR = os.path.join(os.path.dirname(__file__), "rules")
+
+
+@dataclass
+class Rule:
+    name: str
+    expr: str
+    node: Node = field(repr=False)
+    record: bool = False
+    duration: float = 0.0
+    labels: Dict[str, str] = field(default_factory=dict)
+    annotations: Dict[str, str] = field(default_factory=dict)
+
+
+@dataclass
+class RuleGroup:
+    name: str
+    rules: List[Rule]
+    source: str = ""
+
+
+@dataclass
+class Alert:
+    name: str
+    labels: Dict[str, str]
+    value: float
+    state: str
+    active_since: float
+
+
+def load_rule_groups(path: str) -> List[RuleGroup]:
+    """Parse every rule group in a YAML rule file."""
+    import yaml  # optional: only needed to read the rule files
+
+    with open(path) as f:
+        document = yaml.safe_load(f) or {}
+    raw_groups = document.get("groups", []) if isinstance(document, dict) else document
+
+    groups = []
+    for raw in raw_groups:
+        rules = []
+        for raw_rule in raw.get("rules", []):
+            name = raw_rule.get("alert") or raw_rule.get("record")
+            expr = str(raw_rule["expr"]).strip()
+            rules.append(Rule(
+                name=name,
+                expr=expr,
+                node=parse(expr),
+                record="record" in raw_rule,
+                duration=parse_duration(raw_rule["for"]) if raw_rule.get("for") else 0.0,
+                labels={k: str(v) for k, v in (raw_rule.get("labels") or {}).items()},
+                annotations=dict(raw_rule.get("annotations") or {}),
+            ))
+        groups.append(RuleGroup(raw.get("name", ""), rules, path))
+    return groups
+
+
+def load_default_rule_groups(rules_dir: Optional[str] = None) -> List[RuleGroup]:
+    """Rule groups from every ``*.yml`` file under ``rules/``."""
+    groups = []
+    paths = glob.glob(os.path.join(rules_dir or RULES_DIR, "**", "*.yml"), recursive=True)
+    for path in sorted(paths):
+        groups.extend(load_rule_groups(path))
+    return groups
+
+
+class RuleEvaluator:
+    """Evaluates rule groups in order at successive timestamps."""
+
+    def __init__(self, groups: Sequence[RuleGroup], store: Optional[SeriesStore] = None):
+        self.groups = list(groups)
+        self.store = store if store is not None else SeriesStore()
+        # (alert name, labels) -> active since
+        self._active: Dict[Tuple[str, Labels], float] = {}
+        # record name -> series written by the last evaluation (without __name__)
+        self.recorded: Dict[str, Vector] = {}
+
+    def evaluate(self, time: float) -> List[Alert]:
+        """Run every group at ``time`` and return the pending and firing alerts."""
+        alerts: List[Alert] = []
+        seen = set()
+        self.recorded = {}
+        for group in self.groups:
+            for rule in group.rules:
+                result = evaluate(rule.node, self.store, time)
+                if isinstance(result, float):
+                    result = {(): result}
+                if rule.record:
+                    recorded = self.recorded.setdefault(rule.name, {})
+                    for labels, value in result.items():
+                        items = {k: v for k, v in labels if k != "__name__"}
+                        items.update(rule.labels)
+                        self.store.add_sample(make_labels(rule.name, items), time, value)
+                        recorded[make_labels(None, items)] = value
+                    continue
+                for labels, value in result.items():
+                    items = {k: v for k, v in labels if k != "__name__"}
+                    items.update(rule.labels)
+                    key = (rule.name, make_labels(None, items))
+                    if key in seen:
+                        continue
+                    seen.add(key)
+                    since = self._active.setdefault(key, time)
+                    state = "firing" if time - since >= rule.duration else "pending"
+                    alerts.append(Alert(rule.name, items, value, state, since))
+        # Alerts that stopped matching resolve
+        for key in list(self._active):
+            if key not in seen:
+                del self._active[key]
+        return alerts
+
+    def firing(self, time: float) -> List[str]:
+        """Names of alerts firing at ``time`` (sorted, deduplicated)."""
+        return sorted({alert.name for alert in self.evaluate(time) if alert.state == "firing"})
+
+    def reset(self) -> None:
+        self._active.clear()
@@ -0,0 +1,177 @@
+"""
+Collector scheduler for periodic metric sources.
+
+Every registered source runs on its own interval, concurrently with the
+others, so one slow source (Pulsar admin, Valkey) can't delay the rest.
+Ticks are aligned to a fixed grid (no cumulative drift), can be spread with
+random jitter, are skipped while the previous run of the same source is
+still going, and are bounded by a per-source timeout.
+
+The scheduler runs either on an existing asyncio loop (``start()``, e.g.
+from a FastAPI lifespan) or on a dedicated thread (``start_in_thread()``).
+Sync sources run in a small thread pool; async sources are awaited.
+
+Self-metrics per source:
+- metrics_collector_duration_seconds: duration of the last run
+- metrics_collector_failures_total: runs that raised or timed out
+- metrics_collector_skipped_total: ticks skipped because the previous run was still going
+"""
+import asyncio
+import inspect
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+from typing import Any, Callable, Dict, List, Optional
+
+from app.core.prometheus.metrics import (
+    bind,
+    get_collector_duration,
+    get_collector_failures,
+    get_collector_skipped,
+)
+
+
+@dataclass
+class CollectorSource:
+    name: str
+    func: Callable[[], Any]
+    interval: float
+    timeout: Optional[float] = None
+    jitter: float = 0.0
+    is_async: bool = field(init=False)
+    _task: Optional[asyncio.Future] = field(default=None, init=False, repr=False)
+    _thread_future: Optional[asyncio.Future] = field(default=None, init=False, repr=False)
+
+    def __post_init__(self):
+        self.is_async = inspect.iscoroutinefunction(self.func)
+
+    @property
+    def busy(self) -> bool:
+        # A timed-out sync source keeps running in its worker thread
+        return any(f is not None and not f.done() for f in (self._task, self._thread_future))
+
+
+class CollectorScheduler:
+    """Run registered metric sources concurrently on their own intervals."""
+
+    def __init__(self, max_workers: int = 4):
+        self.max_workers = max_workers
+        self._sources: Dict[str, CollectorSource] = {}
+        self._executor: Optional[ThreadPoolExecutor] = None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._tasks: List[asyncio.Task] = []
+        self._thread: Optional[threading.Thread] = None
+
+    def register(
+        self,
+        name: str,
+        func: Callable[[], Any],
+        interval: float,
+        timeout: Optional[float] = None,
+        jitter: float = 0.0,
+    ) -> CollectorSource:
+        """Register a sync or async source; must be called before starting."""
+        if name in self._sources:
+            raise ValueError(f"Collector source already registered: {name}")
+        source = CollectorSource(name, func, interval, timeout, jitter)
+        self._sources[name] = source
+        return source
+
+    @property
+    def sources(self) -> List[CollectorSource]:
+        return list(self._sources.values())
+
+    async def run(self) -> None:
+        """Run every source until cancelled or ``stop()`` is called."""
+        self._loop = asyncio.get_running_loop()
+        self._executor = ThreadPoolExecutor(
+            max_workers=self.max_workers, thread_name_prefix="metrics-collector"
+        )
+        self._tasks = [asyncio.ensure_future(self._run_source(s)) for s in self._sources.values()]
+        try:
+            await asyncio.gather(*self._tasks)
+        except asyncio.CancelledError:
+            pass
+        finally:
+            for task in self._tasks:
+                task.cancel()
+            self._executor.shutdown(wait=False)
+
+    def start(self) -> asyncio.Task:
+        """Start on the running event loop (e.g. in an app lifespan)."""
+        return asyncio.ensure_future(self.run())
+
+    def start_in_thread(self) -> threading.Thread:
+        """Start on a dedicated daemon thread with its own event loop."""
+        self._thread = threading.Thread(
+            target=lambda: asyncio.run(self.run()),
+            daemon=True,
+            name="metrics-collector"
+        )
+        self._thread.start()
+        return self._thread
+
+    def stop(self) -> None:
+        """Cancel every source loop; safe to call from any thread."""
+        loop = self._loop
+        if loop is None or loop.is_closed():
+            return
+        for task in self._tasks:
+            loop.call_soon_threadsafe(task.cancel)
+        if self._thread is not None and self._thread is not threading.current_thread():
+            self._thread.join(timeout=5)
+            self._thread = None
+
+    async def _run_source(self, source: CollectorSource) -> None:
+        loop = asyncio.get_running_loop()
+        skipped = bind(get_collector_skipped()).child(source.name)
+        base = loop.time()
+        next_run = base + random.uniform(0, source.jitter)
+        try:
+            while True:
+                delay = next_run - loop.time()
+                if delay > 0:
+                    await asyncio.sleep(delay)
+                if source.busy:
+                    skipped.inc()
+                else:
+                    source._task = asyncio.ensure_future(self._execute(source))
+                # Advance on a fixed grid so run time never accumulates as drift;
+                # if we fell behind by whole intervals, skip them
+                base += source.interval
+                now = loop.time()
+                if base < now:
+                    base += (int((now - base) / source.interval) + 1) * source.interval
+                next_run = base + random.uniform(0, source.jitter)
+        finally:
+            if source._task is not None:
+                source._task.cancel()
+
+    async def _execute(self, source: CollectorSource) -> None:
+        start = time.perf_counter()
+        try:
+            if source.is_async:
+                await asyncio.wait_for(source.func(), source.timeout)
+            else:
+                loop = asyncio.get_running_loop()
+                source._thread_future = loop.run_in_executor(self._executor, source.func)
+                # A run that outlives its timeout still finishes; don't let its
+                # result or error be reported as never retrieved
+                source._thread_future.add_done_callback(_discard_result)
+                await asyncio.wait_for(asyncio.shield(source._thread_future), source.timeout)
+        except asyncio.CancelledError:
+            raise
+        except asyncio.TimeoutError:
+            bind(get_collector_failures()).child(source.name).inc()
+            print(f"Metrics collector {source.name} timed out after {source.timeout}s")
+        except Exception as e:
+            bind(get_collector_failures()).child(source.name).inc()
+            print(f"Error in metrics collector {source.name}: {e}")
+        bind(get_collector_duration()).child(source.name).set(time.perf_counter() - start)
+
+
+def _discard_result(future: asyncio.Future) -> None:
+    if not future.cancelled():
+        future.exception()
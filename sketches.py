@@ -0,0 +1,223 @@
+"""
+Streaming quantile sketches (DDSketch) for in-process percentiles.
+
+Histograms only give quantiles after a Prometheus round trip. A
+``QuantileSketch`` keeps a DDSketch per label set, so the live process can
+ask for p50/p99 of its own task or query durations (adaptive timeouts, load
+shedding) and still export them to the registry as a summary.
+
+DDSketch maps a value ``v > 0`` to bucket ``ceil(log(v) / log(gamma))`` with
+``gamma = (1 + a) / (1 - a)``; every quantile it returns is within relative
+error ``a`` of the true value. Buckets live in a dense array capped at
+``max_bins``; past the cap the lowest buckets are collapsed, so memory per
+series is fixed and only the lowest quantiles lose accuracy. Sketches with
+the same accuracy can be merged (e.g. across threads or processes).
+
+Values <= 0 are counted in a zero bucket (durations are never negative).
+"""
+import math
+import threading
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+from prometheus_client.core import SummaryMetricFamily
+from prometheus_client.samples import Sample
+from prometheus_client.utils import floatToGoString
+
+DEFAULT_RELATIVE_ACCURACY = 0.01
+DEFAULT_MAX_BINS = 2048
+DEFAULT_QUANTILES = (0.5, 0.9, 0.99)
+# Values below this are indistinguishable from zero at any useful accuracy
+MIN_INDEXABLE_VALUE = 1e-9
+
+
+class DDSketch:
+    """Mergeable quantile sketch with bounded relative error and memory."""
+
+    __slots__ = ("relative_accuracy", "max_bins", "_log_gamma", "_lock", "bins", "offset", "zero_count", "count", "sum")
+
+    def __init__(self, relative_accuracy: float = DEFAULT_RELATIVE_ACCURACY, max_bins: int = DEFAULT_MAX_BINS):
+        if not 0 < relative_accuracy < 1:
+            raise ValueError(f"Relative accuracy must be between 0 and 1: {relative_accuracy}")
+        self.relative_accuracy = relative_accuracy
+        self.max_bins = max_bins
+        self._log_gamma = math.log((1 + relative_accuracy) / (1 - relative_accuracy))
+        self._lock = threading.Lock()
+        self.bins: List[int] = []
+        self.offset = 0
+        self.zero_count = 0
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value: float) -> None:
+        with self._lock:
+            self.count += 1
+            self.sum += value
+            if value <= MIN_INDEXABLE_VALUE:
+                self.zero_count += 1
+                return
+            self._add(math.ceil(math.log(value) / self._log_gamma), 1)
+
+    def _add(self, index: int, n: int) -> None:
+        bins = self.bins
+        if not bins:
+            self.offset = index
+            bins.append(n)
+            return
+        if index < self.offset:
+            if self.offset - index + len(bins) > self.max_bins:
+                # Already at the cap: the lowest kept bucket absorbs it
+                index = max(index, self.offset + len(bins) - self.max_bins)
+            if index < self.offset:
+                bins[:0] = [0] * (self.offset - index)
+                self.offset = index
+        elif index >= self.offset + len(bins):
+            bins.extend([0] * (index - self.offset - len(bins) + 1))
+        bins[index - self.offset] += n
+        if len(bins) > self.max_bins:
+            self._collapse()
+
+    def _collapse(self) -> None:
+        # Fold the lowest buckets into the first one that is kept
+        excess = len(self.bins) - self.max_bins
+        folded = sum(self.bins[:excess + 1])
+        del self.bins[:excess]
+        self.bins[0] = folded
+        self.offset += excess
+
+    def quantile(self, q: float) -> float:
+        """
+        Value at quantile ``q`` (0..1), or NaN when empty. Cost depends only
+        on ``max_bins``, never on the number of observations.
+        """
+        with self._lock:
+            if not self.count:
+                return math.nan
+            rank = q * (self.count - 1)
+            seen = self.zero_count
+            if seen > rank:
+                return 0.0
+            for i, n in enumerate(self.bins):
+                seen += n
+                if seen > rank:
+                    return self._value(self.offset + i)
+            return self._value(self.offset + len(self.bins) - 1)
+
+    def _value(self, index: int) -> float:
+        # Midpoint (in relative terms) of (gamma**(i-1), gamma**i]
+        gamma = math.exp(self._log_gamma)
+        return 2 * gamma ** index / (gamma + 1)
+
+    def merge(self, other: "DDSketch") -> None:
+        """Add every observation of ``other`` (same accuracy) to this sketch."""
+        if other.relative_accuracy != self.relative_accuracy:
+            raise ValueError("Can only merge sketches with the same relative accuracy")
+        with other._lock:
+            bins, offset = list(other.bins), other.offset
+            zero_count, count, total = other.zero_count, other.count, other.sum
+        with self._lock:
+            self.zero_count += zero_count
+            self.count += count
+            self.sum += total
+            for i, n in enumerate(bins):
+                if n:
+                    self._add(offset + i, n)
+
+    def snapshot(self, quantiles: Sequence[float]) -> Tuple[List[float], int, float]:
+        values = [self.quantile(q) for q in quantiles]
+        with self._lock:
+            return values, self.count, self.sum
+
+
+class QuantileSketch:
+    """
+    Labelled metric keeping a DDSketch per label set and exporting it as a
+    summary: ``name{quantile="0.99"}``, ``name_count`` and ``name_sum``.
+
+    ``labels(...).quantile(0.99)`` reads the live value in-process;
+    ``get(...)`` looks a child up without creating it.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        documentation: str,
+        labelnames: Sequence[str] = (),
+        registry: Any = None,
+        quantiles: Sequence[float] = DEFAULT_QUANTILES,
+        relative_accuracy: float = DEFAULT_RELATIVE_ACCURACY,
+        max_bins: int = DEFAULT_MAX_BINS,
+    ):
+        self._name = name
+        self._documentation = documentation
+        self._labelnames = tuple(labelnames)
+        self.quantiles = tuple(quantiles)
+        self.relative_accuracy = relative_accuracy
+        self.max_bins = max_bins
+        self._children: Dict[Tuple[str, ...], DDSketch] = {}
+        self._lock = threading.Lock()
+        if not self._labelnames:
+            self._children[()] = self._new_sketch()
+        if registry is not None:
+            registry.register(self)
+
+    def _new_sketch(self) -> DDSketch:
+        return DDSketch(self.relative_accuracy, self.max_bins)
+
+    def _key(self, labelvalues: Tuple[Any, ...], labelkwargs: Dict[str, Any]) -> Tuple[str, ...]:
+        if not self._labelnames:
+            raise ValueError(f"No label names were set when constructing {self._name}")
+        if labelvalues and labelkwargs:
+            raise ValueError("Can't pass both *args and **kwargs")
+        if labelkwargs:
+            if sorted(labelkwargs) != sorted(self._labelnames):
+                raise ValueError("Incorrect label names")
+            return tuple(str(labelkwargs[name]) for name in self._labelnames)
+        if len(labelvalues) != len(self._labelnames):
+            raise ValueError("Incorrect label count")
+        return tuple(str(value) for value in labelvalues)
+
+    def get(self, *labelvalues: Any, **labelkwargs: Any) -> Optional[DDSketch]:
+        """The existing sketch for these labels, or None (never creates one)."""
+        return self._children.get(self._key(labelvalues, labelkwargs))
+
+    def labels(self, *labelvalues: Any, **labelkwargs: Any) -> DDSketch:
+        labelvalues = self._key(labelvalues, labelkwargs)
+        sketch = self._children.get(labelvalues)
+        if sketch is None:
+            with self._lock:
+                sketch = self._children.get(labelvalues)
+                if sketch is None:
+                    sketch = self._children[labelvalues] = self._new_sketch()
+        return sketch
+
+    def observe(self, value: float) -> None:
+        if self._labelnames:
+            raise ValueError(f"{self._name} is labelled; use labels(...).observe()")
+        self._children[()].observe(value)
+
+    def quantile(self, q: float) -> float:
+        if self._labelnames:
+            raise ValueError(f"{self._name} is labelled; use labels(...).quantile()")
+        return self._children[()].quantile(q)
+
+    def remove(self, *labelvalues: Any) -> None:
+        with self._lock:
+            self._children.pop(tuple(str(value) for value in labelvalues), None)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._children = {} if self._labelnames else {(): self._new_sketch()}
+
+    def describe(self) -> List[SummaryMetricFamily]:
+        return [SummaryMetricFamily(self._name, self._documentation, labels=self._labelnames)]
+
+    def collect(self) -> List[SummaryMetricFamily]:
+        family = SummaryMetricFamily(self._name, self._documentation, labels=self._labelnames)
+        for labelvalues, sketch in list(self._children.items()):
+            labels = dict(zip(self._labelnames, labelvalues))
+            values, count, total = sketch.snapshot(self.quantiles)
+            for q, value in zip(self.quantiles, values):
+                family.samples.append(Sample(self._name, {**labels, "quantile": floatToGoString(q)}, value))
+            family.samples.append(Sample(f"{self._name}_count", labels, count))
+            family.samples.append(Sample(f"{self._name}_sum", labels, total))
+        return [family]
@@ -0,0 +1,323 @@
+"""
+In-process sliding-window SLO aggregator.
+
+The alert rules in rules/alerts.yml are evaluated by a remote Prometheus
+well after the fact. ``SLOAggregator`` is fed by PrometheusMiddleware and
+keeps, per endpoint and for all endpoints together, request counts per
+status class and latency bucket counts over rolling windows (1m and 5m by
+default), so the app can run circuit breakers and shed load on its own
+error rate and p99 using the thresholds of the same YAML rules.
+
+Each window is a ring of fixed-width slots stored in one flat array, with
+running totals kept next to it: an update touches one slot and the totals,
+a query reads only the totals, and expired slots are subtracted as the ring
+advances. Memory is fixed per endpoint, and the number of endpoints tracked
+is capped (the rest share an ``__overflow__`` entry).
+
+Latency buckets are the classic histogram buckets and quantiles use the
+same interpolation as ``histogram_quantile``, so in-process values match
+what Prometheus computes for the rules.
+"""
+import os
+import re
+import threading
+import time
+from array import array
+from bisect import bisect_left
+from dataclasses import dataclass
+from typing import Dict, List, Optional, Sequence, Tuple
+
+from prometheus_client import Histogram
+
+from app.core.prometheus.config import get_prometheus_config
+
+# name -> (length in seconds, number of slots)
+DEFAULT_WINDOWS = {
+    "1m": (60, 60),
+    "5m": (300, 60),
+}
+ALL_ENDPOINTS = "*"
+OVERFLOW_ENDPOINT = "__overflow__"
+DEFAULT_RULES_FILE = os.path.join(os.path.dirname(__file__), "rules", "alerts.yml")
+
+_BOUNDS = tuple(b for b in Histogram.DEFAULT_BUCKETS if b != float("inf"))
+# Slot layout: count, 1xx..5xx, latency sum, one count per bucket (+Inf last)
+_COUNT = 0
+_STATUS = 1
+_SUM = 6
+_BUCKETS = 7
+_FIELDS = _BUCKETS + len(_BOUNDS) + 1
+
+_DURATION_UNITS = {"s": 1, "m": 60, "h": 3600, "d": 86400}
+
+
+def parse_duration(duration: str) -> float:
+    """Parse a Prometheus duration like ``30s``, ``5m`` or ``1h``."""
+    match = re.fullmatch(r"(\d+(?:\.\d+)?)([smhd])", duration.strip())
+    if not match:
+        raise ValueError(f"Invalid duration: {duration}")
+    return float(match.group(1)) * _DURATION_UNITS[match.group(2)]
+
+
+class RollingWindow:
+    """Counts over the last ``length`` seconds in ``slots`` fixed-width slots."""
+
+    __slots__ = ("length", "slots", "width", "_data", "_totals", "_slot")
+
+    def __init__(self, length: float, slots: int):
+        self.length = length
+        self.slots = slots
+        self.width = length / slots
+        self._data = array("d", [0.0]) * (slots * _FIELDS)
+        self._totals = array("d", [0.0]) * _FIELDS
+        self._slot: Optional[int] = None
+
+    def advance(self, now: float) -> None:
+        """Expire the slots that fell out of the window by ``now``."""
+        current = int(now // self.width)
+        if self._slot is None:
+            self._slot = current
+            return
+        if current <= self._slot:
+            return
+        data, totals = self._data, self._totals
+        for step in range(1, min(current - self._slot, self.slots) + 1):
+            base = ((self._slot + step) % self.slots) * _FIELDS
+            for field in range(_FIELDS):
+                totals[field] -= data[base + field]
+                data[base + field] = 0.0
+        self._slot = current
+
+    def add(self, now: float, status_class: int, latency: float, bucket: int) -> None:
+        self.advance(now)
+        base = (self._slot % self.slots) * _FIELDS
+        data, totals = self._data, self._totals
+        for field in (_COUNT, _STATUS + status_class, _BUCKETS + bucket):
+            data[base + field] += 1
+            totals[field] += 1
+        data[base + _SUM] += latency
+        totals[_SUM] += latency
+
+    def totals(self, now: float) -> array:
+        self.advance(now)
+        return self._totals
+
+
+class EndpointWindows:
+    """Every rolling window of one endpoint, behind one lock."""
+
+    __slots__ = ("windows", "_lock")
+
+    def __init__(self, windows: Dict[str, Tuple[float, int]]):
+        self.windows = {name: RollingWindow(length, slots) for name, (length, slots) in windows.items()}
+        self._lock = threading.Lock()
+
+    def add(self, now: float, status_class: int, latency: float, bucket: int) -> None:
+        with self._lock:
+            for window in self.windows.values():
+                window.add(now, status_class, latency, bucket)
+
+    def totals(self, window: str, now: float) -> Tuple[float, List[float]]:
+        with self._lock:
+            rolling = self.windows[window]
+            return rolling.length, list(rolling.totals(now))
+
+
+@dataclass
+class WindowStats:
+    """Snapshot of one endpoint over one window."""
+
+    window: float
+    requests: float
+    status_counts: Tuple[float, ...]  # 1xx..5xx
+    latency_sum: float
+    buckets: Tuple[float, ...]  # non-cumulative, +Inf last
+
+    def errors(self, status_pattern: str = "5..") -> float:
+        """Requests whose status class matches a PromQL status regex (e.g. ``5..``)."""
+        pattern = re.compile(status_pattern)
+        return sum(
+            count for i, count in enumerate(self.status_counts)
+            if pattern.fullmatch(f"{i + 1}00")
+        )
+
+    def rate(self, status_pattern: Optional[str] = None) -> float:
+        """Per-second rate over the window, like PromQL ``rate()``."""
+        count = self.requests if status_pattern is None else self.errors(status_pattern)
+        return count / self.window
+
+    def ratio(self, status_pattern: str = "5..") -> float:
+        """Fraction of requests matching ``status_pattern``."""
+        return self.errors(status_pattern) / self.requests if self.requests else 0.0
+
+    def quantile(self, q: float) -> float:
+        """Latency quantile with ``histogram_quantile`` interpolation (NaN when empty)."""
+        if not self.requests:
+            return float("nan")
+        rank = q * self.requests
+        cumulative = 0.0
+        for i, count in enumerate(self.buckets):
+            if cumulative + count >= rank and count:
+                if i == len(_BOUNDS):
+                    # Rank falls in +Inf: report the highest finite bound
+                    return _BOUNDS[-1]
+                lower = _BOUNDS[i - 1] if i else 0.0
+                return lower + (_BOUNDS[i] - lower) * (rank - cumulative) / count
+            cumulative += count
+        return _BOUNDS[-1]
+
+
+class SLOAggregator:
+    """Per-endpoint rolling request/error counts and latency buckets."""
+
+    def __init__(
+        self,
+        windows: Optional[Dict[str, Tuple[float, int]]] = None,
+        max_endpoints: Optional[int] = None,
+    ):
+        self.windows = dict(windows or DEFAULT_WINDOWS)
+        self.max_endpoints = get_prometheus_config().SLO_MAX_ENDPOINTS if max_endpoints is None else max_endpoints
+        self._all = EndpointWindows(self.windows)
+        self._endpoints: Dict[str, EndpointWindows] = {}
+        self._lock = threading.Lock()
+
+    def observe(self, endpoint: str, status: int, latency: float, now: Optional[float] = None) -> None:
+        """Record one finished request."""
+        now = time.monotonic() if now is None else now
+        status_class = min(max(int(status) // 100, 1), 5) - 1
+        bucket = bisect_left(_BOUNDS, latency)
+        self._all.add(now, status_class, latency, bucket)
+        self._windows_for(endpoint).add(now, status_class, latency, bucket)
+
+    def _windows_for(self, endpoint: str) -> EndpointWindows:
+        windows = self._endpoints.get(endpoint)
+        if windows is None:
+            with self._lock:
+                windows = self._endpoints.get(endpoint)
+                if windows is None:
+                    if len(self._endpoints) >= self.max_endpoints:
+                        endpoint = OVERFLOW_ENDPOINT
+                        windows = self._endpoints.get(endpoint)
+                    if windows is None:
+                        windows = self._endpoints[endpoint] = EndpointWindows(self.windows)
+        return windows
+
+    def stats(self, endpoint: str = ALL_ENDPOINTS, window: str = "5m", now: Optional[float] = None) -> WindowStats:
+        """Snapshot of ``endpoint`` (default: all endpoints) over ``window``."""
+        now = time.monotonic() if now is None else now
+        windows = self._all if endpoint == ALL_ENDPOINTS else self._endpoints.get(endpoint)
+        if windows is None:
+            return WindowStats(self.windows[window][0], 0.0, (0.0,) * 5, 0.0, (0.0,) * (len(_BOUNDS) + 1))
+        length, totals = windows.totals(window, now)
+        return WindowStats(
+            window=length,
+            requests=totals[_COUNT],
+            status_counts=tuple(totals[_STATUS:_SUM]),
+            latency_sum=totals[_SUM],
+            buckets=tuple(totals[_BUCKETS:]),
+        )
+
+    @property
+    def endpoints(self) -> List[str]:
+        return list(self._endpoints)
+
+    def evaluate(
+        self,
+        rules: Optional[Sequence["SLORule"]] = None,
+        endpoint: str = ALL_ENDPOINTS,
+        now: Optional[float] = None,
+    ) -> Dict[str, Tuple[float, bool]]:
+        """Current value and breach state of every rule for ``endpoint``."""
+        rules = get_slo_rules() if rules is None else rules
+        results = {}
+        for rule in rules:
+            value = rule.value(self.stats(endpoint, rule.window, now))
+            results[rule.name] = (value, value > rule.threshold)
+        return results
+
+    def breached(self, endpoint: str = ALL_ENDPOINTS, rules: Optional[Sequence["SLORule"]] = None) -> List[str]:
+        """Names of the rules currently breached for ``endpoint``."""
+        return [name for name, (_, breached) in self.evaluate(rules, endpoint).items() if breached]
+
+
+@dataclass(frozen=True)
+class SLORule:
+    """Threshold taken from an alert rule, evaluated on a rolling window."""
+
+    name: str
+    kind: str  # "error_rate" or "latency_quantile"
+    window: str
+    threshold: float
+    status_pattern: Optional[str] = None
+    quantile: Optional[float] = None
+
+    def value(self, stats: WindowStats) -> float:
+        if self.kind == "error_rate":
+            return stats.rate(self.status_pattern)
+        return stats.quantile(self.quantile)
+
+
+_ERROR_RATE_EXPR = re.compile(
+    r'^\s*rate\(\s*http_requests_total\{\s*status=~"(?P<status>[^"]+)"\s*\}\[(?P<window>\w+)\]\s*\)\s*>\s*(?P<threshold>[\d.]+)\s*$'
+)
+_LATENCY_EXPR = re.compile(
+    r'^\s*histogram_quantile\(\s*(?P<quantile>[\d.]+)\s*,.*http_request_duration_seconds_bucket\[(?P<window>\w+)\].*\)\s*>\s*(?P<threshold>[\d.]+)\s*$',
+    re.S,
+)
+
+
+def load_slo_rules(path: Optional[str] = None, windows: Optional[Dict[str, Tuple[float, int]]] = None) -> List[SLORule]:
+    """
+    Read the HTTP error-rate and latency thresholds from an alert rules file
+    (default: rules/alerts.yml). Rules of other shapes, and rules whose range
+    is not one of the rolling windows, are skipped.
+    """
+    import yaml  # optional: only needed to read the rule files
+
+    windows = windows or DEFAULT_WINDOWS
+    with open(path or DEFAULT_RULES_FILE) as f:
+        document = yaml.safe_load(f) or {}
+    groups = document.get("groups", []) if isinstance(document, dict) else document
+
+    rules: Dict[str, SLORule] = {}
+    for group in groups:
+        for rule in group.get("rules", []):
+            name, expr = rule.get("alert"), rule.get("expr")
+            if not name or not isinstance(expr, str):
+                continue
+            match = _ERROR_RATE_EXPR.match(expr)
+            if match:
+                slo = SLORule(name, "error_rate", match["window"], float(match["threshold"]), status_pattern=match["status"])
+            else:
+                match = _LATENCY_EXPR.match(expr)
+                if not match:
+                    continue
+                slo = SLORule(name, "latency_quantile", match["window"], float(match["threshold"]), quantile=float(match["quantile"]))
+            if slo.window not in windows:
+                print(f"Skipping SLO rule {name}: no {slo.window} rolling window")
+                continue
+            # Same alert repeated across groups: keep the first definition
+            rules.setdefault(name, slo)
+    return list(rules.values())
+
+
+_slo_rules: Optional[List[SLORule]] = None
+_slo_aggregator: Optional[SLOAggregator] = None
+
+def get_slo_rules() -> List[SLORule]:
+    """Thresholds from rules/alerts.yml, loaded once."""
+    global _slo_rules
+    if _slo_rules is None:
+        try:
+            _slo_rules = load_slo_rules()
+        except Exception as e:
+            print(f"Error loading SLO rules: {e}")
+            _slo_rules = []
+    return _slo_rules
+
+def get_slo_aggregator() -> SLOAggregator:
+    """Get the aggregator fed by PrometheusMiddleware."""
+    global _slo_aggregator
+    if _slo_aggregator is None:
+        _slo_aggregator = SLOAggregator()
+    return _slo_aggregator
@@ -0,0 +1,316 @@
+"""
+Registry snapshots and deltas with a compact binary encoding.
+
+``take_snapshot(registry)`` captures every sample of a registry without going
+through the text format: label sets are interned (one entry per distinct
+label set, label names and values in a shared string table) and values are a
+packed ``array('d')``. ``diff_snapshots(previous, current)`` keeps only the
+series that are new or changed, plus the keys of removed series, and
+``apply()`` folds such a delta back into a full snapshot.
+
+Uses: diffing metric state in tests, shipping deltas to an aggregator,
+persisting registry state.
+
+Binary layout (little endian, ``encode()`` / ``RegistrySnapshot.decode()``)::
+
+    header   "<4sBB2xdIIIIIII": magic, version, flags, timestamp, string count,
+             string bytes, family count, label set count, label pair count,
+             series count, removed count
+    strings  u32 lengths, then the utf-8 bytes
+    families u32 (name, type, documentation) string ids per family
+    labels   u32 offsets (label set count + 1) into u32 (name, value) pairs
+    series   u32 (family, sample name, label set) per series
+    values   f64 per series
+    removed  u32 (sample name, label set) per removed series (deltas only)
+"""
+import struct
+import sys
+import time
+from array import array
+from typing import Collection, Dict, Iterator, List, NamedTuple, Optional, Sequence, Tuple
+
+from prometheus_client.core import Metric
+from prometheus_client.samples import Sample
+
+Labels = Tuple[Tuple[str, str], ...]
+SeriesKey = Tuple[str, Labels]
+
+MAGIC = b"PMSN"
+VERSION = 1
+FLAG_DELTA = 0x01
+_HEADER = struct.Struct("<4sBB2xdIIIIIII")
+_BIG_ENDIAN = sys.byteorder == "big"
+
+
+class FamilyInfo(NamedTuple):
+    name: str
+    type: str
+    documentation: str
+
+
+class RegistrySnapshot:
+    """
+    Columnar capture of registry samples. Series ``i`` is
+    ``(series[i] family, sample name, label set)`` with value ``values[i]``.
+    """
+
+    __slots__ = ("timestamp", "families", "labelsets", "series", "values", "removed", "is_delta", "_index")
+
+    def __init__(
+        self,
+        timestamp: float,
+        families: Sequence[FamilyInfo] = (),
+        labelsets: Sequence[Labels] = (),
+        series: Sequence[Tuple[int, str, int]] = (),
+        values: Optional[array] = None,
+        removed: Sequence[SeriesKey] = (),
+        is_delta: bool = False,
+    ):
+        self.timestamp = timestamp
+        self.families = list(families)
+        self.labelsets = list(labelsets)
+        self.series = list(series)
+        self.values = values if values is not None else array("d")
+        self.removed = list(removed)
+        self.is_delta = is_delta
+        self._index: Optional[Dict[SeriesKey, int]] = None
+
+    def __len__(self) -> int:
+        return len(self.series)
+
+    @property
+    def index(self) -> Dict[SeriesKey, int]:
+        """Series key -> position, built on first use."""
+        if self._index is None:
+            labelsets = self.labelsets
+            self._index = {(name, labelsets[ls]): i for i, (_, name, ls) in enumerate(self.series)}
+        return self._index
+
+    def get_sample_value(self, name: str, labels: Optional[Dict[str, str]] = None) -> Optional[float]:
+        """Same contract as ``CollectorRegistry.get_sample_value``."""
+        i = self.index.get((name, tuple(sorted((labels or {}).items()))))
+        return None if i is None else self.values[i]
+
+    def items(self) -> Iterator[Tuple[str, Dict[str, str], float]]:
+        labelsets = self.labelsets
+        for (_, name, ls), value in zip(self.series, self.values):
+            yield name, dict(labelsets[ls]), value
+
+    def to_families(self) -> List[Metric]:
+        """Rebuild metric families (e.g. to expose or restore a snapshot)."""
+        families = [Metric(info.name, info.documentation, info.type) for info in self.families]
+        labelsets = self.labelsets
+        for (family, name, ls), value in zip(self.series, self.values):
+            families[family].samples.append(Sample(name, dict(labelsets[ls]), value))
+        return families
+
+    def apply(self, delta: "RegistrySnapshot") -> "RegistrySnapshot":
+        """Return a new full snapshot: this one with ``delta`` applied."""
+        builder = _Builder(delta.timestamp)
+        removed = set(delta.removed)
+        changed = delta.index
+        for (family, name, ls), value in zip(self.series, self.values):
+            key = (name, self.labelsets[ls])
+            if key in removed:
+                continue
+            i = changed.get(key)
+            if i is not None:
+                value = delta.values[i]
+            builder.add(self.families[family], name, key[1], value)
+        for (family, name, ls), value in zip(delta.series, delta.values):
+            key = (name, delta.labelsets[ls])
+            if key not in self.index:
+                builder.add(delta.families[family], name, key[1], value)
+        return builder.build()
+
+    def encode(self) -> bytes:
+        strings: Dict[str, int] = {}
+
+        def sid(value: str) -> int:
+            i = strings.get(value)
+            if i is None:
+                i = strings[value] = len(strings)
+            return i
+
+        family_ids = array("I")
+        for info in self.families:
+            family_ids.extend((sid(info.name), sid(info.type), sid(info.documentation)))
+        offsets = array("I", [0])
+        pairs = array("I")
+        for labels in self.labelsets:
+            for name, value in labels:
+                pairs.append(sid(name))
+                pairs.append(sid(value))
+            offsets.append(len(pairs) // 2)
+        series = array("I")
+        for family, name, ls in self.series:
+            series.extend((family, sid(name), ls))
+        removed = array("I")
+        if self.removed:
+            # Removed keys may use label sets that no longer exist in this snapshot
+            extra: Dict[Labels, int] = {}
+            for name, labels in self.removed:
+                ls = extra.get(labels)
+                if ls is None:
+                    ls = extra[labels] = len(offsets) - 1
+                    for label_name, label_value in labels:
+                        pairs.append(sid(label_name))
+                        pairs.append(sid(label_value))
+                    offsets.append(len(pairs) // 2)
+                removed.extend((sid(name), ls))
+
+        encoded = [s.encode("utf-8") for s in strings]
+        lengths = array("I", (len(s) for s in encoded))
+        blob = b"".join(encoded)
+        values = array("d", self.values)
+        columns = [lengths, family_ids, offsets, pairs, series, values, removed]
+        if _BIG_ENDIAN:
+            for column in columns:
+                column.byteswap()
+        header = _HEADER.pack(
+            MAGIC, VERSION, FLAG_DELTA if self.is_delta else 0, self.timestamp,
+            len(encoded), len(blob), len(self.families), len(offsets) - 1,
+            len(pairs) // 2, len(self.series), len(removed) // 2,
+        )
+        return b"".join([header, lengths.tobytes(), blob] + [c.tobytes() for c in columns[1:]])
+
+    @classmethod
+    def decode(cls, data: bytes) -> "RegistrySnapshot":
+        view = memoryview(data)
+        try:
+            (magic, version, flags, timestamp, n_strings, blob_len, n_families,
+             n_labelsets, n_pairs, n_series, n_removed) = _HEADER.unpack_from(view, 0)
+        except struct.error as e:
+            raise ValueError(f"Truncated snapshot: {e}")
+        if magic != MAGIC:
+            raise ValueError("Not a registry snapshot")
+        if version != VERSION:
+            raise ValueError(f"Unsupported snapshot version: {version}")
+
+        pos = _HEADER.size
+
+        def column(typecode: str, count: int) -> array:
+            nonlocal pos
+            values = array(typecode)
+            size = values.itemsize * count
+            if pos + size > len(view):
+                raise ValueError("Truncated snapshot")
+            values.frombytes(view[pos:pos + size])
+            if _BIG_ENDIAN:
+                values.byteswap()
+            pos += size
+            return values
+
+        lengths = column("I", n_strings)
+        if pos + blob_len > len(view):
+            raise ValueError("Truncated snapshot")
+        blob = bytes(view[pos:pos + blob_len])
+        pos += blob_len
+        strings = []
+        start = 0
+        for length in lengths:
+            strings.append(blob[start:start + length].decode("utf-8"))
+            start += length
+
+        family_ids = column("I", 3 * n_families)
+        offsets = column("I", n_labelsets + 1)
+        pairs = column("I", 2 * n_pairs)
+        series_ids = column("I", 3 * n_series)
+        values = column("d", n_series)
+        removed_ids = column("I", 2 * n_removed)
+
+        families = [
+            FamilyInfo(strings[family_ids[i]], strings[family_ids[i + 1]], strings[family_ids[i + 2]])
+            for i in range(0, len(family_ids), 3)
+        ]
+        labelsets = [
+            tuple((strings[pairs[2 * p]], strings[pairs[2 * p + 1]]) for p in range(offsets[i], offsets[i + 1]))
+            for i in range(n_labelsets)
+        ]
+        series = [
+            (series_ids[i], strings[series_ids[i + 1]], series_ids[i + 2])
+            for i in range(0, len(series_ids), 3)
+        ]
+        removed = [
+            (strings[removed_ids[i]], labelsets[removed_ids[i + 1]])
+            for i in range(0, len(removed_ids), 2)
+        ]
+        return cls(timestamp, families, labelsets, series, values, removed, bool(flags & FLAG_DELTA))
+
+
+class _Builder:
+    """Interns families and label sets while a snapshot is assembled."""
+
+    def __init__(self, timestamp: float, is_delta: bool = False):
+        self.timestamp = timestamp
+        self.is_delta = is_delta
+        self.families: List[FamilyInfo] = []
+        self.family_ids: Dict[FamilyInfo, int] = {}
+        self.labelsets: List[Labels] = []
+        self.labelset_ids: Dict[Labels, int] = {}
+        self.series: List[Tuple[int, str, int]] = []
+        self.values = array("d")
+        self.removed: List[SeriesKey] = []
+
+    def family(self, info: FamilyInfo) -> int:
+        i = self.family_ids.get(info)
+        if i is None:
+            i = self.family_ids[info] = len(self.families)
+            self.families.append(info)
+        return i
+
+    def add(self, info: FamilyInfo, name: str, labels: Labels, value: float) -> None:
+        ls = self.labelset_ids.get(labels)
+        if ls is None:
+            ls = self.labelset_ids[labels] = len(self.labelsets)
+            self.labelsets.append(labels)
+        self.series.append((self.family(info), name, ls))
+        self.values.append(value)
+
+    def build(self) -> RegistrySnapshot:
+        return RegistrySnapshot(
+            self.timestamp, self.families, self.labelsets, self.series, self.values,
+            self.removed, self.is_delta,
+        )
+
+
+def take_snapshot(
+    registry=None,
+    timestamp: Optional[float] = None,
+    types: Optional[Collection[str]] = None,
+) -> RegistrySnapshot:
+    """
+    Capture every sample of ``registry`` (default: the metric registry), or
+    only those of families whose type is in ``types``.
+    """
+    if registry is None:
+        from app.core.prometheus.metrics import get_metric_registry
+        registry = get_metric_registry()
+    builder = _Builder(time.time() if timestamp is None else timestamp)
+    for metric in registry.collect():
+        if types is not None and metric.type not in types:
+            continue
+        info = FamilyInfo(metric.name, metric.type, metric.documentation)
+        for sample in metric.samples:
+            builder.add(info, sample.name, tuple(sorted(sample.labels.items())), sample.value)
+    return builder.build()
+
+
+def diff_snapshots(previous: RegistrySnapshot, current: RegistrySnapshot) -> RegistrySnapshot:
+    """
+    Delta from ``previous`` to ``current``: series that are new or whose value
+    changed, and the keys of series that disappeared (``removed``).
+    """
+    builder = _Builder(current.timestamp, is_delta=True)
+    old_index = previous.index
+    old_values = previous.values
+    labelsets = current.labelsets
+    for (family, name, ls), value in zip(current.series, current.values):
+        key = (name, labelsets[ls])
+        i = old_index.get(key)
+        # NaN != NaN: an unchanged NaN is not reported as a change
+        if i is None or (old_values[i] != value and not (value != value and old_values[i] != old_values[i])):
+            builder.add(current.families[family], name, key[1], value)
+    current_index = current.index
+    builder.removed = [key for key in old_index if key not in current_index]
+    return builder.build()
@@ -0,0 +1,227 @@
+"""
+SQLAlchemy engine and pool instrumentation.
+
+``instrument_engine(engine)`` populates the database metrics for one engine
+(sync ``Engine`` or ``AsyncEngine``) without touching query code:
+
+- statements: before/after_cursor_execute events count and time each
+  statement in db_operations_total / db_operation_duration_seconds with
+  ``operation`` select, insert, update, delete or other; failed statements
+  (handle_error) are counted as ``error``
+- commits and rollbacks: counted and timed as ``commit`` / ``rollback``;
+  the rollback the pool issues when a connection is returned mid-transaction
+  is recorded as ``reset``
+- pool checkout wait: time spent in ``pool.connect()`` (waiting for a free
+  connection, plus opening one when the pool grows) in
+  db_pool_checkout_wait_seconds, separate from query time
+- db_connections{state="active"}: connections checked out, kept up to date
+  by the pool checkout/checkin events (summed across worker processes)
+- db_pool_connections: size, checked_in, checked_out and overflow read from
+  the pool by the ConnectionPoolCollector only when scraped (summed over
+  the engines sharing a db_type)
+
+The engine has no "after commit" or "before checkout" event, so commits,
+rollbacks and checkouts are timed by wrapping ``do_commit`` /
+``do_rollback`` on this engine's dialect and ``connect`` on its pool (both
+per-engine instances; the pool is re-wrapped after ``engine.dispose()``).
+``db_type`` defaults to the dialect name (postgresql, sqlite, ...).
+"""
+import threading
+from time import perf_counter
+from typing import Any, Dict, Optional
+
+from sqlalchemy import event
+
+from app.core.prometheus.exemplars import attach_exemplar, exemplars_enabled
+from app.core.prometheus.metrics import (
+    bind,
+    get_connection_metrics,
+    get_connection_pools,
+    get_db_count,
+    get_db_latency,
+    get_db_pool_wait,
+    get_db_sketch,
+    get_recorder,
+)
+
+STATEMENT_OPERATIONS = ("select", "insert", "update", "delete")
+OPERATIONS = STATEMENT_OPERATIONS + ("other", "commit", "rollback", "reset", "error")
+_START_KEY = "_prometheus_start"
+
+# Pool method -> db_pool_connections state
+POOL_STATES = (
+    ("size", "size"),
+    ("checkedin", "checked_in"),
+    ("checkedout", "checked_out"),
+    ("overflow", "overflow"),
+)
+
+
+def statement_operation(statement: str) -> str:
+    """The ``operation`` label for a SQL statement (its leading keyword)."""
+    keyword = statement.lstrip()[:6].lower()
+    return keyword if keyword in STATEMENT_OPERATIONS else "other"
+
+
+def pool_states(pool: Any) -> Dict[str, float]:
+    """
+    The states a pool can report (QueuePool reports all of them). Only methods
+    are read: e.g. SingletonThreadPool, the default for in-memory SQLite,
+    has an int ``size`` attribute instead.
+    """
+    states = {}
+    for method, state in POOL_STATES:
+        reader = getattr(pool, method, None)
+        if callable(reader):
+            states[state] = reader()
+    return states
+
+
+class SQLAlchemyInstrumentation:
+    """Event listeners and wrappers recording one engine; see ``instrument_engine()``."""
+
+    def __init__(self, engine: Any, db_type: Optional[str] = None):
+        self.engine = getattr(engine, "sync_engine", engine)
+        self.db_type = db_type or self.engine.dialect.name
+        self._recorder = get_recorder()
+        count = bind(get_db_count())
+        latency = bind(get_db_latency())
+        sketch = bind(get_db_sketch())
+        self._count = {operation: count.child(operation) for operation in OPERATIONS}
+        self._latency = {operation: latency.child(operation) for operation in OPERATIONS}
+        self._sketch = {operation: sketch.child(operation) for operation in OPERATIONS}
+        self._pool_wait = bind(get_db_pool_wait()).child(self.db_type)
+        self._active = get_connection_metrics().labels(self.db_type, "active")
+        self._originals: Dict[str, Any] = {}
+        self._exemplars = exemplars_enabled()
+        # Set by the rollback event, which fires right before an explicit rollback
+        self._local = threading.local()
+        self.installed = False
+
+    def _record(self, operation: str, duration: float) -> None:
+        self._recorder.inc(self._count[operation])
+        latency = self._latency[operation]
+        self._recorder.observe(latency, duration)
+        if self._exemplars:
+            attach_exemplar(latency, duration)
+        self._sketch[operation].observe(duration)
+
+    # -- event handlers -----------------------------------------------------
+
+    def before_cursor_execute(self, conn, cursor, statement, parameters, context, executemany) -> None:
+        if context is not None:
+            setattr(context, _START_KEY, perf_counter())
+
+    def after_cursor_execute(self, conn, cursor, statement, parameters, context, executemany) -> None:
+        start = getattr(context, _START_KEY, None)
+        if start is not None:
+            self._record(statement_operation(statement), perf_counter() - start)
+
+    def handle_error(self, exception_context) -> None:
+        self._recorder.inc(self._count["error"])
+
+    def rollback(self, conn) -> None:
+        self._local.explicit_rollback = True
+
+    def checkout(self, dbapi_connection, connection_record, connection_proxy) -> None:
+        self._active.inc()
+
+    def checkin(self, dbapi_connection, connection_record) -> None:
+        self._active.dec()
+
+    def engine_disposed(self, engine) -> None:
+        # dispose() replaces the pool: wrap the new one
+        self._wrap_pool()
+
+    # -- wrappers -----------------------------------------------------------
+
+    def _timed_commit(self, do_commit: Any) -> Any:
+        def timed(dbapi_connection):
+            start = perf_counter()
+            try:
+                return do_commit(dbapi_connection)
+            finally:
+                self._record("commit", perf_counter() - start)
+        return timed
+
+    def _timed_rollback(self, do_rollback: Any) -> Any:
+        local = self._local
+
+        def timed(dbapi_connection):
+            explicit = local.__dict__.pop("explicit_rollback", False)
+            start = perf_counter()
+            try:
+                return do_rollback(dbapi_connection)
+            finally:
+                self._record("rollback" if explicit else "reset", perf_counter() - start)
+        return timed
+
+    def _wrap_pool(self) -> None:
+        pool = self.engine.pool
+        connect = pool.connect
+        recorder = self._recorder
+        pool_wait = self._pool_wait
+
+        def timed_connect():
+            start = perf_counter()
+            try:
+                return connect()
+            finally:
+                recorder.observe(pool_wait, perf_counter() - start)
+
+        pool.connect = timed_connect
+        self._originals["pool"] = pool
+
+    # -- wiring -------------------------------------------------------------
+
+    def _events(self):
+        return (
+            (self.engine, "before_cursor_execute", self.before_cursor_execute),
+            (self.engine, "after_cursor_execute", self.after_cursor_execute),
+            (self.engine, "handle_error", self.handle_error),
+            (self.engine, "rollback", self.rollback),
+            (self.engine, "engine_disposed", self.engine_disposed),
+            (self.engine.pool, "checkout", self.checkout),
+            (self.engine.pool, "checkin", self.checkin),
+        )
+
+    def install(self) -> None:
+        if self.installed:
+            return
+        for target, name, handler in self._events():
+            event.listen(target, name, handler)
+        dialect = self.engine.dialect
+        for method, wrap in (("do_commit", self._timed_commit), ("do_rollback", self._timed_rollback)):
+            self._originals[method] = dialect.__dict__.get(method)
+            setattr(dialect, method, wrap(getattr(dialect, method)))
+        self._wrap_pool()
+        get_connection_pools().register_pool(
+            self.db_type, lambda: pool_states(self.engine.pool), key=self.engine
+        )
+        self.installed = True
+
+    def uninstall(self) -> None:
+        if not self.installed:
+            return
+        for target, name, handler in self._events():
+            if event.contains(target, name, handler):
+                event.remove(target, name, handler)
+        dialect = self.engine.dialect
+        for method in ("do_commit", "do_rollback"):
+            original = self._originals.pop(method, None)
+            if original is None:
+                delattr(dialect, method)
+            else:
+                setattr(dialect, method, original)
+        pool = self._originals.pop("pool", None)
+        if pool is not None:
+            del pool.connect
+        get_connection_pools().unregister_pool(self.db_type, key=self.engine)
+        self.installed = False
+
+
+def instrument_engine(engine: Any, db_type: Optional[str] = None) -> SQLAlchemyInstrumentation:
+    """Record statement, commit/rollback and pool metrics for ``engine``."""
+    instrumentation = SQLAlchemyInstrumentation(engine, db_type)
+    instrumentation.install()
+    return instrumentation
@@ -16,31 +16,39 @@ def safe_get_counter_value(counter: Counter, labels: Dict[str, str] = None) -> f
         The counter value or 0.0 if not available
     """
     try:
-        if labels:
-            # Try to get labeled counter value using .labels()
-            labeled_counter = counter.labels(**labels)
-            if hasattr(labeled_counter, '_value'):
-                # MutexValue stores the count internally
-                return labeled_counter._value.get()
-            else:
-                # Try to get using sample values
-                for sample in counter.collect()[0].samples:
-                    matches = True
-                    for label_name, label_value in labels.items():
-                        if sample.labels.get(label_name) != label_value:
-                            matches = False
-                            break
-                    if matches:
-                        return sample.value
-                return 0.0
-        else:
-            # For unlabeled counters
-            if hasattr(counter, '_value'):
-                return counter._value.get()
-            return 0.0
+        labels = labels or {}
+        for metric in counter.collect():
+            for sample in metric.samples:
+                # Skip the _created sample exported next to each _total
+                if sample.name != metric.name + '_total' and sample.name != metric.name:
+                    continue
+                if all(sample.labels.get(k) == v for k, v in labels.items()):
+                    return sample.value
+        return 0.0
     except Exception:
         return 0.0
         
+def get_quantile(sketch: Any, q: float, labels: Dict[str, str] = None) -> float:
+    """
+    Read a quantile from a QuantileSketch in-process.
+    
+    Args:
+        sketch: The QuantileSketch metric
+        q: Quantile between 0 and 1
+        labels: Optional dict of labels
+    
+    Returns:
+        The quantile value or NaN if nothing was observed for these labels
+    """
+    try:
+        if labels:
+            # A read must not create a series (or spend cardinality budget)
+            child = sketch.get(**labels)
+            return child.quantile(q) if child is not None else float('nan')
+        return sketch.quantile(q)
+    except Exception:
+        return float('nan')
+        
 def get_counter_labels(counter: Counter) -> Dict[str, Any]:
     """
     Safely get all labels used in a counter.